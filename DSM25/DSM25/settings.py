@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -80,7 +81,8 @@ WSGI_APPLICATION = 'DSM25.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        # DSM25_DB_PATH points a process at another database (benchmark runs, scratch copies)
+        'NAME': os.environ.get('DSM25_DB_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
@@ -126,4 +128,7 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-LOGIN_REDIRECT_URL = '/management/'
\ No newline at end of file
+LOGIN_REDIRECT_URL = '/management/'
+
+# Fitted model artifacts (risk scaler/IsolationForest, note classifier), one versioned dir each
+ARTIFACTS_DIR = Path(os.environ.get('DSM25_ARTIFACTS_DIR', BASE_DIR / 'artifacts'))
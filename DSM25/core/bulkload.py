@@ -0,0 +1,141 @@
+"""
+SQLite bulk-load mode shared by import_data, score_diabetes and note_classifier.
+
+Inside `bulk_load_mode(...)` the connection runs in WAL with synchronous=NORMAL
+(still crash-safe: a crash loses at most the last commits, never consistency),
+a large page cache and in-memory temp storage. Secondary indexes of the tables
+being loaded are dropped and rebuilt once at the end, followed by ANALYZE.
+The gain is modest: on the 100k benchmark dataset (`benchmark --sizes 100k
+--stages import_data --repeat 3 [--bulk-load]`) import_data takes 20.6s with
+it against 22.2s without, a median of three runs each.
+
+The original journal mode and the DDL of every dropped index are written to a
+journal file next to the database before anything changes. If the process
+dies mid-load, the next command that writes to the database (import_data,
+score_diabetes, note_classifier, compact_risk_scores, rebuild_latest_labs all
+call `recover_interrupted_load()` first) replays the journal; until then the
+tables lack those indexes and the database stays in WAL. A journal whose
+loading process is still alive is left alone.
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+TUNED_PRAGMAS = {
+    "synchronous": "NORMAL",
+    "cache_size": "-262144",  # 256 MiB
+    "temp_store": "MEMORY",
+}
+
+
+def _journal_path():
+    return f"{connection.settings_dict['NAME']}.bulkload.json"
+
+
+def _secondary_indexes(cursor, table):
+    # Explicit, non-unique indexes only: autoindexes back PK/UNIQUE constraints and
+    # unique indexes enforce correctness, so both stay in place.
+    cursor.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL",
+        [table],
+    )
+    return [(name, sql) for name, sql in cursor.fetchall() if not sql.upper().startswith("CREATE UNIQUE")]
+
+
+def _write_journal(state):
+    with open(_journal_path(), "w") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _loader_alive(pid):
+    # The database is a local file, so its loader ran on this host
+    if pid is None or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def recover_interrupted_load(log=print):
+    """
+    Put back what a bulk load that died mid-way changed (see module docstring);
+    one os.path.exists when there is nothing to do. Returns indexes rebuilt.
+    """
+    if connection.vendor != "sqlite" or not os.path.exists(_journal_path()):
+        return 0
+    with open(_journal_path()) as f:
+        if _loader_alive(json.load(f).get("pid")):
+            return 0
+    restored = restore_indexes()
+    log(f"Bulk load: recovered from an interrupted load ({restored} index(es) rebuilt)")
+    return restored
+
+
+def restore_indexes():
+    """
+    Undo the persistent changes of a bulk load: recreate dropped indexes and reset
+    the journal mode. Returns how many indexes were rebuilt (0 if nothing was pending).
+    """
+    path = _journal_path()
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        state = json.load(f)
+    with connection.cursor() as cursor:
+        for sql in state["indexes"].values():
+            cursor.execute(sql.replace("CREATE INDEX", "CREATE INDEX IF NOT EXISTS", 1))
+        cursor.execute(f"PRAGMA journal_mode = {state['journal_mode']}")
+    os.remove(path)
+    return len(state["indexes"])
+
+
+@contextmanager
+def bulk_load_mode(*models, drop_indexes=True, log=print):
+    """Tune the SQLite connection for a large load into `models`; a no-op on other backends."""
+    if connection.vendor != "sqlite":
+        yield
+        return
+
+    recover_interrupted_load(log)
+
+    tables = [m._meta.db_table for m in models]
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA journal_mode")
+        state = {"journal_mode": cursor.fetchone()[0], "indexes": {}, "pid": os.getpid()}
+        previous = {}
+        for pragma in TUNED_PRAGMAS:
+            cursor.execute(f"PRAGMA {pragma}")
+            previous[pragma] = cursor.fetchone()[0]
+        if drop_indexes:
+            for table in tables:
+                state["indexes"].update(_secondary_indexes(cursor, table))
+        _write_journal(state)
+
+        cursor.execute("PRAGMA journal_mode = WAL")
+        for pragma, value in TUNED_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+        for name in state["indexes"]:
+            cursor.execute(f"DROP INDEX IF EXISTS {connection.ops.quote_name(name)}")
+        if state["indexes"]:
+            log(f"Bulk load: dropped {len(state['indexes'])} secondary index(es) on {', '.join(tables)}")
+
+    try:
+        yield
+    finally:
+        start = time.perf_counter()
+        restore_indexes()
+        with connection.cursor() as cursor:
+            for table in tables:
+                cursor.execute(f"ANALYZE {connection.ops.quote_name(table)}")
+            for pragma, value in previous.items():
+                cursor.execute(f"PRAGMA {pragma} = {value}")
+        log(f"Bulk load: indexes rebuilt and tables analyzed in {time.perf_counter() - start:.2f}s")
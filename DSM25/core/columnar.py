@@ -0,0 +1,182 @@
+"""
+Columnar loader for patient_lab.csv (plain or compressed).
+
+The file is read in blocks of records (cut by core.ingest.split_records, so a
+block ends on a known decompressed byte offset) and each block is parsed in
+one C-level pass (np.loadtxt) into typed arrays; categorical columns are
+mapped through their distinct values and range checks run column-wise, so no
+Python code runs per row until the INSERT. Only a block that loadtxt cannot
+parse (a ragged row, a malformed index) is re-parsed with the csv module,
+which turns its bad rows into rejects instead of failing the load. Memory is
+bounded by the block size, not the file.
+
+Parsing is only a modest win: on the 25k-row sample, parse + validation takes
+~0.13s against ~0.34s for the csv-module batches of the bulk path. loadtxt's
+float conversion sets that floor. pandas' C reader is faster only with its
+approximate float parsing, which differs from float() in the last bit for
+about 4% of values. Most of the lab-load speedup (~3.2s -> ~0.4s) comes from
+writing the arrays with executemany instead of building model instances.
+"""
+import csv
+import io
+
+import numpy as np
+
+from core.ingest import batched, open_source, skip_to, split_records
+from risk.features import ACTIVITY_MAP
+
+LAB_NUMERIC = [
+    "Age", "BMI", "Systolic_BP", "Diastolic_BP",
+    "Total_Cholesterol", "HDL_Cholesterol", "LDL_Cholesterol", "Triglycerides",
+]
+
+# Plausibility bounds; wide on purpose, they catch unit mix-ups and garbage, not outliers
+LAB_RANGES = {
+    "Age": (0, 120),
+    "BMI": (5, 100),
+    "Systolic_BP": (40, 300),
+    "Diastolic_BP": (20, 200),
+    "Total_Cholesterol": (20, 1000),
+    "HDL_Cholesterol": (1, 300),
+    "LDL_Cholesterol": (1, 800),
+    "Triglycerides": (1, 5000),
+}
+
+SMOKING_MAP = {"smoker": 1, "non-smoker": 0, "": 0}
+
+TEXT_COLUMNS = {"Smoking_Status", "Physical_Activity_Level"}
+
+# Width of the text columns' arrays; the longest valid value has 10 characters, so a
+# value filling the width (possibly truncated by it) is never a known category
+TEXT_WIDTH = 16
+
+
+def lookup(values, mapping):
+    """Map a string column through `mapping` via its distinct values; unknown values -> -1."""
+    uniq, inverse = np.unique(values, return_inverse=True)
+    table = np.array([mapping.get(str(u).strip().lower(), -1) if len(u) < TEXT_WIDTH else -1 for u in uniq],
+                     dtype=np.int8)
+    return table[inverse.reshape(-1)]
+
+
+def _dtype(names):
+    # Numbers as float (NaN-able), the index as int, everything else as short text
+    return [
+        (name, "i8" if name == "ref" else "f8" if name in LAB_NUMERIC else f"U{TEXT_WIDTH}")
+        for name in names
+    ]
+
+
+def _parse_block(text, names, count):
+    """
+    Typed columns for one block of `count` CSV records, plus each row's field count.
+    Falls back to the csv module when loadtxt rejects the block: cells that do not
+    parse become NaN and a row with the wrong number of fields is left empty.
+    """
+    try:
+        data = np.loadtxt(io.StringIO(text), delimiter=",", dtype=_dtype(names), quotechar='"',
+                          comments=None, ndmin=1)
+        if len(data) == count:
+            return {name: data[name] for name in names}, np.full(count, len(names))
+    except ValueError:
+        pass
+
+    rows = list(csv.reader(io.StringIO(text, newline="")))
+    cols = {
+        name: np.full(len(rows), "", dtype=dtype) if dtype.startswith("U") else np.full(len(rows), np.nan)
+        for name, dtype in _dtype(names)
+    }
+    widths = np.array([len(row) for row in rows], dtype=np.int64)
+    for i, row in enumerate(rows):
+        if len(row) != len(names):
+            row = row[:1]  # only the index is reported for a ragged row
+        for name, value in zip(names, row):
+            if cols[name].dtype.kind == "U":
+                cols[name][i] = value
+                continue
+            try:
+                cols[name][i] = float(value)
+            except ValueError:
+                pass
+    return cols, widths
+
+
+def _validate(raw, widths):
+    """Split one parsed block into (valid columns, rejects), rows given by their position in the block."""
+    n = len(widths)
+    ref = np.asarray(raw["ref"], dtype=np.float64)
+    smoking = lookup(raw["Smoking_Status"], SMOKING_MAP)
+    activity = lookup(raw["Physical_Activity_Level"], ACTIVITY_MAP)
+    ragged = widths != len(raw)
+
+    checks = [("missing or malformed index", ~np.isfinite(ref))]
+    for name in LAB_NUMERIC:
+        lo, hi = LAB_RANGES[name]
+        values = raw[name]
+        checks.append((f"{name} missing or outside [{lo}, {hi}]", ~((values >= lo) & (values <= hi))))
+    checks.append(("unknown Smoking_Status", smoking < 0))
+    checks.append(("unknown Physical_Activity_Level", activity < 0))
+
+    bad = ragged.copy()
+    for _, mask in checks:
+        bad |= mask
+    rejects = []
+    for i in np.flatnonzero(bad):
+        if ragged[i]:
+            reasons = f"expected {len(raw)} fields, found {widths[i]}"
+        else:
+            reasons = "; ".join(reason for reason, mask in checks if mask[i])
+        rejects.append((int(i), int(ref[i]) if np.isfinite(ref[i]) else "", reasons))
+
+    ok = ~bad
+    columns = {
+        "row": np.flatnonzero(ok),
+        "ref": ref[ok].astype(np.int64),
+        "Age": raw["Age"][ok].astype(np.int64),
+        **{name: raw[name][ok] for name in LAB_NUMERIC[1:]},
+        "Smoking_status": smoking[ok].astype(bool),
+        "Physical_activity": raw["Physical_Activity_Level"][ok],
+        "activity_level": activity[ok],
+    }
+    return columns, rejects
+
+
+def lab_blocks(path, block_size, offset=0, rows_before=0):
+    """
+    Read a patient_lab CSV `block_size` records at a time, starting at decompressed byte
+    `offset` after `rows_before` data rows, and validate each block.
+
+    Yields (columns, rejects, records, end_offset) per block: `columns` holds only the
+    valid rows ("ref", the Patient_lab field values, plus "row" and "activity_level"),
+    `rejects` is a list of (row_number, ref, reason) for every row that failed
+    validation, `records` the source rows the block consumed.
+    """
+    with open_source(path) as f:
+        header_line = f.readline()
+        header = next(csv.reader([header_line.decode("utf-8-sig")]))
+        missing = [c for c in ["", *LAB_NUMERIC, *TEXT_COLUMNS] if c not in header]
+        if missing:
+            raise ValueError(f"{path} is missing columns: {', '.join(repr(c) for c in missing)}")
+        names = ["ref" if name == "" else name for name in header]
+
+        pos = len(header_line)
+        if offset > pos:
+            skip_to(f, pos, offset)
+            pos = offset
+        row = rows_before + 1
+        for block in batched(split_records(f, pos), block_size):
+            # Blank lines carry no row; they still count as consumed
+            records = [(raw, n) for n, (raw, _) in enumerate(block) if raw.strip()]
+            if records:
+                text = b"".join(raw for raw, _ in records).decode("utf-8")
+                raw, widths = _parse_block(text, names, len(records))
+            else:
+                raw = {name: np.empty(0, dtype=dtype) for name, dtype in _dtype(names)}
+                widths = np.empty(0, dtype=np.int64)
+            columns, rejects = _validate(raw, widths)
+            # Block positions of the non-blank records -> file row numbers
+            numbers = np.array([row + n for _, n in records], dtype=np.int64)
+            columns["row"] = numbers[columns["row"]]
+            rejects = [(int(numbers[i]), ref, reason) for i, ref, reason in rejects]
+            yield columns, rejects, len(block), block[-1][1]
+            row += len(block)
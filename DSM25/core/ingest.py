@@ -0,0 +1,227 @@
+"""
+Source-file parsing for import_data.
+
+Nothing in here touches the ORM, so worker processes can import it without
+Django being set up. Rows come out as (ref, fields, digest) tuples: `ref` is
+the raw value of the CSV's unnamed index column, `fields` the model field
+values, `digest` the content fingerprint (or None when not requested).
+"""
+import bz2
+import csv
+import glob
+import gzip
+import hashlib
+import io
+import lzma
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+# Common prefixes/suffixes
+SUFFIXES = ["MR.", "MRS.", "MS.", "DR.", "MISS", "MR", "MRS", "MS", "DR"]
+SUFFIX_KEYS = {s.replace('.', '') for s in SUFFIXES}
+
+CUSTOMER_FIELDS = ['CustFirstName', 'CustLastName', 'CustMiddleInit', 'CustSuffix', 'Gender']
+NOTE_FIELDS = ['Description', 'Medical_specialty', 'Sample_name', 'Transcription', 'Keywords']
+
+
+def clean_name(name):
+    # Remove extra spaces and normalize case
+    name = name.strip()
+    parts = name.split()
+    suffix = ""
+    # Check for prefix/suffix
+    if parts and parts[0].replace('.', '').upper() in SUFFIX_KEYS:
+        suffix = parts[0].title().replace('.', '')
+        parts = parts[1:]
+    # If still more than 2 parts, assume first is first name, last is last name, middle is middle initial
+    first = parts[0].title() if len(parts) > 0 else ""
+    last = parts[-1].title() if len(parts) > 1 else ""
+    middle = parts[1][0].upper() if len(parts) > 2 and parts[1] else ""
+    return first, last, middle, suffix
+
+
+def patient_ref(index):
+    # The first column is the index, which should match the Customer's Cust_id (starting from 1)
+    try:
+        return int(index) + 1
+    except Exception:
+        return None
+
+
+def customer_fields(row):
+    first, last, middle, suffix = clean_name(row.get('Name', ''))
+    return dict(
+        CustFirstName=first,
+        CustLastName=last,
+        CustMiddleInit=middle,
+        CustSuffix=suffix,
+        Gender=row.get('Gender', '').title(),
+    )
+
+
+def lab_fields(row):
+    # Convert Smoking_Status to boolean
+    smoking = row.get('Smoking_Status', '').strip().lower()
+    return dict(
+        Age=int(float(row.get('Age', 0))),
+        BMI=float(row.get('BMI', 0)),
+        Systolic_BP=float(row.get('Systolic_BP', 0)),
+        Diastolic_BP=float(row.get('Diastolic_BP', 0)),
+        Total_Cholesterol=float(row.get('Total_Cholesterol', 0)),
+        HDL_Cholesterol=float(row.get('HDL_Cholesterol', 0)),
+        LDL_Cholesterol=float(row.get('LDL_Cholesterol', 0)),
+        Triglycerides=float(row.get('Triglycerides', 0)),
+        Smoking_status=smoking == 'smoker',
+        Physical_activity=row.get('Physical_Activity_Level', ''),
+    )
+
+
+def note_fields(row):
+    return dict(
+        Description=row.get('description', ''),
+        Medical_specialty=row.get('medical_specialty', ''),
+        Sample_name=row.get('sample_name', ''),
+        Transcription=row.get('transcription', ''),
+        Keywords=row.get('keywords', ''),
+    )
+
+
+NORMALIZERS = {
+    'patient_info': customer_fields,
+    'patient_lab': lab_fields,
+    'notes': note_fields,
+}
+
+
+def row_digest(row):
+    # Content fingerprint of a source row (all columns, in file order)
+    h = hashlib.blake2b(digest_size=16)
+    h.update('\x1f'.join(str(v) for v in row.values()).encode('utf-8'))
+    return h.hexdigest()
+
+
+def file_signature(path):
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def batched(iterable, size):
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def expand_sources(pattern):
+    """Files matching a path or glob, in name order (date-stamped shards sort chronologically)."""
+    return sorted(glob.glob(os.path.expanduser(pattern)))
+
+
+def open_source(path):
+    """Binary stream over a source file, decompressing .gz/.bz2/.xz/.zst on the fly."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    if path.endswith('.xz'):
+        return lzma.open(path, 'rb')
+    if path.endswith(('.zst', '.zstd')):
+        try:
+            from compression import zstd  # Python 3.14+
+            return zstd.open(path, 'rb')
+        except ImportError:
+            pass
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(f"Reading {path} needs Python 3.14+ or the 'zstandard' package")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return io.BufferedReader(reader)
+    return open(path, 'rb')
+
+
+def open_text(path):
+    return io.TextIOWrapper(open_source(path), encoding='utf-8', newline='')
+
+
+def skip_to(f, pos, offset, chunk=1 << 20):
+    """Advance stream `f` from `pos` to `offset` (decompressing and discarding if it cannot seek)."""
+    if f.seekable():
+        f.seek(offset)
+        return
+    while pos < offset:
+        data = f.read(min(chunk, offset - pos))
+        if not data:
+            break
+        pos += len(data)
+
+
+def split_records(f, offset):
+    """
+    Yield (raw_record, end_offset) from a binary CSV stream positioned at `offset`.
+    Records are cut on newlines outside quotes, so quoted multi-line fields stay
+    whole, without running the csv parser here.
+    """
+    pos = offset
+    record = []
+    quotes = 0
+    for line in f:
+        pos += len(line)
+        record.append(line)
+        quotes += line.count(b'"')
+        if quotes % 2 == 0:
+            yield b''.join(record), pos
+            record = []
+            quotes = 0
+    if record:
+        yield b''.join(record), pos
+
+
+def parse_batch(kind, header, raw, digests=False):
+    """Decode and normalize one batch of raw CSV records (runs in worker processes)."""
+    normalize = NORMALIZERS[kind]
+    reader = csv.DictReader(io.StringIO(raw.decode('utf-8'), newline=''), fieldnames=header)
+    return [(row.get(''), normalize(row), row_digest(row) if digests else None) for row in reader]
+
+
+def parsed_batches(kind, path, batch_size, workers=1, offset=0, digests=False):
+    """
+    Yield (rows, end_offset) per batch of `batch_size` records, in file order.
+    Compressed files are decompressed as they are read; offsets count
+    decompressed bytes.
+
+    With workers > 1, batches are parsed in a process pool; at most 2 * workers
+    batches are in flight, and results are yielded in submission order, so the
+    single consumer (the DB writer) sees exactly what a serial parse would give.
+    """
+    with open_source(path) as f:
+        header_line = f.readline()
+        header = next(csv.reader([header_line.decode('utf-8-sig')]))
+        pos = len(header_line)
+        if offset > pos:
+            skip_to(f, pos, offset)
+            pos = offset
+        raw_batches = (
+            (b''.join(raw for raw, _ in chunk), chunk[-1][1])
+            for chunk in batched(split_records(f, pos), batch_size)
+        )
+
+        if workers <= 1:
+            for raw, end in raw_batches:
+                yield parse_batch(kind, header, raw, digests), end
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for raw, end in raw_batches:
+                pending.append((pool.submit(parse_batch, kind, header, raw, digests), end))
+                if len(pending) >= 2 * workers:
+                    future, end_offset = pending.popleft()
+                    yield future.result(), end_offset
+            while pending:
+                future, end_offset = pending.popleft()
+                yield future.result(), end_offset
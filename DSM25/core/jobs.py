@@ -0,0 +1,217 @@
+"""
+DB-backed job queue for the management page.
+
+Views call `enqueue(...)` and return at once; `manage.py run_jobs` claims queued
+jobs and runs the management command in its own process. Commands report what
+they are doing through `progress(...)`, which is a no-op outside a job, so the
+same code runs unchanged from the shell.
+
+A running job's worker refreshes its heartbeat every HEARTBEAT_INTERVAL. A job
+whose worker is gone (a dead pid on this host, or no heartbeat for ORPHAN_AFTER
+from anywhere) is failed by `fail_orphans()`, which workers run while idle and
+`enqueue` runs before refusing a duplicate, so a crashed run never blocks the
+command for good.
+"""
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+from contextlib import redirect_stdout
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from core.models import Job
+
+# Commands the management page may queue, with the options it runs them with
+JOB_COMMANDS = {
+    "import_data": {"populate": True},
+    "score_diabetes": {},
+    "note_classifier": {"min_labels": 50},
+}
+
+PROGRESS_INTERVAL = 1.0  # seconds between progress writes
+HEARTBEAT_INTERVAL = 30  # seconds between heartbeats of a running job
+ORPHAN_AFTER = 300       # seconds without a heartbeat before a running job counts as orphaned
+OUTPUT_TAIL = 20000      # characters of stdout kept on the job row
+
+_current = ContextVar("current_job", default=None)
+
+
+class JobInFlight(Exception):
+    def __init__(self, job):
+        super().__init__(f"{job.Command} is already {job.Status} (job #{job.pk})")
+        self.job = job
+
+
+def enqueue(command, **options):
+    """Queue `command`; raises JobInFlight if one is already queued or running."""
+    if command not in JOB_COMMANDS:
+        raise ValueError(f"{command} cannot be run as a job")
+    try:
+        with transaction.atomic():
+            return Job.objects.create(Command=command, Options={**JOB_COMMANDS[command], **options})
+    except IntegrityError:
+        job = Job.objects.filter(Command=command, Status__in=Job.IN_FLIGHT).first()
+        # Finished between the insert and the lookup, or held by a dead worker
+        if job is None or (job.Status == Job.RUNNING and fail_orphans()):
+            return enqueue(command, **options)
+        raise JobInFlight(job)
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_next():
+    """Atomically move the oldest queued job to running; None if the queue is empty."""
+    while True:
+        job = Job.objects.filter(Status=Job.QUEUED).order_by("Created_at", "id").first()
+        if job is None:
+            return None
+        now = timezone.now()
+        # Compare-and-set on Status, so two workers never claim the same job
+        claimed = Job.objects.filter(pk=job.pk, Status=Job.QUEUED).update(
+            Status=Job.RUNNING, Started_at=now, Heartbeat_at=now, Worker=worker_name(),
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def fail_orphans():
+    """
+    Fail running jobs whose worker is gone: its process on this host has exited
+    (killed, crashed, rebooted), or, on any host, it sent no heartbeat for ORPHAN_AFTER.
+    """
+    host = socket.gethostname()
+    stale_before = timezone.now() - timedelta(seconds=ORPHAN_AFTER)
+    failed = 0
+    for job in Job.objects.filter(Status=Job.RUNNING):
+        if job.Heartbeat_at is None or job.Heartbeat_at < stale_before:
+            failed += _finish(job, Job.FAILED, error=f"No heartbeat from worker {job.Worker} for {ORPHAN_AFTER}s")
+            continue
+        if not job.Worker.startswith(f"{host}:"):
+            continue
+        pid = int(job.Worker.rsplit(":", 1)[1])
+        try:
+            os.kill(pid, 0)
+            continue
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            continue
+        failed += _finish(job, Job.FAILED, error="Worker process exited before the job finished")
+    return failed
+
+
+def _heartbeat(job, stop):
+    # Runs beside the command: long steps that never call progress() still show the worker is alive
+    try:
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                Job.objects.filter(pk=job.pk, Status=Job.RUNNING).update(Heartbeat_at=timezone.now())
+            except Exception:  # e.g. the command holds the SQLite write lock; try again next beat
+                pass
+    finally:
+        connection.close()
+
+
+def progress(done=None, total=None, step=None, force=False):
+    """
+    Report progress of the job running in this process. Writes are throttled to
+    one per PROGRESS_INTERVAL unless `force` (or the step changes).
+    """
+    state = _current.get()
+    if state is None:
+        return
+    if done is not None:
+        state["done"] = done
+    if total is not None:
+        state["total"] = total
+    if step is not None and step != state["step"]:
+        state["step"] = step
+        force = True
+    now = time.monotonic()
+    if not force and now - state["written"] < PROGRESS_INTERVAL:
+        return
+    state["written"] = now
+    Job.objects.filter(pk=state["job"].pk).update(
+        Step=state["step"][:100], Progress_done=state["done"], Progress_total=state["total"],
+        Heartbeat_at=timezone.now(),
+    )
+
+
+class _Tee:
+    # Echo the command's output to the worker's console while keeping a copy for the job row
+    def __init__(self, stream):
+        self.stream = stream
+        self.parts = []
+
+    def write(self, s):
+        self.parts.append(s)
+        return self.stream.write(s)
+
+    def flush(self):
+        self.stream.flush()
+
+    def getvalue(self):
+        return "".join(self.parts)
+
+
+def run(job):
+    """Run a claimed job to completion, recording its outcome; returns the final status."""
+    tee = _Tee(sys.stdout)
+    token = _current.set({"job": job, "done": 0, "total": None, "step": "", "written": 0.0})
+    stop = threading.Event()
+    beat = threading.Thread(target=_heartbeat, args=(job, stop), name=f"job-{job.pk}-heartbeat", daemon=True)
+    beat.start()
+    try:
+        with redirect_stdout(tee):
+            call_command(job.Command, stdout=tee, **job.Options)
+    except Exception:
+        _finish(job, Job.FAILED, tee.getvalue(), traceback.format_exc())
+    else:
+        _finish(job, Job.SUCCEEDED, tee.getvalue())
+    finally:
+        stop.set()
+        beat.join()
+        _current.reset(token)
+    return job.Status
+
+
+def _finish(job, status, output="", error=""):
+    now = timezone.now()
+    job.Status = status
+    job.Output = output[-OUTPUT_TAIL:]
+    job.Error = error
+    job.Finished_at = now
+    job.Heartbeat_at = now
+    job.Duration = (now - job.Started_at).total_seconds() if job.Started_at else None
+    job.save(update_fields=["Status", "Output", "Error", "Finished_at", "Heartbeat_at", "Duration"])
+    return 1
+
+
+def job_status(job):
+    """JSON-ready summary of a job for the status endpoint."""
+    duration = job.Duration
+    if duration is None and job.Started_at:
+        duration = (timezone.now() - job.Started_at).total_seconds()
+    return {
+        "id": job.pk,
+        "command": job.Command,
+        "status": job.Status,
+        "step": job.Step,
+        "done": job.Progress_done,
+        "total": job.Progress_total,
+        "created_at": job.Created_at.isoformat(),
+        "started_at": job.Started_at.isoformat() if job.Started_at else None,
+        "finished_at": job.Finished_at.isoformat() if job.Finished_at else None,
+        "duration": round(duration, 1) if duration is not None else None,
+        "error": job.Error.strip().splitlines()[-1] if job.Error.strip() else "",
+    }
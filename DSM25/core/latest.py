@@ -0,0 +1,70 @@
+"""
+Maintenance of the LatestLab pointer table (newest Patient_lab per patient).
+
+Single saves are handled by the Patient_lab signals below; bulk paths that
+bypass signals (bulk_create, raw executemany in import_data) call
+`advance_latest_labs(after_id)` in the same transaction as their insert, with
+the highest lab id that existed before it.
+"""
+from django.db import connection
+from django.db.models import Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.models import LatestLab, Patient_lab
+
+
+def _names():
+    qn = connection.ops.quote_name
+    return (
+        qn(LatestLab._meta.db_table), qn(Patient_lab._meta.db_table),
+        qn(LatestLab._meta.get_field("Patient_id").column), qn(LatestLab._meta.get_field("Lab").column),
+        qn(Patient_lab._meta.get_field("Patient_id").column),
+    )
+
+
+def lab_watermark():
+    """Highest Patient_lab id right now (0 for an empty table)."""
+    return Patient_lab.objects.aggregate(m=Max("id"))["m"] or 0
+
+
+def advance_latest_labs(after_id):
+    """Repoint every patient that has labs with id > after_id at its newest one (one set-based upsert)."""
+    latest, labs, patient_col, lab_col, lab_patient_col = _names()
+    with connection.cursor() as cursor:
+        # SQLite 3.24+ / PostgreSQL upsert; the WHERE keeps a pointer from ever moving backwards
+        cursor.execute(
+            f"INSERT INTO {latest} ({patient_col}, {lab_col}) "
+            f"SELECT {lab_patient_col}, MAX(id) FROM {labs} "
+            f"WHERE id > %s AND {lab_patient_col} IS NOT NULL GROUP BY {lab_patient_col} "
+            f"ON CONFLICT ({patient_col}) DO UPDATE SET {lab_col} = excluded.{lab_col} "
+            f"WHERE excluded.{lab_col} > {latest}.{lab_col}",
+            [after_id],
+        )
+        return cursor.rowcount
+
+
+def rebuild_latest_labs():
+    """Recompute the whole table from Patient_lab (backfills, repairs); returns the row count."""
+    LatestLab.objects.all().delete()
+    advance_latest_labs(0)
+    return LatestLab.objects.count()
+
+
+@receiver(post_save, sender=Patient_lab)
+def _lab_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and instance.Patient_id_id is not None:
+        advance_latest_labs(instance.pk - 1)
+
+
+@receiver(post_delete, sender=Patient_lab)
+def _lab_deleted(sender, instance, **kwargs):
+    # The pointer row cascades away with its lab; fall back to the patient's previous lab
+    if instance.Patient_id_id is None:
+        return
+    previous = (
+        Patient_lab.objects.filter(Patient_id=instance.Patient_id_id)
+        .exclude(pk=instance.pk).order_by("-id").values_list("id", flat=True).first()
+    )
+    if previous is not None:
+        LatestLab.objects.update_or_create(Patient_id_id=instance.Patient_id_id, defaults={"Lab_id": previous})
@@ -0,0 +1,59 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.synth import SPECIALTY_TERMS, generate
+from note.routing import keyword_route
+
+
+class Command(BaseCommand):
+    help = ("Write seeded synthetic patient_info.csv, patient_lab.csv and notes.csv (10k to 10M patients) "
+            "for import_data load and scaling tests. Labs follow the shipped sample's distributions.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--patients", type=int, default=10000, help="Number of patients (default 10000)")
+        parser.add_argument("--out", default=os.path.join(settings.BASE_DIR, "data", "synthetic"),
+                            help="Output directory (default data/synthetic)")
+        parser.add_argument("--seed", type=int, default=42, help="Same seed, same files (default 42)")
+        parser.add_argument("--sample", default=os.path.join(settings.BASE_DIR, "data", "raw_test", "patient_lab.csv"),
+                            help="patient_lab CSV whose distributions the labs follow (default: the shipped sample)")
+        parser.add_argument("--labs-per-patient", type=float, default=1.0,
+                            help="Mean labs per patient, at least 1 each (default 1.0)")
+        parser.add_argument("--notes-per-patient", type=float, default=0.5,
+                            help="Mean clinical notes per patient (default 0.5)")
+        parser.add_argument("--unlabeled", type=float, default=0.2,
+                            help="Fraction of notes with no medical_specialty, left for the classifier (default 0.2)")
+        parser.add_argument("--gzip", action="store_true", help="Write .csv.gz (import_data reads them directly)")
+
+    def handle(self, *args, **opts):
+        if opts["patients"] < 1:
+            raise CommandError("--patients must be >= 1")
+        if opts["labs_per_patient"] < 1:
+            raise CommandError("--labs-per-patient must be >= 1")
+        if not 0 <= opts["unlabeled"] <= 1:
+            raise CommandError("--unlabeled must be between 0 and 1")
+        if not os.path.exists(opts["sample"]):
+            raise CommandError(f"Lab sample {opts['sample']} not found")
+        # Keep the note vocabulary in step with the keyword router
+        for spec, terms in SPECIALTY_TERMS.items():
+            drifted = [t for t in terms if keyword_route(t)[0] != spec]
+            if drifted:
+                raise CommandError(f"{spec} terms no longer match note.routing.KEYWORDS: {drifted}")
+
+        start = time.perf_counter()
+
+        def on_block(done, rows):
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"  {done}/{opts['patients']} patients, {rows} rows ({rows / elapsed:,.0f} rows/sec)")
+
+        written = generate(
+            opts["out"], opts["patients"], seed=opts["seed"], sample=opts["sample"],
+            labs_per_patient=opts["labs_per_patient"], notes_per_patient=opts["notes_per_patient"],
+            unlabeled=opts["unlabeled"], gzip_output=opts["gzip"], on_block=on_block,
+        )
+        elapsed = time.perf_counter() - start
+        for table, (path, rows) in written.items():
+            self.stdout.write(f"{table}: {rows} rows, {os.path.getsize(path) / 1e6:.1f} MB -> {path}")
+        self.stdout.write(self.style.SUCCESS(f"Generated {opts['patients']} patients in {elapsed:.2f}s"))
@@ -1,143 +1,475 @@
-
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 import os
 import csv
-from core.models import Customer
+import time
+from contextlib import nullcontext
+import numpy as np
+from core.models import (
+    Customer, Patient_lab, Clinical_note, ImportFingerprint, ImportCheckpoint,
+)
+from core.ingest import (
+    CUSTOMER_FIELDS, customer_fields, lab_fields, note_fields, patient_ref,
+    expand_sources, file_signature, open_text, parsed_batches,
+)
+from core.columnar import lab_blocks
+from core.bulkload import bulk_load_mode, recover_interrupted_load
+from core.jobs import progress
+from core.latest import advance_latest_labs, lab_watermark
+from risk.model import registry as risk_registry
+from django.db import connection, transaction
+from django.utils import timezone
 from django.utils.dateparse import parse_date
 from django.core.management import call_command
 
+
+def report_rate(label, count, elapsed):
+    rate = count / elapsed if elapsed > 0 else float(count)
+    print(f"{label}: {count} rows in {elapsed:.2f}s ({rate:,.0f} rows/sec)")
+
+
 class Command(BaseCommand):
     help = 'Populate the database with data.'
 
     def add_arguments(self, parser):
         parser.add_argument('--populate', action='store_true', help='Populate database with loaded data')
+        parser.add_argument('--bulk', action='store_true',
+                            help='Load with batched bulk_create inside transactions instead of one INSERT per row')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Fingerprint source rows: insert new, upsert changed, skip loaded; resumes from checkpoints')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Rows per bulk_create batch and transaction (default 5000)')
+        parser.add_argument('--columnar-labs', action='store_true',
+                            help='Bulk mode: load patient_lab.csv through the vectorized NumPy loader')
+        parser.add_argument('--rejects', default=None,
+                            help='With --columnar-labs: write rejected lab rows (file, row, index, reason) to this CSV')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes that parse/normalize CSV batches in parallel; implies --bulk unless --incremental (default 1)')
+        parser.add_argument('--patients', default=None,
+                            help='Path or glob of patient_info shards (.csv, .csv.gz, .csv.zst, ...)')
+        parser.add_argument('--labs', default=None, help='Path or glob of patient_lab shards')
+        parser.add_argument('--notes', default=None, help='Path or glob of notes shards')
+        parser.add_argument('--bulk-load', action='store_true',
+                            help='SQLite: WAL + relaxed sync, drop/rebuild secondary indexes, ANALYZE afterwards. '
+                                 'After a crash mid-load the next command that writes to the database restores '
+                                 'the indexes and journal mode')
+        parser.add_argument('--skip-ml', action='store_true',
+                            help='Only load: do not run score_diabetes / note_classifier afterwards')
 
     def handle(self, *args, **options):
+        recover_interrupted_load(self.stdout.write)
+        if options['columnar_labs'] and options['incremental']:
+            raise CommandError('--columnar-labs is a bulk mode and cannot be combined with --incremental')
         if options['populate']:
             self.stdout.write(self.style.SUCCESS('Populating database...'))
-            self.populate_database()
+            self.populate_database(bulk=options['bulk'], batch_size=options['batch_size'],
+                                   incremental=options['incremental'], workers=options['workers'],
+                                   columnar_labs=options['columnar_labs'], rejects_path=options['rejects'],
+                                   patients=options['patients'], labs=options['labs'], notes=options['notes'],
+                                   bulk_load=options['bulk_load'], skip_ml=options['skip_ml'])
 
-    def populate_database(self):
+    def populate_database(self, bulk=False, batch_size=5000, incremental=False, workers=1,
+                          columnar_labs=False, rejects_path=None, patients=None, labs=None, notes=None,
+                          bulk_load=False, skip_ml=False):
         # Path to the CSV file
         # Find the DSM25 base directory
         base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
         # If 'core' is in the path, go up one more level to DSM25
         if os.path.basename(base_dir) == 'core':
             base_dir = os.path.dirname(base_dir)
-        csv_path = os.path.join(base_dir, 'data', 'raw_test', 'patient_info.csv')
-
-        # Common prefixes/suffixes
-        SUFFIXES = ["MR.", "MRS.", "MS.", "DR.", "MISS", "MR", "MRS", "MS", "DR"]
-
-        def clean_name(name):
-            # Remove extra spaces and normalize case
-            name = name.strip()
-            parts = name.split()
-            suffix = ""
-            # Check for prefix/suffix
-            if parts and parts[0].replace('.', '').upper() in [s.replace('.', '') for s in SUFFIXES]:
-                suffix = parts[0].title().replace('.', '')
-                parts = parts[1:]
-            # If still more than 2 parts, assume first is first name, last is last name, middle is middle initial
-            first = parts[0].title() if len(parts) > 0 else ""
-            last = parts[-1].title() if len(parts) > 1 else ""
-            middle = parts[1][0].upper() if len(parts) > 2 and parts[1] else ""
-            return first, last, middle, suffix
-
-        with open(csv_path, newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            count = 0
-            for row in reader:
-                name = row.get('Name', '')
-                gender = row.get('Gender', '')
-                first, last, middle, suffix = clean_name(name)
-
-                Customer.objects.create(
-                    CustFirstName=first,
-                    CustLastName=last,
-                    CustMiddleInit=middle,
-                    CustSuffix=suffix,
-                    Gender=gender.title(),
-                )
-                count += 1
-            print(f"Database population completed. {count} customers added. loading Patient_lab...")
+        raw_dir = os.path.join(base_dir, 'data', 'raw_test')
+        csv_paths = self.source_files(patients or os.path.join(raw_dir, 'patient_info.csv'))
+        lab_csv_paths = self.source_files(labs or os.path.join(raw_dir, 'patient_lab.csv'))
+        notes_csv_paths = self.source_files(notes or os.path.join(raw_dir, 'notes.csv'))
 
-        # Populate Patient_lab
-        lab_csv_path = os.path.join(base_dir, 'data', 'raw_test', 'patient_lab.csv')
-        from core.models import Patient_lab
-
-        with open(lab_csv_path, newline='', encoding='utf-8') as labfile:
-            lab_reader = csv.DictReader(labfile)
-            lab_count = 0
-            for row in lab_reader:
-                # The first column is the index, which should match the Customer's Cust_id (starting from 1)
-                try:
-                    patient_index = int(row.get('', None))
-                except Exception:
-                    continue
-                cust_id = patient_index + 1
-                try:
-                    customer = Customer.objects.get(Cust_id=cust_id)
-                except Customer.DoesNotExist:
-                    continue
-                # Convert Smoking_Status to boolean
-                smoking = row.get('Smoking_Status', '').strip().lower()
-                smoking_bool = True if smoking == 'smoker' else False
-                Patient_lab.objects.create(
-                    Patient_id=customer,
-                    Age=int(float(row.get('Age', 0))),
-                    BMI=float(row.get('BMI', 0)),
-                    Systolic_BP=float(row.get('Systolic_BP', 0)),
-                    Diastolic_BP=float(row.get('Diastolic_BP', 0)),
-                    Total_Cholesterol=float(row.get('Total_Cholesterol', 0)),
-                    HDL_Cholesterol=float(row.get('HDL_Cholesterol', 0)),
-                    LDL_Cholesterol=float(row.get('LDL_Cholesterol', 0)),
-                    Triglycerides=float(row.get('Triglycerides', 0)),
-                    Smoking_status=smoking_bool,
-                    Physical_activity=row.get('Physical_Activity_Level', '')
-                )
-                lab_count += 1
-            print(f"Database population completed. {lab_count} patient labs added. loading Clinical_note...")
-
-        # Populate Clinical_note
-        notes_csv_path = os.path.join(base_dir, 'data', 'raw_test', 'notes.csv')
-        from core.models import Clinical_note
-
-        with open(notes_csv_path, newline='', encoding='utf-8') as notesfile:
-            notes_reader = csv.DictReader(notesfile)
-            notes_count = 0
-            for row in notes_reader:
-                # The first column is the index, which should match the Customer's Cust_id (starting from 1)
-                try:
-                    patient_index = int(row.get('', None))
-                except Exception:
-                    continue
-                cust_id = patient_index + 1
-                try:
-                    customer = Customer.objects.get(Cust_id=cust_id)
-                except Customer.DoesNotExist:
-                    continue
-                Clinical_note.objects.create(
-                    Patient_id=customer,
-                    Description=row.get('description', ''),
-                    Medical_specialty=row.get('medical_specialty', ''),
-                    Sample_name=row.get('sample_name', ''),
-                    Transcription=row.get('transcription', ''),
-                    Keywords=row.get('keywords', '')
-                )
-                notes_count += 1
-            print(f"Database population completed. {notes_count} clinical notes added. All done.")
+        rescore_labs = reclassify_notes = True
+        start = time.perf_counter()
+        with bulk_load_mode(Customer, Patient_lab, Clinical_note) if bulk_load else nullcontext():
+            if incremental:
+                delta = self.incremental_populate(csv_paths, lab_csv_paths, notes_csv_paths, batch_size, workers)
+                # Only re-run downstream scoring for tables that actually changed
+                rescore_labs = delta['Patient_lab']['inserted'] + delta['Patient_lab']['updated'] > 0
+                reclassify_notes = delta['Clinical_note']['inserted'] + delta['Clinical_note']['updated'] > 0
+            elif bulk or workers > 1 or columnar_labs:
+                counts = self.bulk_populate(csv_paths, lab_csv_paths, notes_csv_paths, batch_size, workers,
+                                            columnar_labs, rejects_path)
+                rescore_labs = counts['Patient_lab'] > 0
+                reclassify_notes = counts['Clinical_note'] > 0
+            else:
+                self.row_populate(csv_paths, lab_csv_paths, notes_csv_paths)
+        print(f"Load finished in {time.perf_counter() - start:.2f}s")
+        if skip_ml:
+            return
 
         # Kick off ML scoring right after populate
         try:
-            print("Scoring structured diabetes risk…")
-            call_command("score_diabetes", fraction=0.05)
+            if rescore_labs:
+                print("Scoring structured diabetes risk…")
+                progress(done=0, total=0, step="score_diabetes")
+                # Once a model has been trained: score only patients with new labs; retraining is an explicit run
+                call_command("score_diabetes", bulk_load=bulk_load, incremental=risk_registry.current() is not None)
 
-            print("Classifying notes by specialty…")
-            # Train TF-IDF+LogReg if you have enough labeled notes; else keyword fallback
-            call_command("note_classifier", min_labels=50)
-            print("Note classification done.")
+            if reclassify_notes:
+                print("Classifying notes by specialty…")
+                progress(done=0, total=0, step="note_classifier")
+                # Train TF-IDF+LogReg if you have enough labeled notes; else keyword fallback
+                call_command("note_classifier", min_labels=50, bulk_load=bulk_load)
+                print("Note classification done.")
         except Exception as e:
             print(f"ML scoring/classification failed: {e}")
             # Don’t let a scoring hiccup kill your import
             print(f"[WARN] Post-import scoring failed: {e}")
+
+    def source_files(self, pattern):
+        paths = expand_sources(pattern)
+        if not paths:
+            raise CommandError(f'No source files match {pattern}')
+        return paths
+
+    def shard_checkpoint(self, source, path, mode=ImportCheckpoint.BULK):
+        """
+        Checkpoint of one source shard in one load mode. Shards already loaded (same size
+        and mtime) come back Completed; a shard that changed since it was recorded starts over.
+        Checkpoints of the other mode are ignored: a bulk load records no fingerprints, so
+        an incremental load must still read (and fingerprint) every row it loaded.
+        """
+        signature = file_signature(path)
+        checkpoint, created = ImportCheckpoint.objects.get_or_create(
+            Mode=mode, Source=source, Path=os.path.abspath(path), defaults={'Signature': signature},
+        )
+        if created and mode == ImportCheckpoint.INCREMENTAL and ImportCheckpoint.objects.filter(
+                Mode=ImportCheckpoint.BULK, Source=source, Path=checkpoint.Path).exists():
+            print(f"[WARN] {source}: {path} was bulk loaded, which records no fingerprints; "
+                  f"its rows will be loaded again")
+        if checkpoint.Signature != signature:
+            checkpoint.Signature, checkpoint.Offset, checkpoint.Rows, checkpoint.Completed = signature, 0, 0, False
+        elif checkpoint.Completed:
+            print(f"{source}: already loaded, skipping {path}")
+        elif checkpoint.Offset or checkpoint.Rows:
+            print(f"{source}: resuming {path} at byte {checkpoint.Offset} (row {checkpoint.Rows})")
+        return checkpoint
+
+    def finish_shard(self, checkpoint):
+        checkpoint.Completed = True
+        checkpoint.Updated_at = timezone.now()
+        checkpoint.save()
+
+    def row_populate(self, csv_paths, lab_csv_paths, notes_csv_paths):
+        # One INSERT (and one Customer lookup) per row, autocommitted
+        start = time.perf_counter()
+        count = 0
+        for csv_path in csv_paths:
+            with open_text(csv_path) as csvfile:
+                reader = csv.DictReader(csvfile)
+                for row in reader:
+                    Customer.objects.create(**customer_fields(row))
+                    count += 1
+                    progress(done=count, step="Customer")
+        print(f"Database population completed. {count} customers added. loading Patient_lab...")
+        report_rate("Customer", count, time.perf_counter() - start)
+
+        # Populate Patient_lab
+        start = time.perf_counter()
+        lab_count = 0
+        for lab_csv_path in lab_csv_paths:
+            with open_text(lab_csv_path) as labfile:
+                lab_reader = csv.DictReader(labfile)
+                for row in lab_reader:
+                    cust_id = patient_ref(row.get(''))
+                    if cust_id is None:
+                        continue
+                    try:
+                        customer = Customer.objects.get(Cust_id=cust_id)
+                    except Customer.DoesNotExist:
+                        continue
+                    Patient_lab.objects.create(Patient_id=customer, **lab_fields(row))
+                    lab_count += 1
+                    progress(done=lab_count, step="Patient_lab")
+        print(f"Database population completed. {lab_count} patient labs added. loading Clinical_note...")
+        report_rate("Patient_lab", lab_count, time.perf_counter() - start)
+
+        # Populate Clinical_note
+        start = time.perf_counter()
+        notes_count = 0
+        for notes_csv_path in notes_csv_paths:
+            with open_text(notes_csv_path) as notesfile:
+                notes_reader = csv.DictReader(notesfile)
+                for row in notes_reader:
+                    cust_id = patient_ref(row.get(''))
+                    if cust_id is None:
+                        continue
+                    try:
+                        customer = Customer.objects.get(Cust_id=cust_id)
+                    except Customer.DoesNotExist:
+                        continue
+                    Clinical_note.objects.create(Patient_id=customer, **note_fields(row))
+                    notes_count += 1
+                    progress(done=notes_count, step="Clinical_note")
+        print(f"Database population completed. {notes_count} clinical notes added. All done.")
+        report_rate("Clinical_note", notes_count, time.perf_counter() - start)
+
+    def bulk_populate(self, csv_paths, lab_csv_paths, notes_csv_paths, batch_size, workers=1,
+                      columnar_labs=False, rejects_path=None):
+        # Parse each file into batches and write every batch with one bulk_create
+        # inside its own transaction; patient ids resolve against an in-memory id map.
+        def build_customers(rows):
+            return [Customer(**fields) for _, fields, _ in rows]
+
+        count = self.bulk_load(Customer, 'patient_info', csv_paths, build_customers, batch_size, workers)
+        print(f"Database population completed. {count} customers added. loading Patient_lab...")
+
+        # Built once; replaces the per-row Customer.objects.get()
+        known_ids = set(Customer.objects.values_list('Cust_id', flat=True))
+
+        def build_labs(rows):
+            objs = []
+            for ref, fields, _ in rows:
+                cust_id = patient_ref(ref)
+                if cust_id in known_ids:
+                    objs.append(Patient_lab(Patient_id_id=cust_id, **fields))
+            return objs
+
+        if columnar_labs:
+            lab_count = self.columnar_load_labs(lab_csv_paths, known_ids, batch_size, rejects_path)
+        else:
+            lab_count = self.bulk_load(Patient_lab, 'patient_lab', lab_csv_paths, build_labs, batch_size, workers)
+        print(f"Database population completed. {lab_count} patient labs added. loading Clinical_note...")
+
+        def build_notes(rows):
+            objs = []
+            for ref, fields, _ in rows:
+                cust_id = patient_ref(ref)
+                if cust_id in known_ids:
+                    objs.append(Clinical_note(Patient_id_id=cust_id, **fields))
+            return objs
+
+        notes_count = self.bulk_load(Clinical_note, 'notes', notes_csv_paths, build_notes, batch_size, workers)
+        print(f"Database population completed. {notes_count} clinical notes added. All done.")
+        return {'Customer': count, 'Patient_lab': lab_count, 'Clinical_note': notes_count}
+
+    def bulk_load(self, model, kind, paths, build, batch_size, workers=1):
+        # Shards stream in name order; each batch commits with its shard checkpoint,
+        # so loaded shards are skipped next run and an interrupted one resumes.
+        start = time.perf_counter()
+        count = 0
+        for path in paths:
+            checkpoint = self.shard_checkpoint(kind, path)
+            if checkpoint.Completed:
+                continue
+            for rows, end_offset in parsed_batches(kind, path, batch_size, workers, offset=checkpoint.Offset):
+                objs = build(rows)
+                with transaction.atomic():
+                    watermark = lab_watermark() if model is Patient_lab else None
+                    model.objects.bulk_create(objs, batch_size=batch_size)
+                    if watermark is not None:
+                        advance_latest_labs(watermark)
+                    checkpoint.Offset = end_offset
+                    checkpoint.Rows += len(rows)
+                    checkpoint.Updated_at = timezone.now()
+                    checkpoint.save()
+                count += len(objs)
+                progress(done=count, step=model.__name__)
+            self.finish_shard(checkpoint)
+        report_rate(model.__name__, count, time.perf_counter() - start)
+        return count
+
+    def columnar_load_labs(self, paths, known_ids, batch_size, rejects_path=None):
+        # Typed arrays straight into executemany: no csv.DictReader, no model instances
+        start = time.perf_counter()
+        known = np.fromiter(known_ids, dtype=np.int64, count=len(known_ids))
+        fields = ['Patient_id', 'Age', 'BMI', 'Systolic_BP', 'Diastolic_BP', 'Total_Cholesterol',
+                  'HDL_Cholesterol', 'LDL_Cholesterol', 'Triglycerides', 'Smoking_status', 'Physical_activity']
+        columns = [Patient_lab._meta.get_field(f).column for f in fields]
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            connection.ops.quote_name(Patient_lab._meta.db_table),
+            ', '.join(connection.ops.quote_name(c) for c in columns),
+            ', '.join(['%s'] * len(columns)),
+        )
+
+        all_rejects = []
+        count = 0
+        for path in paths:
+            checkpoint = self.shard_checkpoint('patient_lab', path)
+            if checkpoint.Completed:
+                continue
+            # As in bulk_load, the checkpoint records source rows consumed and the byte offset after them
+            parse_time, unlinked, consumed = 0.0, 0, checkpoint.Rows
+            blocks = lab_blocks(path, batch_size, offset=checkpoint.Offset, rows_before=checkpoint.Rows)
+            with connection.cursor() as cursor:
+                while True:
+                    parse_start = time.perf_counter()
+                    block = next(blocks, None)
+                    parse_time += time.perf_counter() - parse_start
+                    if block is None:
+                        break
+                    cols, rejects, records, end_offset = block
+                    all_rejects.extend((path, *r) for r in rejects)
+                    cust_ids = cols['ref'] + 1
+                    linked = np.isin(cust_ids, known)
+                    unlinked += int((~linked).sum())
+                    rows = list(zip(cust_ids[linked].tolist(), *(cols[f][linked].tolist() for f in fields[1:])))
+                    with transaction.atomic():
+                        if rows:
+                            watermark = lab_watermark()
+                            cursor.executemany(sql, rows)
+                            advance_latest_labs(watermark)
+                        checkpoint.Offset = end_offset
+                        checkpoint.Rows += records
+                        checkpoint.Updated_at = timezone.now()
+                        checkpoint.save()
+                    count += len(rows)
+                    progress(done=count, step='Patient_lab')
+            print(f"Columnar lab parse: {checkpoint.Rows - consumed} rows of {path} in {parse_time * 1000:.0f}ms")
+            if unlinked:
+                print(f"Skipped {unlinked} lab rows with no matching customer")
+            self.finish_shard(checkpoint)
+
+        if all_rejects:
+            print(f"Rejected {len(all_rejects)} lab rows, e.g. {all_rejects[0][0]} row {all_rejects[0][1]}: "
+                  f"{all_rejects[0][3]}")
+            if rejects_path:
+                with open(rejects_path, 'w', newline='', encoding='utf-8') as f:
+                    writer = csv.writer(f)
+                    writer.writerow(['file', 'row', 'index', 'reason'])
+                    writer.writerows(all_rejects)
+                print(f"Rejected-rows report written to {rejects_path}")
+        report_rate('Patient_lab', count, time.perf_counter() - start)
+        return count
+
+    def incremental_populate(self, csv_paths, lab_csv_paths, notes_csv_paths, batch_size, workers=1):
+        delta = {}
+
+        def write_customers(new, changed):
+            objs = [Customer(**fields) for _, (_, fields) in new]
+            Customer.objects.bulk_create(objs, batch_size=batch_size)
+            Customer.objects.bulk_update(
+                [Customer(Cust_id=obj_id, **fields) for obj_id, (_, fields) in changed],
+                CUSTOMER_FIELDS, batch_size=batch_size,
+            )
+            return [o.pk for o in objs], [obj_id for obj_id, _ in changed]
+
+        delta['Customer'] = self.incremental_load(
+            'patient_info', csv_paths, batch_size, workers, write_customers,
+            key_for=lambda ref, n, digest: ref or str(n),
+        )
+
+        # Source patient key -> Cust_id, built once for the lab and note loads
+        cust_ids = dict(
+            ImportFingerprint.objects.filter(Source='patient_info').values_list('Row_key', 'Object_id')
+        )
+
+        # Labs and notes are append-only: a patient has any number of each and the index
+        # column is the patient, so rows are keyed by their content digest (which covers
+        # that column). A row already loaded is skipped wherever it appears, e.g. again in
+        # a cumulative extract or after rows were inserted before it; an edited row is a
+        # new row (for labs, the patient's new latest version). Content keys never "change".
+        def write_labs(new, changed):
+            objs = [
+                Patient_lab(Patient_id_id=cust_ids[ref], **fields) if ref in cust_ids else None
+                for _, (ref, fields) in new
+            ]
+            watermark = lab_watermark()
+            Patient_lab.objects.bulk_create([o for o in objs if o is not None], batch_size=batch_size)
+            advance_latest_labs(watermark)
+            return [o.pk if o is not None else None for o in objs], []
+
+        delta['Patient_lab'] = self.incremental_load(
+            'patient_lab', lab_csv_paths, batch_size, workers, write_labs,
+            key_for=lambda ref, n, digest: digest,
+        )
+
+        def write_notes(new, changed):
+            objs = [
+                Clinical_note(Patient_id_id=cust_ids[ref], **fields) if ref in cust_ids else None
+                for _, (ref, fields) in new
+            ]
+            Clinical_note.objects.bulk_create([o for o in objs if o is not None], batch_size=batch_size)
+            return [o.pk if o is not None else None for o in objs], []
+
+        delta['Clinical_note'] = self.incremental_load(
+            'notes', notes_csv_paths, batch_size, workers, write_notes,
+            key_for=lambda ref, n, digest: digest,
+        )
+
+        for label, d in delta.items():
+            print(f"{label}: {d['inserted']} inserted, {d['updated']} updated, {d['skipped']} skipped"
+                  + (f", {d['collapsed']} collapsed into a later row with the same key" if d['collapsed'] else ""))
+        return delta
+
+    def incremental_load(self, source, paths, batch_size, workers, write, key_for):
+        """
+        Load one source's shards batch by batch. Each batch's object writes, fingerprints
+        and checkpoint commit in one transaction, so a crashed load resumes at the last
+        committed byte offset and re-running a finished shard is a no-op.
+        `write(new, changed)` gets [(None, (ref, fields))] / [(object_id, (ref, fields))]
+        and returns the object ids it wrote for each (None where a row was dropped).
+        """
+        stats = {'inserted': 0, 'updated': 0, 'skipped': 0, 'collapsed': 0}
+        start = time.perf_counter()
+        consumed = 0
+        base = 0  # rows in earlier shards, so positional keys (customers without an index) stay unique
+        for path in paths:
+            checkpoint = self.shard_checkpoint(source, path, ImportCheckpoint.INCREMENTAL)
+            if checkpoint.Completed:
+                base += checkpoint.Rows
+                continue
+
+            ordinal = checkpoint.Rows
+            for rows, end_offset in parsed_batches(source, path, batch_size, workers,
+                                                   offset=checkpoint.Offset, digests=True):
+                entries = {}
+                for ref, fields, digest in rows:
+                    # Last occurrence of a key within a batch wins; the others are counted as collapsed
+                    key = key_for(ref, base + ordinal, digest)
+                    if key in entries:
+                        stats['collapsed'] += 1
+                    entries[key] = (digest, (ref, fields))
+                    ordinal += 1
+                consumed += len(rows)
+
+                seen = {
+                    key: (pk, digest, obj_id)
+                    for pk, key, digest, obj_id in ImportFingerprint.objects.filter(
+                        Source=source, Row_key__in=list(entries),
+                    ).values_list('id', 'Row_key', 'Digest', 'Object_id')
+                }
+                new, changed = [], []
+                for key, (digest, parsed) in entries.items():
+                    prev = seen.get(key)
+                    if prev is None:
+                        new.append((key, digest, parsed))
+                    elif prev[1] != digest:
+                        changed.append((key, digest, parsed))
+                    else:
+                        stats['skipped'] += 1
+
+                now = timezone.now()
+                with transaction.atomic():
+                    new_ids, changed_ids = write(
+                        [(None, parsed) for _, _, parsed in new],
+                        [(seen[key][2], parsed) for key, _, parsed in changed],
+                    )
+                    ImportFingerprint.objects.bulk_create([
+                        ImportFingerprint(Source=source, Row_key=key, Digest=digest, Object_id=obj_id, Loaded_at=now)
+                        for (key, digest, _), obj_id in zip(new, new_ids) if obj_id is not None
+                    ], batch_size=batch_size)
+                    ImportFingerprint.objects.bulk_update([
+                        ImportFingerprint(id=seen[key][0], Digest=digest, Object_id=obj_id, Loaded_at=now)
+                        for (key, digest, _), obj_id in zip(changed, changed_ids) if obj_id is not None
+                    ], ['Digest', 'Object_id', 'Loaded_at'], batch_size=batch_size)
+
+                    checkpoint.Offset = end_offset
+                    checkpoint.Rows = ordinal
+                    checkpoint.Updated_at = now
+                    checkpoint.save()
+
+                inserted = sum(1 for i in new_ids if i is not None)
+                updated = sum(1 for i in changed_ids if i is not None)
+                stats['inserted'] += inserted
+                stats['updated'] += updated
+                stats['skipped'] += len(new) + len(changed) - inserted - updated
+                progress(done=consumed, step=source)
+
+            self.finish_shard(checkpoint)
+            base += checkpoint.Rows
+        report_rate(source, consumed, time.perf_counter() - start)
+        return stats
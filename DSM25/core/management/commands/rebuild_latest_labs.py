@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.bulkload import recover_interrupted_load
+from core.latest import rebuild_latest_labs
+
+
+class Command(BaseCommand):
+    help = "Recompute the LatestLab pointer table (newest Patient_lab per patient) from scratch."
+
+    def handle(self, *args, **opts):
+        recover_interrupted_load(self.stdout.write)
+        start = time.perf_counter()
+        with transaction.atomic():
+            count = rebuild_latest_labs()
+        self.stdout.write(self.style.SUCCESS(
+            f"LatestLab rebuilt: {count} patients in {time.perf_counter() - start:.2f}s"
+        ))
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import jobs
+
+
+class Command(BaseCommand):
+    help = "Worker: run jobs queued from the management page (import_data, score_diabetes, note_classifier)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Exit when the queue is empty instead of polling")
+        parser.add_argument("--poll", type=float, default=2.0, help="Seconds between queue polls (default 2)")
+
+    def handle(self, *args, **opts):
+        orphans = jobs.fail_orphans()
+        if orphans:
+            self.stdout.write(self.style.WARNING(f"Marked {orphans} orphaned running job(s) as failed"))
+        self.stdout.write(self.style.SUCCESS(f"Job worker {jobs.worker_name()} started"))
+
+        while True:
+            close_old_connections()
+            job = jobs.claim_next()
+            if job is None:
+                if opts["once"]:
+                    return
+                # Jobs of workers that died elsewhere (or silently) would otherwise block their command
+                orphans = jobs.fail_orphans()
+                if orphans:
+                    self.stdout.write(self.style.WARNING(f"Marked {orphans} orphaned running job(s) as failed"))
+                time.sleep(opts["poll"])
+                continue
+
+            self.stdout.write(self.style.HTTP_INFO(f"Job #{job.pk}: {job.Command} {job.Options}"))
+            status = jobs.run(job)
+            style = self.style.SUCCESS if status == job.SUCCEEDED else self.style.ERROR
+            self.stdout.write(style(f"Job #{job.pk} {status} in {job.Duration:.1f}s"))
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:57
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_noteprediction'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('Path', models.CharField(max_length=500, unique=True)),
+                ('Signature', models.CharField(max_length=100)),
+                ('Offset', models.BigIntegerField(default=0)),
+                ('Rows', models.BigIntegerField(default=0)),
+                ('Completed', models.BooleanField(default=False)),
+                ('Updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ImportFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('Source', models.CharField(max_length=50)),
+                ('Row_key', models.CharField(max_length=100)),
+                ('Digest', models.CharField(max_length=32)),
+                ('Object_id', models.BigIntegerField()),
+                ('Loaded_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('Source', 'Row_key'), name='uniq_import_source_row')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:09
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_import_fingerprints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('Command', models.CharField(max_length=50)),
+                ('Options', models.JSONField(blank=True, default=dict)),
+                ('Status', models.CharField(choices=[('queued', 'queued'), ('running', 'running'), ('succeeded', 'succeeded'), ('failed', 'failed')], default='queued', max_length=10)),
+                ('Step', models.CharField(blank=True, max_length=100)),
+                ('Progress_done', models.BigIntegerField(default=0)),
+                ('Progress_total', models.BigIntegerField(blank=True, null=True)),
+                ('Output', models.TextField(blank=True)),
+                ('Error', models.TextField(blank=True)),
+                ('Worker', models.CharField(blank=True, max_length=100)),
+                ('Created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('Started_at', models.DateTimeField(blank=True, null=True)),
+                ('Heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('Finished_at', models.DateTimeField(blank=True, null=True)),
+                ('Duration', models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['Status', 'Created_at'], name='core_job_Status_198207_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('Status__in', ['queued', 'running'])), fields=('Command',), name='uniq_inflight_job')],
+            },
+        ),
+    ]
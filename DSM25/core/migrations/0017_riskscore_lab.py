@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='riskscore',
+            name='Lab',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.patient_lab'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill(apps, schema_editor):
+    # Same statement as core.latest.rebuild_latest_labs(), against the historical models
+    LatestLab = apps.get_model('core', 'LatestLab')
+    Patient_lab = apps.get_model('core', 'Patient_lab')
+    qn = schema_editor.connection.ops.quote_name
+    schema_editor.execute(
+        f"INSERT INTO {qn(LatestLab._meta.db_table)} ({qn('Patient_id_id')}, {qn('Lab_id')}) "
+        f"SELECT {qn('Patient_id_id')}, MAX({qn('id')}) FROM {qn(Patient_lab._meta.db_table)} "
+        f"WHERE {qn('Patient_id_id')} IS NOT NULL GROUP BY {qn('Patient_id_id')}"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_riskscore_lab'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestLab',
+            fields=[
+                ('Patient_id', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='core.customer')),
+                ('Lab', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='core.patient_lab')),
+            ],
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
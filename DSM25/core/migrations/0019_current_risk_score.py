@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:23
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill(apps, schema_editor):
+    # Same statement as risk.history.rebuild_current_scores(), against the historical models
+    CurrentRiskScore = apps.get_model('core', 'CurrentRiskScore')
+    RiskScore = apps.get_model('core', 'RiskScore')
+    qn = schema_editor.connection.ops.quote_name
+    cols = ', '.join(qn(c) for c in ['Patient_id_id', 'Lab_id', 'Score', 'HighRisk', 'Scored_at'])
+    schema_editor.execute(
+        f"INSERT INTO {qn(CurrentRiskScore._meta.db_table)} ({cols}) "
+        f"SELECT {cols} FROM (SELECT {cols}, ROW_NUMBER() OVER ("
+        f"PARTITION BY {qn('Patient_id_id')} ORDER BY {qn('Scored_at')} DESC, {qn('id')} DESC) AS rn "
+        f"FROM {qn(RiskScore._meta.db_table)}) latest WHERE rn = 1"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_latest_lab'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RiskScoreSummary',
+            fields=[
+                ('Patient_id', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='core.customer')),
+                ('Runs', models.IntegerField(default=0)),
+                ('High_runs', models.IntegerField(default=0)),
+                ('Min_score', models.FloatField()),
+                ('Max_score', models.FloatField()),
+                ('Last_score', models.FloatField()),
+                ('Last_high', models.BooleanField(default=False)),
+                ('First_scored_at', models.DateTimeField()),
+                ('Last_scored_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CurrentRiskScore',
+            fields=[
+                ('Patient_id', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='core.customer')),
+                ('Score', models.FloatField()),
+                ('HighRisk', models.BooleanField(default=False)),
+                ('Scored_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('Lab', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.patient_lab')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-Score'], name='core_curren_Score_ce7441_idx'), models.Index(fields=['HighRisk', '-Score'], name='core_curren_HighRis_8e4c81_idx'), models.Index(fields=['-Scored_at'], name='core_curren_Scored__245cbd_idx')],
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_current_risk_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='noteprediction',
+            name='Model_version',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:00
+
+import os
+
+from django.db import migrations, models
+
+
+def classify_existing(apps, schema_editor):
+    # Checkpoints written before this migration were keyed by path alone. Infer the source
+    # table from the file name; a source with fingerprints was loaded incrementally,
+    # anything else by a bulk load (which writes none)
+    ImportCheckpoint = apps.get_model('core', 'ImportCheckpoint')
+    ImportFingerprint = apps.get_model('core', 'ImportFingerprint')
+    fingerprinted = set(ImportFingerprint.objects.values_list('Source', flat=True).distinct())
+    for checkpoint in ImportCheckpoint.objects.all():
+        name = os.path.basename(checkpoint.Path)
+        source = next((s for s in ('patient_info', 'patient_lab', 'notes') if s in name), '')
+        checkpoint.Source = source
+        checkpoint.Mode = 'incremental' if source in fingerprinted else 'bulk'
+        checkpoint.save(update_fields=['Source', 'Mode'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_note_prediction_model_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importcheckpoint',
+            name='Mode',
+            field=models.CharField(default='incremental', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='importcheckpoint',
+            name='Source',
+            field=models.CharField(default='', max_length=50),
+        ),
+        migrations.RunPython(classify_existing, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='importcheckpoint',
+            name='Path',
+            field=models.CharField(max_length=500),
+        ),
+        migrations.AddConstraint(
+            model_name='importcheckpoint',
+            constraint=models.UniqueConstraint(fields=('Mode', 'Source', 'Path'), name='uniq_import_checkpoint'),
+        ),
+    ]
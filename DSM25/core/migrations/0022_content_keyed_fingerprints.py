@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:10
+
+from django.db import migrations
+
+
+def rekey_by_digest(apps, schema_editor):
+    # Lab and note fingerprints were keyed by row position (labs earlier by patient); they are
+    # now keyed by their content digest, which each row already stores. Where several rows
+    # share a digest (the same row loaded at two positions) the newest is kept.
+    ImportFingerprint = apps.get_model('core', 'ImportFingerprint')
+    for source in ('patient_lab', 'notes'):
+        keep, duplicates = {}, []
+        for pk, digest in ImportFingerprint.objects.filter(Source=source).order_by('id').values_list('id', 'Digest'):
+            if digest in keep:
+                duplicates.append(keep[digest])
+            keep[digest] = pk
+        for i in range(0, len(duplicates), 1000):
+            ImportFingerprint.objects.filter(id__in=duplicates[i:i + 1000]).delete()
+        ImportFingerprint.objects.bulk_update(
+            [ImportFingerprint(id=pk, Row_key=digest) for digest, pk in keep.items()],
+            ['Row_key'], batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_import_checkpoint_mode'),
+    ]
+
+    operations = [
+        migrations.RunPython(rekey_by_digest, migrations.RunPython.noop),
+    ]
@@ -26,6 +26,16 @@ class Patient_lab(models.Model):
     Smoking_status = models.BooleanField()
     Physical_activity = models.CharField(max_length=50)
 
+class LatestLab(models.Model):
+    # Denormalized pointer to each patient's newest Patient_lab row, so scoring joins
+    # one row per patient instead of computing Max(id) per patient every run.
+    # Kept current by core.latest (lab post_save/post_delete signals + import_data).
+    Patient_id = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True)
+    Lab = models.OneToOneField(Patient_lab, on_delete=models.CASCADE)
+
+    def __str__(self):
+        return f"LatestLab(patient={self.Patient_id_id} -> lab {self.Lab_id})"
+
 class Clinical_note(models.Model):
     Patient_id = models.ForeignKey(Customer, on_delete=models.CASCADE,  null=True, blank=True)
     Description = models.TextField()
@@ -36,6 +46,7 @@ class Clinical_note(models.Model):
 
 class RiskScore(models.Model):
     Patient_id = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    Lab = models.ForeignKey(Patient_lab, on_delete=models.SET_NULL, null=True, blank=True)  # lab row that was scored
     Score = models.FloatField()             # 0..1 normalized risk score
     HighRisk = models.BooleanField(default=False)  # outcome label
     Scored_at = models.DateTimeField(default=timezone.now)
@@ -49,11 +60,48 @@ class RiskScore(models.Model):
     def __str__(self):
         return f"RiskScore(patient={self.Patient_id_id}, score={self.Score:.3f}, high={self.HighRisk})"
     
+class CurrentRiskScore(models.Model):
+    # One row per patient mirroring its newest RiskScore, maintained by score_diabetes;
+    # the risk queue reads this instead of windowing over the whole history
+    Patient_id = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True)
+    Lab = models.ForeignKey(Patient_lab, on_delete=models.SET_NULL, null=True, blank=True)
+    Score = models.FloatField()
+    HighRisk = models.BooleanField(default=False)
+    Scored_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-Score"]),
+            models.Index(fields=["HighRisk", "-Score"]),
+            models.Index(fields=["-Scored_at"]),
+        ]
+
+    def __str__(self):
+        return f"CurrentRiskScore(patient={self.Patient_id_id}, score={self.Score:.3f}, high={self.HighRisk})"
+
+class RiskScoreSummary(models.Model):
+    # Per-patient rollup of RiskScore rows removed by compact_risk_scores
+    Patient_id = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True)
+    Runs = models.IntegerField(default=0)
+    High_runs = models.IntegerField(default=0)
+    Min_score = models.FloatField()
+    Max_score = models.FloatField()
+    Last_score = models.FloatField()
+    Last_high = models.BooleanField(default=False)
+    First_scored_at = models.DateTimeField()
+    Last_scored_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"RiskScoreSummary(patient={self.Patient_id_id}, runs={self.Runs}, last={self.Last_score:.3f})"
+
 class NotePrediction(models.Model):
     Note = models.ForeignKey(Clinical_note, on_delete=models.CASCADE)
     Predicted_specialty = models.CharField(max_length=50)
     Confidence = models.FloatField()
     Predicted_at = models.DateTimeField(default=timezone.now)
+    # Note registry version that predicted it ("v3"), "keywords" for the keyword fallback;
+    # blank on rows from before versioning, which note_classifier treats as outdated
+    Model_version = models.CharField(max_length=50, blank=True, default="")
 
     class Meta:
         indexes = [
@@ -63,3 +111,76 @@ class NotePrediction(models.Model):
 
     def __str__(self):
         return f"NotePrediction(note={self.Note_id}, {self.Predicted_specialty}, conf={self.Confidence:.2f})"
+
+class ImportFingerprint(models.Model):
+    # One row per loaded source row: content hash + the object it produced
+    Source = models.CharField(max_length=50)
+    Row_key = models.CharField(max_length=100)
+    Digest = models.CharField(max_length=32)
+    Object_id = models.BigIntegerField()
+    Loaded_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["Source", "Row_key"], name="uniq_import_source_row"),
+        ]
+
+    def __str__(self):
+        return f"ImportFingerprint({self.Source}:{self.Row_key} -> {self.Object_id})"
+
+class ImportCheckpoint(models.Model):
+    # Resume point of a load, per (load mode, source table, source file): bulk loads write
+    # no fingerprints, so their progress must not make an incremental load skip a file
+    BULK, INCREMENTAL = "bulk", "incremental"
+    Mode = models.CharField(max_length=20, default=INCREMENTAL)
+    Source = models.CharField(max_length=50, default="")  # patient_info / patient_lab / notes
+    Path = models.CharField(max_length=500)
+    Signature = models.CharField(max_length=100)   # size:mtime of the file being loaded
+    Offset = models.BigIntegerField(default=0)     # byte offset just past the last committed row
+    Rows = models.BigIntegerField(default=0)       # source rows consumed up to Offset
+    Completed = models.BooleanField(default=False)
+    Updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["Mode", "Source", "Path"], name="uniq_import_checkpoint"),
+        ]
+
+    def __str__(self):
+        return f"ImportCheckpoint({self.Mode} {self.Source} {self.Path} @ {self.Offset}, done={self.Completed})"
+
+class Job(models.Model):
+    # Background run of a management command, queued by the management page
+    QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+    STATUS_CHOICES = [(s, s) for s in (QUEUED, RUNNING, SUCCEEDED, FAILED)]
+    IN_FLIGHT = (QUEUED, RUNNING)
+
+    Command = models.CharField(max_length=50)
+    Options = models.JSONField(default=dict, blank=True)
+    Status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    Step = models.CharField(max_length=100, blank=True)       # what the command is doing right now
+    Progress_done = models.BigIntegerField(default=0)
+    Progress_total = models.BigIntegerField(null=True, blank=True)
+    Output = models.TextField(blank=True)                     # tail of the command's stdout
+    Error = models.TextField(blank=True)
+    Worker = models.CharField(max_length=100, blank=True)     # host:pid of the worker that claimed it
+    Created_at = models.DateTimeField(default=timezone.now)
+    Started_at = models.DateTimeField(null=True, blank=True)
+    Heartbeat_at = models.DateTimeField(null=True, blank=True)
+    Finished_at = models.DateTimeField(null=True, blank=True)
+    Duration = models.FloatField(null=True, blank=True)       # seconds
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["Status", "Created_at"]),
+        ]
+        constraints = [
+            # At most one queued/running job per command: duplicate clicks are rejected by the DB
+            models.UniqueConstraint(
+                fields=["Command"], condition=models.Q(Status__in=["queued", "running"]),
+                name="uniq_inflight_job",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Job(#{self.pk} {self.Command}, {self.Status})"
@@ -0,0 +1,100 @@
+"""
+Versioned on-disk registry for fitted model artifacts.
+
+Each model family gets a directory under settings.ARTIFACTS_DIR holding one
+`v<N>/` per saved version (`model.joblib` + `manifest.json`) and a `CURRENT`
+file naming the version scoring uses by default. Versions are written to a
+temp dir and renamed into place, so a reader never sees a half-written one.
+"""
+import json
+import os
+import re
+import tempfile
+
+import joblib
+import sklearn
+from django.conf import settings
+from django.utils import timezone
+
+
+class ArtifactNotFound(Exception):
+    pass
+
+
+class ModelRegistry:
+    def __init__(self, name):
+        self.name = name
+
+    @property
+    def root(self):
+        return os.path.join(settings.ARTIFACTS_DIR, self.name)
+
+    def versions(self):
+        """Saved version numbers, oldest first."""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(int(m.group(1)) for d in os.listdir(self.root) if (m := re.fullmatch(r"v(\d+)", d)))
+
+    def current(self):
+        """The promoted version (falls back to the newest saved one); None if nothing is saved."""
+        try:
+            with open(os.path.join(self.root, "CURRENT")) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            versions = self.versions()
+            return versions[-1] if versions else None
+
+    def save(self, payload, promote=True, **meta):
+        """Persist `payload` (anything joblib can dump) as a new version; returns its number."""
+        os.makedirs(self.root, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=".tmp-", dir=self.root)
+        joblib.dump(payload, os.path.join(tmp, "model.joblib"))
+        while True:
+            version = (self.versions() or [0])[-1] + 1
+            manifest = {
+                "name": self.name,
+                "version": version,
+                "created_at": timezone.now().isoformat(),
+                "sklearn": sklearn.__version__,
+                **meta,
+            }
+            with open(os.path.join(tmp, "manifest.json"), "w") as f:
+                json.dump(manifest, f, indent=2, default=str)
+            try:
+                os.rename(tmp, os.path.join(self.root, f"v{version}"))
+                break
+            except OSError:  # another process took this number first
+                continue
+        if promote:
+            self.promote(version)
+        return version
+
+    def promoted_at(self):
+        """When a version was last promoted (mtime of CURRENT, epoch seconds); None if never."""
+        try:
+            return os.path.getmtime(os.path.join(self.root, "CURRENT"))
+        except FileNotFoundError:
+            return None
+
+    def promote(self, version):
+        if version not in self.versions():
+            raise ArtifactNotFound(f"{self.name} model v{version} does not exist")
+        tmp = os.path.join(self.root, ".CURRENT.tmp")
+        with open(tmp, "w") as f:
+            f.write(str(version))
+        os.replace(tmp, os.path.join(self.root, "CURRENT"))
+
+    def manifest(self, version):
+        with open(os.path.join(self.root, f"v{version}", "manifest.json")) as f:
+            return json.load(f)
+
+    def load(self, version=None):
+        """(payload, manifest) of `version`, or of the current version when None."""
+        if version is None:
+            version = self.current()
+            if version is None:
+                raise ArtifactNotFound(f"No saved {self.name} model under {self.root}; train one first")
+        path = os.path.join(self.root, f"v{version}", "model.joblib")
+        if not os.path.exists(path):
+            raise ArtifactNotFound(f"{self.name} model v{version} not found at {path}")
+        return joblib.load(path), self.manifest(version)
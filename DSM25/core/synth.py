@@ -0,0 +1,260 @@
+"""
+Seeded synthetic patient_info / patient_lab / notes CSVs in the layout import_data reads.
+
+Nothing in here touches the ORM. Each table is produced in BLOCK-patient blocks,
+every block from its own RNG stream (seed, table, block number), so the output
+for a given seed is the same whatever else is generated, and memory stays flat
+from 10k to 10M patients: a block is formatted and written before the next one
+is drawn.
+
+Labs follow the shipped sample: a Gaussian copula over its empirical marginals
+keeps each column's distribution (range, skew, category frequencies) and the
+rank correlations between columns.
+"""
+import csv
+import gzip
+import io
+import os
+
+import numpy as np
+from scipy.special import ndtr, ndtri
+from scipy.stats import rankdata
+
+from risk.features import ACTIVITY_MAP
+
+BLOCK = 50000
+
+LAB_COLUMNS = [
+    "Age", "BMI", "Systolic_BP", "Diastolic_BP", "Total_Cholesterol", "HDL_Cholesterol",
+    "LDL_Cholesterol", "Triglycerides", "Smoking_Status", "Physical_Activity_Level",
+]
+CATEGORICAL = {"Smoking_Status", "Physical_Activity_Level"}
+DISCRETE = {"Age"} | CATEGORICAL  # sampled as observed values, never interpolated between them
+
+TABLES = {"patient_info": 1, "patient_lab": 2, "notes": 3}  # RNG stream ids
+
+FIRST_NAMES = {
+    "Male": ["james", "john", "robert", "michael", "william", "david", "richard", "joseph", "thomas", "charles",
+             "carlos", "daniel", "matthew", "anthony", "mark", "luis", "steven", "kevin", "brian", "wei"],
+    "Female": ["mary", "patricia", "jennifer", "linda", "elizabeth", "barbara", "susan", "jessica", "sarah", "karen",
+               "maria", "nancy", "lisa", "betty", "sandra", "ashley", "emily", "donna", "michelle", "mei"],
+}
+LAST_NAMES = [
+    "smith", "johnson", "williams", "brown", "jones", "garcia", "miller", "davis", "rodriguez", "martinez",
+    "hernandez", "lopez", "gonzalez", "wilson", "anderson", "thomas", "taylor", "moore", "jackson", "martin",
+    "lee", "perez", "thompson", "white", "harris", "sanchez", "clark", "ramirez", "lewis", "robinson",
+    "walker", "young", "allen", "king", "wright", "scott", "torres", "nguyen", "hill", "flores",
+]
+PREFIXES = {"Male": ["Mr.", "MR", "Dr."], "Female": ["Mrs.", "Ms.", "Miss", "DR"]}
+
+# Surface forms of note.routing.KEYWORDS; generate_data checks each still routes to its specialty
+SPECIALTY_TERMS = {
+    "ENDO": ["insulin", "glucose", "A1c", "metformin", "hyperglycemia", "hypoglycemia", "thyroid"],
+    "CARD": ["chest pain", "MI", "myocardial infarction", "EKG", "stent", "angiogram", "cardio", "statin"],
+    "PCP": ["primary care", "annual exam", "annual physical", "follow-up", "blood pressure", "refill"],
+}
+SPECIALTY_WEIGHTS = {"ENDO": 0.3, "CARD": 0.3, "PCP": 0.3, "OTHER": 0.1}
+TEMPLATES = [
+    "Patient reports {term} concerns since the last visit.",
+    "Discussed {term} and next steps with the patient.",
+    "Review of {term}, documented in the chart.",
+    "Plan: continue current management of {term}.",
+    "History notable for {term}; no acute distress today.",
+    "Ordered labs related to {term}, will call with results.",
+]
+FILLER = [
+    "Vitals reviewed.", "No known drug allergies.", "Patient is alert and oriented.",
+    "Lungs clear to auscultation bilaterally.", "Denies fever, chills or weight loss.",
+    "Medication list reconciled.", "Patient verbalized understanding of the plan.",
+    "Abdomen soft, nontender.", "Skin warm and dry.", "Return precautions given.",
+    "Sleep and appetite are unchanged.", "Social history: lives with family, works full time.",
+]
+SECTIONS = ["SUBJECTIVE:", "OBJECTIVE:", "ASSESSMENT:", "PLAN:"]
+
+
+def rng_for(seed, table, block):
+    return np.random.default_rng([seed, TABLES[table], block])
+
+
+def category_order(column, values):
+    # Order categories so the copula sees a meaningful rank (non-smoker < smoker, low < moderate < high)
+    if column == "Smoking_Status":
+        return sorted(values, key=lambda v: (v.strip().lower() == "smoker", v))
+    return sorted(values, key=lambda v: (ACTIVITY_MAP.get(v.strip().lower(), 0), v))
+
+
+def fit_lab_model(path):
+    """Marginals + rank correlation of a patient_lab CSV (the shipped sample)."""
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    if not rows:
+        raise ValueError(f"{path} has no rows to fit")
+
+    columns, categories = [], {}
+    for name in LAB_COLUMNS:
+        raw = [r.get(name, "") for r in rows]
+        if name in CATEGORICAL:
+            categories[name] = category_order(name, set(raw))
+            codes = {v: i for i, v in enumerate(categories[name])}
+            columns.append(np.array([codes[v] for v in raw], dtype=np.float64))
+        else:
+            columns.append(np.array([float(v or 0) for v in raw], dtype=np.float64))
+    data = np.column_stack(columns)
+
+    # Normal scores of the ranks -> correlation of the Gaussian copula
+    z = ndtri(np.column_stack([rankdata(c) for c in data.T]) / (len(data) + 1))
+    corr = np.corrcoef(z, rowvar=False)
+    return {
+        "sorted": [np.sort(c) for c in data.T],
+        "chol": np.linalg.cholesky(corr + 1e-9 * np.eye(len(corr))),
+        "categories": categories,
+    }
+
+
+def sample_labs(model, rng, n):
+    """n lab rows as a list of column lists in LAB_COLUMNS order (CSV-ready values)."""
+    u = ndtr(rng.standard_normal((n, len(LAB_COLUMNS))) @ model["chol"].T)
+    out = []
+    for j, name in enumerate(LAB_COLUMNS):
+        ref = model["sorted"][j]
+        m = len(ref)
+        if name in DISCRETE:
+            col = ref[np.minimum((u[:, j] * m).astype(np.int64), m - 1)]  # inverse empirical CDF
+        else:
+            col = np.interp(u[:, j] * (m - 1), np.arange(m), ref)
+        if name in CATEGORICAL:
+            out.append([model["categories"][name][int(c)] for c in col])
+        elif name == "Age":
+            out.append(col.astype(np.int64).tolist())
+        else:
+            out.append(col.tolist())
+    return out
+
+
+def patient_rows(rng, start, n):
+    """patient_info rows (index, Name, Gender) for patients start..start+n-1."""
+    genders = np.where(rng.random(n) < 0.5, "Male", "Female")
+    first_pick = rng.integers(0, len(FIRST_NAMES["Male"]), n)
+    last_pick = rng.integers(0, len(LAST_NAMES), n)
+    middle = rng.integers(0, 26, n)
+    has_middle, has_prefix, messy = rng.random((3, n)) < np.array([[0.4], [0.15], [0.05]])
+    prefix_pick = rng.integers(0, 3, n)
+
+    rows = []
+    for i in range(n):
+        g = str(genders[i])
+        parts = [FIRST_NAMES[g][first_pick[i]].title()]
+        if has_middle[i]:
+            parts.append(chr(65 + middle[i]))
+        parts.append(LAST_NAMES[last_pick[i]].title())
+        if has_prefix[i]:
+            options = PREFIXES[g]
+            parts.insert(0, options[prefix_pick[i] % len(options)])
+        name = " ".join(parts)
+        if messy[i]:  # what clean_name has to cope with
+            name = f"  {name.lower()} "
+        rows.append((start + i, name, g))
+    return rows
+
+
+def lab_rows(model, rng, start, n, labs_per_patient):
+    """patient_lab rows for patients start..start+n-1: one or more labs each, in patient order."""
+    counts = 1 + rng.poisson(max(labs_per_patient - 1.0, 0.0), n)
+    refs = np.repeat(np.arange(start, start + n), counts).tolist()
+    return zip(refs, *sample_labs(model, rng, len(refs)))
+
+
+def note_rows(rng, start, n, notes_per_patient, unlabeled):
+    """notes rows (patient index, description, medical_specialty, sample_name, transcription, keywords)."""
+    total = int(rng.poisson(notes_per_patient * n))
+    patients = np.sort(rng.integers(start, start + n, total))
+    specs = rng.choice(list(SPECIALTY_WEIGHTS), total, p=list(SPECIALTY_WEIGHTS.values()))
+    labeled = rng.random(total) >= unlabeled
+    # Every random choice for the block is drawn up front; the loop below only assembles strings
+    widest = max(len(t) for t in SPECIALTY_TERMS.values())
+    term_order = np.argsort(rng.random((total, widest)), axis=1)
+    n_terms = rng.integers(2, 5, total)
+    stray = rng.random(total) < 0.15  # a passing mention from another specialty
+    stray_spec = rng.integers(0, len(SPECIALTY_TERMS), total)
+    stray_term = rng.random(total)
+    templates = rng.integers(0, len(TEMPLATES), (total, widest + 1))
+    filler_order = np.argsort(rng.random((total, len(FILLER))), axis=1)
+    n_filler = rng.integers(4, 8, total)
+    sentence_order = np.argsort(rng.random((total, widest + 1 + len(FILLER))), axis=1)
+    stray_pools = list(SPECIALTY_TERMS.values())
+
+    rows = []
+    for i in range(total):
+        spec = str(specs[i])
+        terms = []
+        if spec != "OTHER":
+            pool = SPECIALTY_TERMS[spec]
+            terms = [pool[k] for k in term_order[i] if k < len(pool)][:n_terms[i]]
+            if stray[i]:
+                other = stray_pools[stray_spec[i]]
+                terms.append(other[int(stray_term[i] * len(other))])
+        body = [TEMPLATES[templates[i, j]].format(term=t) for j, t in enumerate(terms)]
+        body += [FILLER[k] for k in filler_order[i, :n_filler[i]]]
+        body = [body[k] for k in sentence_order[i] if k < len(body)]
+        cuts = [len(body) * s // len(SECTIONS) for s in range(len(SECTIONS) + 1)]
+        transcription = "\n".join(
+            f"{title} " + " ".join(body[cuts[s]:cuts[s + 1]]) for s, title in enumerate(SECTIONS)
+        )
+        rows.append((
+            int(patients[i]),
+            f"Visit regarding {terms[0] if terms else 'general health'}.",
+            spec if labeled[i] else "",
+            f"{spec} - note {start}-{i}",
+            transcription,
+            ", ".join(terms),
+        ))
+    return rows
+
+
+HEADERS = {
+    "patient_info": ["", "Name", "Gender"],
+    "patient_lab": [""] + LAB_COLUMNS,
+    "notes": ["", "description", "medical_specialty", "sample_name", "transcription", "keywords"],
+}
+
+
+def open_sink(path):
+    """Text stream for a CSV being written; .gz paths are compressed (level 1: speed over size)."""
+    if path.endswith(".gz"):
+        return io.TextIOWrapper(gzip.open(path, "wb", compresslevel=1), encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="", buffering=1 << 20)
+
+
+def generate(out_dir, patients, seed=42, sample=None, labs_per_patient=1.0, notes_per_patient=0.5,
+             unlabeled=0.2, gzip_output=False, on_block=None):
+    """
+    Write patient_info.csv, patient_lab.csv and notes.csv for `patients` patients to `out_dir`.
+    `on_block(patients_done, rows_written)` is called after each block. Returns {table: (path, rows)}.
+    """
+    model = fit_lab_model(sample)
+    os.makedirs(out_dir, exist_ok=True)
+    suffix = ".csv.gz" if gzip_output else ".csv"
+    paths = {table: os.path.join(out_dir, table + suffix) for table in HEADERS}
+    counts = dict.fromkeys(HEADERS, 0)
+
+    sinks = {table: open_sink(path) for table, path in paths.items()}
+    try:
+        writers = {table: csv.writer(f) for table, f in sinks.items()}
+        for table, writer in writers.items():
+            writer.writerow(HEADERS[table])
+        for block, start in enumerate(range(0, patients, BLOCK)):
+            n = min(BLOCK, patients - start)
+            produced = {
+                "patient_info": patient_rows(rng_for(seed, "patient_info", block), start, n),
+                "patient_lab": list(lab_rows(model, rng_for(seed, "patient_lab", block), start, n, labs_per_patient)),
+                "notes": note_rows(rng_for(seed, "notes", block), start, n, notes_per_patient, unlabeled),
+            }
+            for table, rows in produced.items():
+                writers[table].writerows(rows)
+                counts[table] += len(rows)
+            if on_block:
+                on_block(start + n, sum(counts.values()))
+    finally:
+        for f in sinks.values():
+            f.close()
+    return {table: (paths[table], counts[table]) for table in HEADERS}
@@ -1,3 +1,466 @@
-from django.test import TestCase
+import contextlib
+import csv
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Max
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+
+from core import bulkload, jobs, queues
+from core.latest import advance_latest_labs, lab_watermark
+from core.models import Clinical_note, Customer, ImportCheckpoint, ImportFingerprint, Job, LatestLab, Patient_lab
+
+PATIENTS = [(0, "jane doe", "female"), (1, "DR bob k lee", "male"), (2, "ann smith", "female")]
+# Patients 0 and 1 have several labs each
+LABS = [
+    (0, 61, 27.5, "non-smoker", "low"),
+    (0, 62, 28.1, "non-smoker", "low"),
+    (1, 45, 31.0, "smoker", "moderate"),
+    (2, 38, 22.4, "non-smoker", "high"),
+    (1, 46, 30.2, "smoker", "moderate"),
+    (0, 63, 28.9, "non-smoker", "moderate"),
+    (1, 47, 29.8, "non-smoker", "moderate"),
+]
+NOTES = [
+    (0, "desc", "ENDO", "s0", "patient on insulin, a1c 8", "kw"),
+    (1, "desc", "CARD", "s1", "chest pain, ekg ordered", "kw"),
+    (2, "desc", "", "s2", "annual exam, refill meds", "kw"),
+]
+
+
+def write_csv(path, header, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def dead_pid():
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+class IncrementalImportTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.paths = {name: os.path.join(self.tmp.name, f"{name}.csv") for name in ("patients", "labs", "notes")}
+        write_csv(self.paths["patients"], ["", "Name", "Gender"], PATIENTS)
+        write_csv(self.paths["labs"], ["", "Age", "BMI", "Systolic_BP", "Diastolic_BP", "Total_Cholesterol",
+                                       "HDL_Cholesterol", "LDL_Cholesterol", "Triglycerides", "Smoking_Status",
+                                       "Physical_Activity_Level"],
+                  [(ref, age, bmi, 120, 80, 190, 50, 110, 140, smoking, activity)
+                   for ref, age, bmi, smoking, activity in LABS])
+        write_csv(self.paths["notes"], ["", "description", "medical_specialty", "sample_name", "transcription",
+                                        "keywords"], NOTES)
+
+    def load(self, *extra, **options):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            call_command("import_data", *extra, populate=True, skip_ml=True, **{**self.paths, **options})
+        return out.getvalue()
+
+    def counts(self):
+        return Customer.objects.count(), Patient_lab.objects.count(), Clinical_note.objects.count()
+
+    def test_every_lab_row_is_loaded_whatever_the_batch_size(self):
+        self.load(incremental=True, batch_size=1)
+        by_one = sorted(Patient_lab.objects.values_list("Patient_id__CustFirstName", "Age"))
+        Patient_lab.objects.all().delete()
+        Customer.objects.all().delete()
+        ImportFingerprint.objects.all().delete()
+        ImportCheckpoint.objects.all().delete()
+
+        self.load(incremental=True, batch_size=5000)
+        self.assertEqual(sorted(Patient_lab.objects.values_list("Patient_id__CustFirstName", "Age")), by_one)
+        self.assertEqual(len(by_one), len(LABS))
+        self.assertEqual(Patient_lab.objects.filter(Patient_id__CustFirstName="Bob").count(), 3)
+
+    def test_rerun_is_a_no_op(self):
+        self.load(incremental=True, batch_size=2)
+        first = self.counts()
+        self.assertEqual(first, (len(PATIENTS), len(LABS), len(NOTES)))
+
+        # Same files: every shard is already complete
+        self.load(incremental=True, batch_size=2)
+        self.assertEqual(self.counts(), first)
+
+        # Touched but unchanged files: re-read, every row matches its fingerprint
+        for path in self.paths.values():
+            os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10 ** 9))
+        out = self.load(incremental=True, batch_size=3)
+        self.assertEqual(self.counts(), first)
+        self.assertIn(f"Patient_lab: 0 inserted, 0 updated, {len(LABS)} skipped", out)
+
+    def test_changed_lab_row_is_loaded_as_a_new_version(self):
+        self.load(incremental=True)
+        rows = list(csv.reader(open(self.paths["labs"], newline="")))
+        rows[4][1] = "39"  # patient 2's only lab
+        write_csv(self.paths["labs"], rows[0], rows[1:])
+        out = self.load(incremental=True)
+        self.assertIn(f"Patient_lab: 1 inserted, 0 updated, {len(LABS) - 1} skipped", out)
+        self.assertEqual(Patient_lab.objects.count(), len(LABS) + 1)
+        ages = Patient_lab.objects.filter(Patient_id__CustFirstName="Ann").order_by("id").values_list("Age", flat=True)
+        self.assertEqual(list(ages), [38, 39])
+
+    def test_cumulative_extract_in_a_new_shard_loads_only_new_rows(self):
+        self.load(incremental=True)
+        rows = list(csv.reader(open(self.paths["labs"], newline="")))
+        extra = [["2", "39", "22.0", "120", "80", "190", "50", "110", "140", "non-smoker", "high"],
+                 ["0", "64", "29.3", "120", "80", "190", "50", "110", "140", "non-smoker", "low"]]
+        # The next day's extract holds every row again plus new ones, in a different order
+        cumulative = os.path.join(self.tmp.name, "labs-day2.csv")
+        write_csv(cumulative, rows[0], rows[:0:-1] + extra)
+        out = self.load(incremental=True, labs=os.path.join(self.tmp.name, "labs*.csv"))
+        self.assertIn(f"Patient_lab: 2 inserted, 0 updated, {len(LABS)} skipped", out)
+        self.assertEqual(Patient_lab.objects.count(), len(LABS) + 2)
+
+    def test_row_inserted_mid_file_does_not_reload_later_rows(self):
+        self.load(incremental=True)
+        rows = list(csv.reader(open(self.paths["labs"], newline="")))
+        rows.insert(2, ["1", "48", "29.0", "120", "80", "190", "50", "110", "140", "smoker", "low"])
+        write_csv(self.paths["labs"], rows[0], rows[1:])
+        out = self.load(incremental=True)
+        self.assertIn(f"Patient_lab: 1 inserted, 0 updated, {len(LABS)} skipped", out)
+        self.assertEqual(Patient_lab.objects.count(), len(LABS) + 1)
+
+    def test_interrupted_load_resumes_from_the_checkpoint_offset(self):
+        from core.management.commands import import_data
+
+        real = import_data.advance_latest_labs
+        calls = []
+
+        def fail_on_second_batch(watermark):
+            calls.append(watermark)
+            if len(calls) == 2:
+                raise RuntimeError("interrupted")
+            return real(watermark)
+
+        with mock.patch.object(import_data, "advance_latest_labs", fail_on_second_batch):
+            with self.assertRaises(RuntimeError):
+                self.load(incremental=True, batch_size=3)
+        # The first lab batch committed with its checkpoint, the second rolled back
+        checkpoint = ImportCheckpoint.objects.get(Mode=ImportCheckpoint.INCREMENTAL, Source="patient_lab",
+                                                  Path=os.path.abspath(self.paths["labs"]))
+        self.assertEqual((checkpoint.Rows, checkpoint.Completed), (3, False))
+        self.assertGreater(checkpoint.Offset, 0)
+        self.assertEqual(Patient_lab.objects.count(), 3)
+
+        out = self.load(incremental=True, batch_size=3)
+        self.assertIn(f"resuming {self.paths['labs']} at byte {checkpoint.Offset} (row 3)", out)
+        self.assertIn(f"Patient_lab: {len(LABS) - 3} inserted, 0 updated, 0 skipped", out)
+        self.assertEqual(self.counts(), (len(PATIENTS), len(LABS), len(NOTES)))
+        self.assertEqual(ImportFingerprint.objects.filter(Source="patient_lab").count(), len(LABS))
+
+    def test_duplicate_keys_in_a_batch_are_counted(self):
+        write_csv(self.paths["patients"], ["", "Name", "Gender"], PATIENTS + [(2, "ann smyth", "female")])
+        out = self.load(incremental=True)
+        self.assertIn("Customer: 3 inserted, 0 updated, 0 skipped, 1 collapsed into a later row with the same key",
+                      out)
+        self.assertTrue(Customer.objects.filter(CustFirstName="Ann", CustLastName="Smyth").exists())
+
+    def test_incremental_ignores_bulk_checkpoints(self):
+        self.load(bulk=True)
+        bulk = self.counts()
+        self.assertEqual(bulk, (len(PATIENTS), len(LABS), len(NOTES)))
+        self.assertFalse(ImportFingerprint.objects.exists())
+        out = self.load(bulk=True)
+        self.assertIn("already loaded, skipping", out)
+        self.assertEqual(self.counts(), bulk)
+
+        # Bulk-mode checkpoints do not make the incremental load skip the files: it fingerprints every row
+        out = self.load(incremental=True)
+        self.assertIn("was bulk loaded, which records no fingerprints", out)
+        self.assertEqual(ImportFingerprint.objects.count(), len(PATIENTS) + len(LABS) + len(NOTES))
+
+        # From then on incremental runs are idempotent, even after the files are touched
+        loaded = self.counts()
+        for path in self.paths.values():
+            os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10 ** 9))
+        self.load(incremental=True)
+        self.assertEqual(self.counts(), loaded)
+
+
+class ColumnarLabImportTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.paths = {name: os.path.join(self.tmp.name, f"{name}.csv") for name in ("patients", "labs", "notes")}
+        write_csv(self.paths["patients"], ["", "Name", "Gender"], PATIENTS)
+        write_csv(self.paths["notes"], ["", "description", "medical_specialty", "sample_name", "transcription",
+                                        "keywords"], NOTES)
+        self.rejects = os.path.join(self.tmp.name, "rejects.csv")
+
+    def load(self, lab_lines=None, **options):
+        if lab_lines is not None:
+            with open(self.paths["labs"], "w", encoding="utf-8") as f:
+                f.write(",Age,BMI,Systolic_BP,Diastolic_BP,Total_Cholesterol,HDL_Cholesterol,LDL_Cholesterol,"
+                        "Triglycerides,Smoking_Status,Physical_Activity_Level\n")
+                f.writelines(line + "\n" for line in lab_lines)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            call_command("import_data", populate=True, skip_ml=True, columnar_labs=True, rejects=self.rejects,
+                         **{**self.paths, **options})
+        return out.getvalue()
+
+    def test_bad_rows_are_rejected_not_fatal(self):
+        out = self.load([
+            "0,61,27.5,120,80,190,50,110,140,non-smoker,low",
+            "1,45,31.0,120,80,190,50,110,140,smoker,moderate,extra",
+            "2,38,abc,120,80,190,50,110,140,non-smoker,high",
+            "",
+            "x,50,25.0,120,80,190,50,110,140,non-smoker,high",
+            '1,46,30.2,120,80,190,50,110,140,"smoker",moderatemoderatemoderate',
+            "2,39,22.0,120,80,190,50,110,140,non-smoker,high",
+        ], batch_size=3)
+        self.assertIn("Rejected 4 lab rows", out)
+        with open(self.rejects, newline="") as f:
+            rejects = [row[1:] for row in csv.reader(f)][1:]
+        self.assertEqual(rejects, [
+            ["2", "1", "expected 11 fields, found 12"],
+            ["3", "2", "BMI missing or outside [5, 100]"],
+            ["5", "", "missing or malformed index"],
+            ["6", "1", "unknown Physical_Activity_Level"],
+        ])
+        self.assertEqual(sorted(Patient_lab.objects.values_list("Age", flat=True)), [39, 61])
+
+        # Rows counts source rows consumed, as in the bulk path
+        checkpoint = ImportCheckpoint.objects.get(Mode=ImportCheckpoint.BULK, Source="patient_lab")
+        self.assertEqual((checkpoint.Rows, checkpoint.Completed), (7, True))
+        self.assertEqual(checkpoint.Offset, os.path.getsize(self.paths["labs"]))
+
+    def test_interrupted_load_resumes_after_the_last_block(self):
+        from core.management.commands import import_data
+
+        lines = [f"{i % 3},{40 + i},25.0,120,80,190,50,110,140,non-smoker,low" for i in range(7)]
+        real = import_data.advance_latest_labs
+        calls = []
+
+        def fail_on_second_block(watermark):
+            calls.append(watermark)
+            if len(calls) == 2:
+                raise RuntimeError("interrupted")
+            return real(watermark)
+
+        with mock.patch.object(import_data, "advance_latest_labs", fail_on_second_block):
+            with self.assertRaises(RuntimeError):
+                self.load(lines, batch_size=3)
+        self.assertEqual(Patient_lab.objects.count(), 3)
+        self.load(batch_size=3)
+        self.assertEqual(sorted(Patient_lab.objects.values_list("Age", flat=True)), list(range(40, 47)))
+
+
+class BulkLoadRecoveryTests(TransactionTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.journal = os.path.join(tmp.name, "db.bulkload.json")
+        patcher = mock.patch.object(bulkload, "_journal_path", lambda: self.journal)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def indexes(self):
+        with connection.cursor() as cursor:
+            return {name for name, _ in bulkload._secondary_indexes(cursor, Patient_lab._meta.db_table)}
+
+    def crash_mid_load(self, pid):
+        # What bulk_load_mode leaves behind when its process is killed mid-load
+        table = Patient_lab._meta.db_table
+        with connection.cursor() as cursor:
+            indexes = dict(bulkload._secondary_indexes(cursor, table))
+            cursor.execute("PRAGMA journal_mode")
+            bulkload._write_journal({"journal_mode": cursor.fetchone()[0], "indexes": indexes, "pid": pid})
+            for name in indexes:
+                cursor.execute(f"DROP INDEX {connection.ops.quote_name(name)}")
+        self.assertTrue(indexes)
+        self.assertFalse(self.indexes())
+        return set(indexes)
+
+    def test_next_plain_command_restores_indexes(self):
+        before = self.crash_mid_load(dead_pid())
+
+        out = io.StringIO()
+        call_command("rebuild_latest_labs", stdout=out)
+        self.assertIn("recovered from an interrupted load", out.getvalue())
+        self.assertEqual(self.indexes(), before)
+        self.assertFalse(os.path.exists(self.journal))
+
+    def test_journal_of_a_running_load_is_left_alone(self):
+        self.crash_mid_load(os.getppid())
+        self.assertEqual(bulkload.recover_interrupted_load(log=lambda msg: None), 0)
+        self.assertTrue(os.path.exists(self.journal))
+        bulkload.restore_indexes()
+
+
+class JobQueueTests(TestCase):
+    def running(self, command, worker, heartbeat_age=0):
+        now = timezone.now()
+        return Job.objects.create(Command=command, Status=Job.RUNNING, Worker=worker, Started_at=now,
+                                  Heartbeat_at=now - timedelta(seconds=heartbeat_age))
+
+    def test_in_flight_command_is_not_queued_twice(self):
+        first = jobs.enqueue("import_data")
+        self.assertEqual(first.Options, jobs.JOB_COMMANDS["import_data"])
+        with self.assertRaises(jobs.JobInFlight) as raised:
+            jobs.enqueue("import_data")
+        self.assertEqual(raised.exception.job, first)
+        jobs.enqueue("score_diabetes")
+
+        jobs._finish(first, Job.SUCCEEDED)
+        self.assertNotEqual(jobs.enqueue("import_data"), first)
+
+    def test_unknown_command_is_rejected(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue("flush")
+
+    def test_claims_oldest_queued_job_once(self):
+        older = jobs.enqueue("score_diabetes")
+        newer = jobs.enqueue("import_data")
+        Job.objects.filter(pk=newer.pk).update(Created_at=older.Created_at - timedelta(seconds=1))
+
+        claimed = jobs.claim_next()
+        self.assertEqual((claimed, claimed.Status, claimed.Worker), (newer, Job.RUNNING, jobs.worker_name()))
+        self.assertEqual(jobs.claim_next(), older)
+        self.assertIsNone(jobs.claim_next())
+
+    def test_job_claimed_by_another_worker_is_skipped(self):
+        first, second = jobs.enqueue("import_data"), jobs.enqueue("score_diabetes")
+        real_update = type(Job.objects.all()).update
+        raced = []
+
+        def update(qs, **fields):
+            # Another worker claims the first job between our read and our compare-and-set
+            if not raced:
+                raced.append(real_update(Job.objects.filter(pk=first.pk), Status=Job.RUNNING, Worker="other:1"))
+            return real_update(qs, **fields)
+
+        with mock.patch.object(type(Job.objects.all()), "update", update):
+            self.assertEqual(jobs.claim_next(), second)
+        first.refresh_from_db()
+        self.assertEqual(first.Worker, "other:1")
+
+    def test_orphans_are_failed(self):
+        host = jobs.socket.gethostname()
+        dead = self.running("import_data", f"{host}:{dead_pid()}")
+        alive = self.running("score_diabetes", jobs.worker_name())
+        stale = self.running("note_classifier", "elsewhere:1", heartbeat_age=jobs.ORPHAN_AFTER + 1)
+
+        self.assertEqual(jobs.fail_orphans(), 2)
+        statuses = dict(Job.objects.values_list("pk", "Status"))
+        self.assertEqual([statuses[j.pk] for j in (dead, alive, stale)], [Job.FAILED, Job.RUNNING, Job.FAILED])
+        self.assertIn("No heartbeat", Job.objects.get(pk=stale.pk).Error)
+
+    def test_enqueue_replaces_an_orphaned_run(self):
+        orphan = self.running("import_data", "elsewhere:1", heartbeat_age=jobs.ORPHAN_AFTER + 1)
+        job = jobs.enqueue("import_data")
+        self.assertEqual(job.Status, Job.QUEUED)
+        self.assertEqual(Job.objects.get(pk=orphan.pk).Status, Job.FAILED)
+
+        self.running("score_diabetes", "elsewhere:1")
+        with self.assertRaises(jobs.JobInFlight):
+            jobs.enqueue("score_diabetes")
+
+    def test_run_records_the_outcome(self):
+        job = Job.objects.create(Command="no_such_command", Status=Job.RUNNING, Started_at=timezone.now())
+        self.assertEqual(jobs.run(job), Job.FAILED)
+        job.refresh_from_db()
+        self.assertIn("Unknown command", job.Error)
+        self.assertIsNotNone(job.Duration)
+
+
+class QueueHelperTests(SimpleTestCase):
+    def test_page_size_is_clamped_to_the_offered_sizes(self):
+        factory = RequestFactory()
+        for raw, want in [(None, 25), ("50", 50), ("100", 100), ("1000000", 25), ("-5", 25), ("abc", 25), ("", 25)]:
+            with self.subTest(raw=raw):
+                request = factory.get("/", {} if raw is None else {"page_size": raw})
+                self.assertEqual(queues.page_size_from(request), want)
+
+    def test_csv_is_streamed_in_blocks(self):
+        consumed = []
+
+        def rows():
+            for i in range(5):
+                consumed.append(i)
+                yield (i, f"name, {i}")
+
+        with mock.patch.object(queues, "EXPORT_CHUNK", 2):
+            response = queues.csv_response("out.csv", ["id", "name"], rows())
+            self.assertTrue(response.streaming)
+            self.assertEqual(response["Content-Disposition"], 'attachment; filename="out.csv"')
+            chunks = iter(response.streaming_content)
+            self.assertEqual(next(chunks), b"id,name\r\n")
+            self.assertEqual(consumed, [])  # nothing is read before the header goes out
+            self.assertEqual(next(chunks), b'0,"name, 0"\r\n1,"name, 1"\r\n')
+            self.assertEqual(consumed, [0, 1])
+            self.assertEqual(list(chunks), [b'2,"name, 2"\r\n3,"name, 3"\r\n', b'4,"name, 4"\r\n'])
+
+
+class LatestLabTests(TestCase):
+    def setUp(self):
+        self.a, self.b = (Customer.objects.create(CustFirstName=name, CustLastName="Test", CustMiddleInit="",
+                                                  CustSuffix="", Gender="female") for name in ("A", "B"))
+
+    def lab(self, patient, create=True, age=50):
+        lab = Patient_lab(Patient_id=patient, Age=age, BMI=25, Systolic_BP=120, Diastolic_BP=80,
+                          Total_Cholesterol=190, HDL_Cholesterol=50, LDL_Cholesterol=110, Triglycerides=120,
+                          Smoking_status=False, Physical_activity="low")
+        if create:
+            lab.save()
+        return lab
+
+    def pointers(self):
+        return dict(LatestLab.objects.values_list("Patient_id", "Lab"))
+
+    def test_saves_and_deletes_move_the_pointer(self):
+        a1, a2, b1 = self.lab(self.a), self.lab(self.a), self.lab(self.b)
+        self.lab(None)
+        self.assertEqual(self.pointers(), {self.a.pk: a2.pk, self.b.pk: b1.pk})
+
+        a2.Age = 51
+        a2.save()  # an update does not move anything
+        a2.delete()
+        self.assertEqual(self.pointers(), {self.a.pk: a1.pk, self.b.pk: b1.pk})
+        b1.delete()
+        self.assertEqual(self.pointers(), {self.a.pk: a1.pk})
+
+    def test_bulk_insert_is_caught_up_in_one_upsert(self):
+        a1 = self.lab(self.a)
+        watermark = lab_watermark()
+        Patient_lab.objects.bulk_create([self.lab(p, create=False) for p in (self.a, self.b, self.b, None)])
+        self.assertEqual(self.pointers(), {self.a.pk: a1.pk})  # bulk_create sends no signals
+
+        self.assertEqual(advance_latest_labs(watermark), 2)
+        newest = dict(Patient_lab.objects.filter(Patient_id__isnull=False).values("Patient_id")
+                      .annotate(m=Max("id")).values_list("Patient_id", "m"))
+        self.assertEqual(self.pointers(), newest)
+
+    def test_pointer_never_moves_backwards(self):
+        a1, a2 = self.lab(self.a), self.lab(self.a)
+        LatestLab.objects.filter(Patient_id=self.a).delete()
+        self.lab(self.b)
+        advance_latest_labs(a2.pk)  # only newer labs: A gets no pointer from this call
+        self.assertNotIn(self.a.pk, self.pointers())
+        advance_latest_labs(0)
+        self.assertEqual(self.pointers()[self.a.pk], a2.pk)
+        self.assertEqual(advance_latest_labs(a1.pk - 1), 0)
+
+    def test_rebuild_command_repairs_the_table(self):
+        a1, a2, b1 = self.lab(self.a), self.lab(self.a), self.lab(self.b)
+        LatestLab.objects.filter(Patient_id=self.a).update(Lab=a1)
+        LatestLab.objects.filter(Patient_id=self.b).delete()
+
+        out = io.StringIO()
+        call_command("rebuild_latest_labs", stdout=out)
+        self.assertIn("LatestLab rebuilt: 2 patients", out.getvalue())
+        self.assertEqual(self.pointers(), {self.a.pk: a2.pk, self.b.pk: b1.pk})
@@ -7,4 +7,5 @@ urlpatterns = [
     path('import_data/', views.import_data, name='import_data'),
     path('score_diabetes/', views.run_score_diabetes, name='score_diabetes'),
     path('note_classifier/', views.run_note_classifier, name='note_classifier'),
-]
\ No newline at end of file
+    path('jobs/status/', views.job_status, name='job_status'),
+]
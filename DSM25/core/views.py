@@ -1,6 +1,9 @@
 from django.shortcuts import render, redirect
 from django.contrib import messages
-from django.core.management import call_command
+from django.http import JsonResponse
+
+from core import jobs
+from core.models import Job
 
 # Create your views here.
 def home(request):
@@ -9,29 +12,34 @@ def home(request):
 def management(request):
     return render(request, 'core/management.html')
 
+def _enqueue(request, command):
+    # Queue the command for the run_jobs worker instead of running it inside the request
+    try:
+        job = jobs.enqueue(command)
+        messages.success(request, f'{command} queued as job #{job.pk}.')
+    except jobs.JobInFlight as e:
+        messages.warning(request, f'{e}; not queued again.')
+    return redirect('management')
+
 def import_data(request):
     if request.method == 'POST':
-        try:
-            call_command('import_data', populate=True)
-            messages.success(request, 'import_data command ran successfully!')
-        except Exception as e:
-            messages.error(request, f'Error: {e}')
-        return redirect('management')
+        return _enqueue(request, 'import_data')
+    return redirect('management')
 
 def run_score_diabetes(request):
     if request.method == 'POST':
-        try:
-            call_command("score_diabetes", fraction=0.05)
-            messages.success(request, 'score_diabetes command ran successfully!')
-        except Exception as e:
-            messages.error(request, f'Error: {e}')
-        return redirect('management')
+        return _enqueue(request, 'score_diabetes')
+    return redirect('management')
 
 def run_note_classifier(request):
     if request.method == 'POST':
-        try:
-            call_command("note_classifier", min_labels=50)
-            messages.success(request, 'note_classifier command ran successfully!')
-        except Exception as e:
-            messages.error(request, f'Error: {e}')
-        return redirect('management')
\ No newline at end of file
+        return _enqueue(request, 'note_classifier')
+    return redirect('management')
+
+def job_status(request):
+    # Polled by the management page: recent jobs, newest first
+    recent = Job.objects.order_by('-id')[:10]
+    return JsonResponse({
+        'jobs': [jobs.job_status(job) for job in recent],
+        'in_flight': Job.objects.filter(Status__in=Job.IN_FLIGHT).count(),
+    })
@@ -1,70 +1,72 @@
 from __future__ import annotations
 
-from typing import List, Tuple
-import re
-import numpy as np
-import pandas as pd
+from contextlib import nullcontext
+import hashlib
+from itertools import islice
 
 from django.core.management.base import BaseCommand
-from django.db.models import Exists, OuterRef
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Length
 from django.utils import timezone
 
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.linear_model import LogisticRegression
-
+from core.bulkload import bulk_load_mode, recover_interrupted_load
+from core.jobs import progress
 from core.models import Clinical_note, NotePrediction
+from note.model import (
+    KEYWORD_VERSION, find_model, find_streaming_model, fit_note_model, new_streaming_model, partial_fit_chunk,
+    registry, streaming_registry, training_fingerprint, version_tag,
+)
+from note.predict import join_note_text, predicted_chunks
 
-# -------------------------
-# Keyword fallback (if not enough labels)
-# -------------------------
-KEYWORDS = {
-    "ENDO": [
-        r"\binsulin\b", r"\bglucose\b", r"\ba1c\b", r"\bmetformin\b",
-        r"\bhyperglyc?emia\b", r"\bhypoglyc?emia\b", r"\bthyroid\b",
-    ],
-    "CARD": [
-        r"\bchest pain\b", r"\bmi\b", r"\bmyocard(ial|ium)\b", r"\bekg\b",
-        r"\bstent\b", r"\bangiogram\b", r"\bcardio\b", r"\bstatin\b",
-    ],
-    "PCP": [
-        r"\bprimary care\b", r"\bannual (exam|visit|physical)\b",
-        r"\bfollow[- ]?up\b", r"\bblood pressure\b", r"\brefill\b",
-    ],
-}
-
-def keyword_route(text: str) -> Tuple[str, float]:
-    """Return (specialty, confidence[0..1]) via transparent keyword rules."""
-    t = text.lower()
-    scores = []
-    for spec, patterns in KEYWORDS.items():
-        hits = sum(1 for p in patterns if re.search(p, t))
-        scores.append((spec, hits))
-    # pick best, break ties deterministically
-    best_spec, best_hits = max(scores, key=lambda x: (x[1], x[0]))
-    if best_hits == 0:
-        return "OTHER", 0.50  # low confidence default
-    total_hits = sum(h for _, h in scores) or 1
-    conf = min(0.95, 0.60 + 0.35 * (best_hits / total_hits))
-    return best_spec, float(conf)
+STREAM_CHUNK = 5000
 
 # -------------------------
 # Helpers
 # -------------------------
 
 def text_for(note: Clinical_note) -> str:
-    # Build a single text field (Transcription primary; add Description/Keywords if present)
-    parts = [note.Transcription or ""]
-    if getattr(note, "Description", ""):
-        parts.append(note.Description)
-    if getattr(note, "Keywords", ""):
-        parts.append(note.Keywords)
-    return "\n".join(parts).strip()
+    return join_note_text(note.Transcription, getattr(note, "Description", ""), getattr(note, "Keywords", ""))
 
 def labeled_qs():
     return Clinical_note.objects.exclude(Medical_specialty__isnull=True).exclude(Medical_specialty="").only(
         "id","Medical_specialty","Transcription","Description","Keywords"
     )
 
+def label_classes():
+    return sorted({s.strip().upper() for s in labeled_qs().values_list("Medical_specialty", flat=True).distinct()} - {""})
+
+def labeled_chunks(after_id=0, upto_id=None, chunk_size=STREAM_CHUNK):
+    """Yield (last note id, texts, labels) per `chunk_size` labeled notes with after_id < id <= upto_id."""
+    qs = labeled_qs().filter(id__gt=after_id)
+    if upto_id is not None:
+        qs = qs.filter(id__lte=upto_id)
+    it = qs.order_by("id").values_list("id", "Medical_specialty", "Transcription", "Description", "Keywords") \
+        .iterator(chunk_size=chunk_size)
+    while rows := list(islice(it, chunk_size)):
+        texts, labels = [], []
+        for _, spec, transcription, description, keywords in rows:
+            text, label = join_note_text(transcription, description, keywords), spec.strip().upper()
+            if text and label:
+                texts.append(text)
+                labels.append(label)
+        yield rows[-1][0], texts, labels
+
+def labels_digest(upto_id):
+    """
+    Cheap change marker for the labeled notes with id <= upto_id: hashes ids, labels and
+    text lengths (computed in the DB) rather than the texts themselves.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    rows = (
+        labeled_qs().filter(id__lte=upto_id).order_by("id")
+        .annotate(n=Length("Transcription") + Length("Description") + Length("Keywords"))
+        .values_list("id", "Medical_specialty", "n").iterator(chunk_size=20000)
+    )
+    for note_id, spec, n in rows:
+        h.update(f"{note_id}:{spec}:{n};".encode())
+    return h.hexdigest()
+
 def unlabeled_or_unpredicted_qs():
     # notes without any prediction yet
     sub = NotePrediction.objects.filter(Note_id=OuterRef("pk"))
@@ -72,6 +74,35 @@ def unlabeled_or_unpredicted_qs():
         "id","Transcription","Description","Keywords"
     )
 
+def outdated_qs(model_version):
+    # notes whose latest prediction came from another model version (or the keyword fallback);
+    # without a version (unsaved model) nothing can be told apart, so nothing is selected
+    if model_version is None:
+        return Clinical_note.objects.none()
+    latest = NotePrediction.objects.filter(Note_id=OuterRef("pk")).order_by("-Predicted_at", "-id")
+    return Clinical_note.objects.annotate(latest_version=Subquery(latest.values("Model_version")[:1])).filter(
+        Q(latest_version__isnull=False) & ~Q(latest_version=model_version)
+    ).only("id","Transcription","Description","Keywords")
+
+def note_chunks(qs, chunk_size=STREAM_CHUNK, limit=None):
+    """
+    Yield (note ids, texts) for the notes in `qs`, `chunk_size` at a time in id order.
+    Pages by id (not OFFSET), so notes predicted by earlier chunks do not shift later pages.
+    """
+    after, left = 0, limit
+    while left is None or left > 0:
+        size = chunk_size if left is None else min(chunk_size, left)
+        rows = list(
+            qs.filter(id__gt=after).order_by("id")
+            .values_list("id", "Transcription", "Description", "Keywords")[:size]
+        )
+        if not rows:
+            return
+        yield [r[0] for r in rows], [join_note_text(*r[1:]) for r in rows]
+        after = rows[-1][0]
+        if left is not None:
+            left -= len(rows)
+
 # -------------------------
 # Command
 # -------------------------
@@ -83,97 +114,205 @@ class Command(BaseCommand):
         parser.add_argument("--min-labels", type=int, default=50, help="Need at least this many labeled notes to train.")
         parser.add_argument("--dry-run", action="store_true", help="Show what would happen without writing predictions.")
         parser.add_argument("--max", type=int, default=None, help="Limit number of new notes to predict (debug).")
+        parser.add_argument("--budget", type=int, default=None,
+                            help="Re-predict at most this many notes whose latest prediction came from an older "
+                                 "model or keyword routing (default: all of them; 0: none)")
+        parser.add_argument("--bulk-load", action="store_true",
+                            help="SQLite: WAL + relaxed sync while writing NotePrediction chunks")
+        parser.add_argument("--retrain", action="store_true",
+                            help="Refit even if a saved model matches the current labeled notes")
+        parser.add_argument("--streaming", action="store_true",
+                            help="Out-of-core model: hashed features + SGD partial_fit over DB chunks, updated "
+                                 "with only the labels added since the last run (constant memory)")
+        parser.add_argument("--epochs", type=int, default=5,
+                            help="With --streaming: passes over the labeled notes on a full (re)fit (default 5)")
+        parser.add_argument("--chunk-size", type=int, default=STREAM_CHUNK,
+                            help="Notes read, predicted and committed per chunk (with --streaming also labeled "
+                                 f"notes fitted per chunk; default {STREAM_CHUNK})")
+        parser.add_argument("--workers", type=int, default=1,
+                            help="Processes vectorizing and predicting chunks in parallel; the model is sent "
+                                 "to each once (default 1: in-process)")
 
     def handle(self, *args, **opts):
+        recover_interrupted_load(self.stdout.write)
         min_labels = opts["min_labels"]
         dry = opts["dry_run"]
         limit = opts["max"]
 
         # 1) Build training set if available
-        L = list(labeled_qs().values("id", "Medical_specialty", "Transcription", "Description", "Keywords"))
-        y_labels = [row["Medical_specialty"].strip().upper() for row in L]
-        X_texts = [text_for(Clinical_note(id=row["id"], Transcription=row["Transcription"],
-                                          Description=row["Description"], Keywords=row["Keywords"])) for row in L]
-        # Drop empties / normalize
-        train_pairs = [(t, y) for t, y in zip(X_texts, y_labels) if t and y]
-        X_texts = [t for t, _ in train_pairs]
-        y_labels = [y for _, y in train_pairs]
-
-        use_supervised = len(train_pairs) >= min_labels and len(set(y_labels)) >= 2
-
-        if use_supervised:
-            # 2) Train simple TF-IDF + LogisticRegression (multiclass) on ALL labeled notes
-            vect = TfidfVectorizer(lowercase=True, stop_words="english",
-                                   ngram_range=(1,2), min_df=2, max_df=0.95)
-            X = vect.fit_transform(X_texts)
-            clf = LogisticRegression(max_iter=1000, n_jobs=None, multi_class="auto")
-            clf.fit(X, y_labels)
-
-        # 3) Select notes to score (those with no prediction)
-        P = unlabeled_or_unpredicted_qs()
-        if limit:
-            P = P.order_by("id")[:limit]
-        P = list(P)
-        if not P:
-            self.stdout.write(self.style.WARNING("No new notes to score."))
-            return
+        if opts["streaming"]:
+            artifact, n_train, classes, version = self.streaming_model(min_labels, dry, opts)
+            use_supervised = artifact is not None
+        else:
+            progress(step="Loading labeled notes")
+            L = list(labeled_qs().values("id", "Medical_specialty", "Transcription", "Description", "Keywords"))
+            y_labels = [row["Medical_specialty"].strip().upper() for row in L]
+            X_texts = [text_for(Clinical_note(id=row["id"], Transcription=row["Transcription"],
+                                              Description=row["Description"], Keywords=row["Keywords"])) for row in L]
+            # Drop empties / normalize
+            train_pairs = [(t, y) for t, y in zip(X_texts, y_labels) if t and y]
+            X_texts = [t for t, _ in train_pairs]
+            y_labels = [y for _, y in train_pairs]
 
-        now = timezone.now()
-        to_create = []
-
-        if use_supervised:
-            self.stdout.write(self.style.SUCCESS(f"Training set: {len(train_pairs)} notes, classes={sorted(set(y_labels))}"))
-            texts = [text_for(n) for n in P]
-            Xp = vect.transform(texts)
-            # Probabilities for confidence
-            try:
-                probs = clf.predict_proba(Xp)
-                preds = clf.classes_[np.argmax(probs, axis=1)]
-                confs = probs.max(axis=1)
-            except Exception:
-                # Fallback if probas not available
-                decision = clf.decision_function(Xp)
-                if decision.ndim == 1:
-                    # Binary-like decision → pseudo-proba
-                    confs = 1.0 / (1.0 + np.exp(-np.abs(decision)))
-                    preds = np.where(decision >= 0, clf.classes_[1], clf.classes_[0])
+            n_train, classes = len(train_pairs), sorted(set(y_labels))
+            use_supervised = n_train >= min_labels and len(classes) >= 2
+
+            if use_supervised:
+                # 2) Reuse the saved model fitted on exactly these labeled notes, else train
+                # TF-IDF + LogisticRegression (multiclass) on ALL of them and save it
+                fingerprint = training_fingerprint(X_texts, y_labels)
+                found = None if opts["retrain"] else find_model(fingerprint)
+                if found:
+                    artifact, manifest = found
+                    version = manifest["version"]
+                    if not dry:
+                        registry.promote(version)  # this run's family becomes the active one
+                    self.stdout.write(self.style.HTTP_INFO(
+                        f"Labeled notes unchanged: using saved note model v{manifest['version']} "
+                        f"(trained {manifest['created_at']})"
+                    ))
                 else:
-                    # Multiclass decision → softmax
-                    e = np.exp(decision - decision.max(axis=1, keepdims=True))
-                    probs = e / e.sum(axis=1, keepdims=True)
-                    preds = clf.classes_[np.argmax(probs, axis=1)]
-                    confs = probs.max(axis=1)
-
-            for note, spec, c in zip(P, preds, confs):
-                to_create.append(NotePrediction(
-                    Note=note,
-                    Predicted_specialty=str(spec).upper(),
-                    Confidence=float(c),
-                    Predicted_at=now,
-                ))
-        else:
+                    progress(step="Training TF-IDF + LogisticRegression")
+                    artifact = fit_note_model(X_texts, y_labels)
+                    version = None  # dry run: not saved
+                    if not dry:
+                        version = registry.save(artifact, fingerprint=fingerprint, n_train=n_train,
+                                                classes=classes)
+                        self.stdout.write(self.style.SUCCESS(f"Saved note model v{version} to {registry.root}"))
+        if not use_supervised:
+            artifact, model_version = None, KEYWORD_VERSION
             self.stdout.write(self.style.WARNING(
-                f"Not enough labeled notes to train (found {len(train_pairs)}). Using keyword routing."
+                f"Not enough labeled notes to train (found {n_train}). Using keyword routing."
             ))
-            for note in P:
-                spec, conf = keyword_route(text_for(note))
-                to_create.append(NotePrediction(
-                    Note=note,
-                    Predicted_specialty=spec,
-                    Confidence=conf,
-                    Predicted_at=now,
-                ))
+        else:
+            model_version = version_tag(version, streaming=opts["streaming"]) if version is not None else None
+            self.stdout.write(self.style.SUCCESS(f"Training set: {n_train} notes, classes={classes}"))
 
-        if opts["dry_run"]:
-            self.stdout.write(self.style.HTTP_INFO(f"[DRY RUN] Would create {len(to_create)} NotePrediction rows."))
+        # 3) Score notes with no prediction, then (with a model) re-predict notes whose latest
+        # prediction came from another model version or keyword routing, up to --budget.
+        # Notes go in id-ordered chunks; each chunk is vectorized, predicted and committed
+        # on its own, so memory stays bounded and an interrupted run keeps what it wrote
+        new_total = unlabeled_or_unpredicted_qs().count()
+        if limit:
+            new_total = min(new_total, limit)
+        passes = [("new", unlabeled_or_unpredicted_qs(), new_total, limit)]
+        if use_supervised and model_version is None and opts["budget"] != 0:
+            # A dry run that trained a model never saved it: no version to compare predictions with
+            self.stdout.write(self.style.HTTP_INFO(
+                "No saved model version (dry run): skipping the check for outdated predictions"
+            ))
+        elif use_supervised and opts["budget"] != 0:
+            stale = outdated_qs(model_version)
+            stale_total = stale.count()
+            if opts["budget"]:
+                stale_total = min(stale_total, opts["budget"])
+            passes.append(("outdated", stale, stale_total, opts["budget"]))
+            if stale_total:
+                self.stdout.write(self.style.HTTP_INFO(
+                    f"{stale_total} note(s) last predicted by another model version will be re-predicted"
+                ))
+        total = sum(p[2] for p in passes)
+        if not total:
+            self.stdout.write(self.style.WARNING(
+                "No new notes to score." if len(passes) == 1 else "No new or outdated notes to score."
+            ))
             return
 
-        NotePrediction.objects.bulk_create(to_create, batch_size=1000)
-        by_spec = {}
-        for npred in to_create:
-            by_spec[npred.Predicted_specialty] = by_spec.get(npred.Predicted_specialty, 0) + 1
+        now = timezone.now()
+        progress(done=0, total=total, step="Predicting notes")
+        bulk = opts["bulk_load"] and not dry
+        written, by_spec, counts = 0, {}, {}
+        # Indexes stay in bulk-load mode: every chunk's "latest prediction" lookup needs the Note index
+        with bulk_load_mode(NotePrediction, drop_indexes=False, log=self.stdout.write) if bulk else nullcontext():
+            for name, qs, n, cap in passes:
+                if not n:
+                    continue
+                chunks = note_chunks(qs, opts["chunk_size"], cap)
+                for ids, preds, confs in predicted_chunks(chunks, artifact, opts["workers"]):
+                    for spec in preds:
+                        by_spec[spec] = by_spec.get(spec, 0) + 1
+                    written += len(ids)
+                    counts[name] = counts.get(name, 0) + len(ids)
+                    if not dry:
+                        with transaction.atomic():
+                            NotePrediction.objects.bulk_create([
+                                NotePrediction(Note_id=note_id, Predicted_specialty=spec, Confidence=c,
+                                               Predicted_at=now, Model_version=model_version)
+                                for note_id, spec, c in zip(ids, preds, confs)
+                            ], batch_size=1000)
+                    progress(done=written, total=total)
+        progress(done=written, total=total, force=True)
+        detail = ", ".join(f"{v} {k}" for k, v in counts.items())
+
+        if dry:
+            self.stdout.write(self.style.HTTP_INFO(f"[DRY RUN] Would create {written} NotePrediction rows ({detail})."))
+            return
 
         self.stdout.write(self.style.SUCCESS(
-            f"Wrote {len(to_create)} NotePrediction rows at {now:%Y-%m-%d %H:%M}. "
+            f"Wrote {written} NotePrediction rows ({detail}, model {model_version}) at {now:%Y-%m-%d %H:%M}. "
             f"Mix: " + ", ".join(f"{k}:{v}" for k,v in sorted(by_spec.items()))
         ))
+
+    def streaming_model(self, min_labels, dry, opts):
+        """
+        Streaming model brought up to date with the labeled notes;
+        returns (artifact or None, n_train, classes, registry version or None).
+        Only labels above the saved model's watermark are fed to it, unless labels at or below
+        it changed or a new class appeared, which needs a full (still chunked) refit.
+        """
+        progress(step="Checking labeled notes")
+        classes = label_classes()
+        n_labeled = labeled_qs().count()
+        if n_labeled < min_labels or len(classes) < 2:
+            return None, n_labeled, classes, None
+        upto = labeled_qs().aggregate(m=Max("id"))["m"]
+
+        found = None if opts["retrain"] else find_streaming_model()
+        artifact, reason = None, "--retrain" if opts["retrain"] else "no saved streaming model"
+        if found:
+            artifact, manifest = found
+            version = manifest["version"]
+            if not set(classes) <= set(artifact["classes"]):
+                artifact, reason = None, f"new label classes {sorted(set(classes) - set(artifact['classes']))}"
+            elif labels_digest(artifact["label_watermark"]) != artifact["labels_digest"]:
+                artifact, reason = None, f"labels at or below note {artifact['label_watermark']} changed"
+
+        if artifact is None:
+            self.stdout.write(self.style.HTTP_INFO(f"Fitting streaming note model from scratch ({reason})"))
+            artifact = new_streaming_model(classes)
+            passes = [(0, epoch) for epoch in range(max(1, opts["epochs"]))]
+        elif upto > artifact["label_watermark"]:
+            self.stdout.write(self.style.HTTP_INFO(
+                f"Updating streaming note model v{manifest['version']} with labels after note {artifact['label_watermark']}"
+            ))
+            passes = [(artifact["label_watermark"], 0)]
+        else:
+            self.stdout.write(self.style.HTTP_INFO(
+                f"Streaming note model v{manifest['version']} is up to date (label watermark {upto})"
+            ))
+            if not dry:
+                streaming_registry.promote(version)  # this run's family becomes the active one
+            return artifact, artifact["n_train"], artifact["classes"], version
+
+        seen = 0
+        for after, epoch in passes:
+            progress(done=0, total=n_labeled, step=f"Streaming fit, pass {epoch + 1}/{len(passes)}")
+            seen, done = 0, 0
+            for last_id, texts, labels in labeled_chunks(after, upto, opts["chunk_size"]):
+                if texts:
+                    partial_fit_chunk(artifact, texts, labels, seed=epoch * 1000003 + last_id)
+                seen += len(texts)
+                done += opts["chunk_size"]
+                progress(done=min(done, n_labeled))
+        artifact["n_train"] = seen if after == 0 else artifact["n_train"] + seen
+        artifact["label_watermark"], artifact["labels_digest"] = upto, labels_digest(upto)
+        version = None  # dry run: not saved
+        if not dry:
+            version = streaming_registry.save(artifact, mode="streaming", spec=artifact["spec"],
+                                              n_train=artifact["n_train"], label_watermark=upto,
+                                              classes=artifact["classes"])
+            self.stdout.write(self.style.SUCCESS(
+                f"Saved streaming note model v{version} to {streaming_registry.root}"
+            ))
+        return artifact, artifact["n_train"], artifact["classes"], version
+
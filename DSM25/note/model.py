@@ -0,0 +1,121 @@
+"""
+Fit, persist and reuse the note specialty classifier.
+
+The default model is TF-IDF + LogisticRegression, fitted in memory on every
+labeled note. It is saved in the "note" registry together with the fingerprint
+of its training set: a hash of every (text, label) pair in note id order plus
+the model spec. A run whose labeled notes hash to a saved fingerprint loads
+that model instead of refitting.
+
+The streaming model (note_classifier --streaming) never holds the corpus:
+a stateless HashingVectorizer turns each DB chunk into features and an
+SGDClassifier is updated with partial_fit. It remembers the highest labeled
+note id it has seen (label watermark), so later runs only feed it the labels
+that arrived since. It lives in its own "note-streaming" registry, so each
+family keeps its own CURRENT and looking one up never moves the other's.
+
+A note_classifier run promotes the model it predicts with in its family; the
+family promoted last is the active one, which online classification serves.
+Every NotePrediction records the model version that wrote it, so when a new
+model becomes current note_classifier can re-predict just the notes whose
+latest prediction came from another version or from keyword routing.
+"""
+import hashlib
+
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+
+from core.registry import ModelRegistry
+
+registry = ModelRegistry("note")
+streaming_registry = ModelRegistry("note-streaming")
+
+# Bump when the vectorizer/classifier settings below change, so saved models are not reused
+MODEL_SPEC = 1
+STREAMING_SPEC = 1
+HASH_FEATURES = 2 ** 20
+
+# NotePrediction.Model_version of keyword-routed predictions
+KEYWORD_VERSION = "keywords"
+
+
+def version_tag(version, streaming=False):
+    """NotePrediction.Model_version for predictions made by `version` of the note (or streaming) registry."""
+    return f"streaming-v{version}" if streaming else f"v{version}"
+
+
+def active_registry():
+    """The note model family promoted most recently (what note_classifier last ran with); None if nothing is saved."""
+    saved = [r for r in (registry, streaming_registry) if r.current() is not None]
+    return max(saved, key=lambda r: r.promoted_at() or 0, default=None)
+
+
+def training_fingerprint(texts, labels):
+    """Hash of the training set exactly as fit_note_model sees it (order matters)."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"spec={MODEL_SPEC};n={len(texts)}".encode())
+    for text, label in zip(texts, labels):
+        h.update(b"\x1e" + label.encode("utf-8") + b"\x1f" + text.encode("utf-8"))
+    return h.hexdigest()
+
+
+def fit_note_model(texts, labels):
+    """Fit TF-IDF (1-2 grams) + LogisticRegression on all labeled notes."""
+    vect = TfidfVectorizer(lowercase=True, stop_words="english",
+                           ngram_range=(1, 2), min_df=2, max_df=0.95)
+    X = vect.fit_transform(texts)
+    clf = LogisticRegression(max_iter=1000, n_jobs=None)
+    clf.fit(X, labels)
+    return {"vectorizer": vect, "classifier": clf}
+
+
+def find_model(fingerprint):
+    """
+    (artifact, manifest) of a saved model fitted on `fingerprint`, preferring the
+    current one; else None. Only looks: promoting is up to the caller.
+    """
+    current = registry.current()
+    versions = sorted(registry.versions(), key=lambda v: (v != current, -v))
+    for version in versions:
+        try:
+            manifest = registry.manifest(version)
+        except (FileNotFoundError, ValueError):
+            continue
+        if manifest.get("fingerprint") == fingerprint:
+            return registry.load(version)
+    return None
+
+
+def new_streaming_model(classes):
+    """Unfitted streaming artifact; `classes` must list every label partial_fit will see."""
+    return {
+        "vectorizer": HashingVectorizer(lowercase=True, stop_words="english", ngram_range=(1, 2),
+                                        n_features=HASH_FEATURES, alternate_sign=False, norm="l2"),
+        "classifier": SGDClassifier(loss="log_loss", alpha=1e-5, random_state=42),
+        "classes": sorted(classes),
+        "spec": STREAMING_SPEC,
+        "label_watermark": 0,  # highest labeled note id trained on
+        "labels_digest": None,  # labels_digest() of the notes up to the watermark
+        "n_train": 0,
+    }
+
+
+def partial_fit_chunk(artifact, texts, labels, seed=0):
+    """Update the streaming classifier with one chunk (rows shuffled, so id order does not bias SGD)."""
+    order = np.random.default_rng(seed).permutation(len(texts))
+    X = artifact["vectorizer"].transform([texts[i] for i in order])
+    artifact["classifier"].partial_fit(X, np.asarray(labels, dtype=object)[order], classes=artifact["classes"])
+
+
+def find_streaming_model():
+    """(artifact, manifest) of the newest saved streaming model, preferring the current one; else None."""
+    current = streaming_registry.current()
+    for version in sorted(streaming_registry.versions(), key=lambda v: (v != current, -v)):
+        try:
+            manifest = streaming_registry.manifest(version)
+        except (FileNotFoundError, ValueError):
+            continue
+        if manifest.get("spec") == STREAMING_SPEC:
+            return streaming_registry.load(version)
+    return None
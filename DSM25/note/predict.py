@@ -0,0 +1,84 @@
+"""
+Note specialty prediction, in process or fanned out to a process pool.
+
+Chunks of note texts go to `--workers` processes that receive the fitted
+vectorizer and classifier (or nothing, for keyword routing) once, at start-up;
+the parent keeps reading chunks from the DB and writing the results. At most
+2 * workers chunks are in flight and results come back in submission order,
+as in risk.engine.scored_chunks.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
+
+from note.routing import keyword_route_batch
+
+_artifact = None
+
+
+def _init_worker(artifact):
+    global _artifact
+    _artifact = artifact
+
+
+def _predict_chunk(texts):
+    return predict_chunk(_artifact, texts)
+
+
+def join_note_text(transcription, description, keywords) -> str:
+    # Build a single text field (Transcription primary; add Description/Keywords if present)
+    parts = [transcription or ""]
+    if description:
+        parts.append(description)
+    if keywords:
+        parts.append(keywords)
+    return "\n".join(parts).strip()
+
+
+def predict_chunk(artifact, texts) -> Tuple[List[str], List[float]]:
+    """(specialties, confidences) for `texts`: the fitted model's, or keyword routing when artifact is None."""
+    if artifact is None:
+        routed = keyword_route_batch(texts)
+        return [spec for spec, _ in routed], [conf for _, conf in routed]
+    clf = artifact["classifier"]
+    Xp = artifact["vectorizer"].transform(texts)
+    # Probabilities for confidence
+    try:
+        probs = clf.predict_proba(Xp)
+        preds = clf.classes_[np.argmax(probs, axis=1)]
+        confs = probs.max(axis=1)
+    except Exception:
+        # Fallback if probas not available
+        decision = clf.decision_function(Xp)
+        if decision.ndim == 1:
+            # Binary-like decision → pseudo-proba
+            confs = 1.0 / (1.0 + np.exp(-np.abs(decision)))
+            preds = np.where(decision >= 0, clf.classes_[1], clf.classes_[0])
+        else:
+            # Multiclass decision → softmax
+            e = np.exp(decision - decision.max(axis=1, keepdims=True))
+            probs = e / e.sum(axis=1, keepdims=True)
+            preds = clf.classes_[np.argmax(probs, axis=1)]
+            confs = probs.max(axis=1)
+    return [str(spec).upper() for spec in preds], [float(c) for c in confs]
+
+
+def predicted_chunks(chunks, artifact, workers=1):
+    """Yield (note_ids, specialties, confidences) for each (note_ids, texts) chunk, in order."""
+    if workers <= 1:
+        for ids, texts in chunks:
+            yield (ids, *predict_chunk(artifact, texts))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(artifact,)) as pool:
+        pending = deque()
+        for ids, texts in chunks:
+            pending.append((ids, pool.submit(_predict_chunk, texts)))
+            if len(pending) >= 2 * workers:
+                ids_, future = pending.popleft()
+                yield (ids_, *future.result())
+        while pending:
+            ids_, future = pending.popleft()
+            yield (ids_, *future.result())
@@ -0,0 +1,89 @@
+"""
+Keyword routing, the note classifier's fallback when there are too few labels.
+
+A note's score for a specialty is how many of its KEYWORDS patterns occur in
+the lowercased text. All patterns are compiled into one alternation of
+lookaheads with a named group each, so a note is scanned once however many
+patterns there are; a lookahead match is zero-width, so patterns starting at
+the same or overlapping positions are all still found.
+"""
+from __future__ import annotations
+
+import re
+from typing import Iterable, List, Tuple
+
+KEYWORDS = {
+    "ENDO": [
+        r"\binsulin\b", r"\bglucose\b", r"\ba1c\b", r"\bmetformin\b",
+        r"\bhyperglyc?emia\b", r"\bhypoglyc?emia\b", r"\bthyroid\b",
+    ],
+    "CARD": [
+        r"\bchest pain\b", r"\bmi\b", r"\bmyocard(ial|ium)\b", r"\bekg\b",
+        r"\bstent\b", r"\bangiogram\b", r"\bcardio\b", r"\bstatin\b",
+    ],
+    "PCP": [
+        r"\bprimary care\b", r"\bannual (exam|visit|physical)\b",
+        r"\bfollow[- ]?up\b", r"\bblood pressure\b", r"\brefill\b",
+    ],
+}
+
+
+def _combine(patterns):
+    """
+    One regex matching, zero-width, wherever any of `patterns` starts; group p<i> is pattern i.
+    A leading \\b shared by every pattern is tested once per position instead of once per
+    pattern, and when each pattern then starts with a literal character, a lookahead for
+    those characters lets the scan skip every other position cheaply.
+    """
+    if not all(p.startswith(r"\b") for p in patterns):
+        return "|".join(f"(?=(?P<p{i}>{p}))" for i, p in enumerate(patterns))
+    tails = [p[2:] for p in patterns]
+    head = r"\b"
+    if all(re.match(r"[a-z0-9](?![?*{])", t) for t in tails):
+        head = "(?=[" + "".join(sorted({t[0] for t in tails})) + "])" + head
+    return head + "(?=" + "|".join(f"(?P<p{i}>{t})" for i, t in enumerate(tails)) + ")"
+
+
+class KeywordRouter:
+    def __init__(self, keywords=KEYWORDS):
+        self.specs = list(keywords)
+        # (spec index, compiled pattern) per pattern, in KEYWORDS order; group p<i> is pattern i
+        self.patterns = [(k, re.compile(p)) for k, spec in enumerate(self.specs) for p in keywords[spec]]
+        self.combined = re.compile(_combine([p.pattern for _, p in self.patterns]))
+
+    def hits(self, text: str) -> List[int]:
+        """Patterns matched per specialty (each pattern counts once), in KEYWORDS order."""
+        t = text.lower()
+        found = set()
+        for m in self.combined.finditer(t):
+            # The alternation reports the first pattern matching here; later ones may start here too
+            pos, first = m.start(), int(m.lastgroup[1:])
+            found.add(first)
+            for i in range(first + 1, len(self.patterns)):
+                if i not in found and self.patterns[i][1].match(t, pos):
+                    found.add(i)
+            if len(found) == len(self.patterns):
+                break
+        counts = [0] * len(self.specs)
+        for i in found:
+            counts[self.patterns[i][0]] += 1
+        return counts
+
+    def route(self, text: str) -> Tuple[str, float]:
+        """Return (specialty, confidence[0..1]) via transparent keyword rules."""
+        scores = list(zip(self.specs, self.hits(text)))
+        # pick best, break ties deterministically
+        best_spec, best_hits = max(scores, key=lambda x: (x[1], x[0]))
+        if best_hits == 0:
+            return "OTHER", 0.50  # low confidence default
+        total_hits = sum(h for _, h in scores) or 1
+        conf = min(0.95, 0.60 + 0.35 * (best_hits / total_hits))
+        return best_spec, float(conf)
+
+    def route_batch(self, texts: Iterable[str]) -> List[Tuple[str, float]]:
+        return [self.route(t) for t in texts]
+
+
+router = KeywordRouter()
+keyword_route = router.route
+keyword_route_batch = router.route_batch
@@ -0,0 +1,135 @@
+"""
+Online note classification, coalesced into micro-batches.
+
+Requests in a process hand their note text to one batching thread. It collects
+up to BATCH_SIZE notes, waiting at most BATCH_WAIT after the first, runs them
+through a single vectorized transform + predict_proba (note.predict.predict_chunk)
+and writes the NotePrediction rows of the notes that came with an id in one
+transaction before answering each request. If the batch fails, each request in
+it is retried on its own, so a bad note only fails its own request.
+
+The current version of the active note model family (TF-IDF or streaming,
+whichever note_classifier last ran with) is loaded once per process and swapped
+only when another version is promoted; with no saved model the keyword router
+answers, as in note_classifier. Rows carry the same Model_version tags as the
+batch job, so a later note_classifier run treats them like its own.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from core.models import NotePrediction
+from note.model import KEYWORD_VERSION, active_registry, streaming_registry, version_tag
+from note.predict import predict_chunk
+
+BATCH_SIZE = 64
+BATCH_WAIT = 0.005  # seconds
+RESULT_TIMEOUT = 30
+
+_lock = threading.Lock()
+_loaded = None  # (Model_version tag, artifact)
+
+
+def current_model():
+    """(Model_version tag, artifact) for the active note model; artifact is None without a saved model."""
+    global _loaded
+    registry = active_registry()
+    if registry is None:
+        return KEYWORD_VERSION, None
+    version = registry.current()
+    tag = version_tag(version, streaming=registry is streaming_registry)
+    loaded = _loaded
+    if loaded is None or loaded[0] != tag:
+        with _lock:
+            if _loaded is None or _loaded[0] != tag:
+                artifact, _ = registry.load(version)
+                _loaded = (tag, artifact)
+            loaded = _loaded
+    return loaded
+
+
+class MicroBatcher:
+    def __init__(self, size=BATCH_SIZE, wait=BATCH_WAIT):
+        self.size, self.wait = size, wait
+        self._queue = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, text, note_id=None):
+        """Future resolving to {specialty, confidence, model_version, batch_size[, prediction_id]}."""
+        future = Future()
+        self._running_queue().put((text, note_id, future))
+        return future
+
+    def _running_queue(self):
+        # Started lazily, and again in a forked worker (threads do not survive fork)
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    threading.Thread(target=self._run, args=(self._queue,), name="note-batcher", daemon=True).start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    def _run(self, q):
+        while True:
+            batch = [q.get()]
+            deadline = time.monotonic() + self.wait
+            while len(batch) < self.size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(q.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._process(batch)
+
+    def _process(self, batch):
+        try:
+            close_old_connections()
+            results = self._classify(batch)
+        except Exception as e:
+            if len(batch) > 1:
+                # One bad request must not fail the rest: retry each on its own
+                for item in batch:
+                    self._process([item])
+            else:
+                batch[0][2].set_exception(e)  # handed to the waiting request; the thread keeps serving
+            return
+        for (_, _, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def _classify(self, batch):
+        # One transform + predict for the batch, one transaction for its rows; a result per request
+        model_version, artifact = current_model()
+        preds, confs = predict_chunk(artifact, [text for text, _, _ in batch])
+        results = [
+            {"specialty": spec, "confidence": conf, "model_version": model_version, "batch_size": len(batch)}
+            for spec, conf in zip(preds, confs)
+        ]
+        now = timezone.now()
+        rows = [
+            (result, NotePrediction(Note_id=note_id, Predicted_specialty=result["specialty"],
+                                    Confidence=result["confidence"], Predicted_at=now,
+                                    Model_version=model_version))
+            for (_, note_id, _), result in zip(batch, results) if note_id is not None
+        ]
+        if rows:
+            with transaction.atomic():
+                NotePrediction.objects.bulk_create([row for _, row in rows])
+            for result, row in rows:
+                result["prediction_id"] = row.pk
+        return results
+
+batcher = MicroBatcher()
+
+
+def classify(text, note_id=None):
+    """Classify one note text through the shared micro-batcher (blocks until its batch is done)."""
+    return batcher.submit(text, note_id).result(timeout=RESULT_TIMEOUT)
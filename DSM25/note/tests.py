@@ -1,3 +1,302 @@
-from django.test import TestCase
+import io
+import json
+import random
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import Clinical_note, NotePrediction
+from note.management.commands import note_classifier
+from note.management.commands.note_classifier import note_chunks, outdated_qs, unlabeled_or_unpredicted_qs
+from note import serving
+from note.model import fit_note_model, registry, streaming_registry
+from note.predict import predicted_chunks
+from note.routing import KEYWORDS, KeywordRouter, keyword_route, keyword_route_batch
+
+
+def reference_hits(keywords, text):
+    # The per-pattern re.search loop the compiled router replaced
+    t = text.lower()
+    return [sum(1 for p in patterns if re.search(p, t)) for patterns in keywords.values()]
+
+
+def reference_route(keywords, text):
+    scores = list(zip(keywords, reference_hits(keywords, text)))
+    best_spec, best_hits = max(scores, key=lambda x: (x[1], x[0]))
+    if best_hits == 0:
+        return "OTHER", 0.50
+    total_hits = sum(h for _, h in scores) or 1
+    return best_spec, float(min(0.95, 0.60 + 0.35 * (best_hits / total_hits)))
+
+
+FIXED = [
+    "",
+    "Patient on INSULIN, glucose 240, A1C 9.1; metformin stopped.",
+    "Chest pain radiating to the left arm, EKG shows prior MI; stent placed after angiogram.",
+    "Annual physical with primary care; blood pressure fine, refill statin, follow-up in 6 months.",
+    "Mild symptoms, mildly elevated; admitted for hypoglycemia and hyperglycaemia.",
+    "followup / follow up / follow-up; myocardium and myocardial; thyroid.",
+    "cardiologist said cardio-vascular; a1c1; insulinoma; chest  pain",
+    "ekg ekg ekg ekg",
+]
+
+# Patterns sharing a start, overlapping each other, or outside the \b-literal fast path
+CUSTOM = [
+    {"A": [r"\bchest\b", r"\bchest pain\b", r"\bch"], "B": [r"\bpain\b", r"\bpa", r"\bchest p"]},
+    {"X": [r"ab", r"abc", r"b+c"], "Y": [r"c", r"\d+", r"(?:ab)+"]},
+    {"P": [r"\bx?y", r"\by"], "Q": [r"\b[0-9]+\b", r"\b\w{3}\b"]},
+]
+
+
+class KeywordRouterTests(SimpleTestCase):
+    def test_matches_per_pattern_search_on_fixed_notes(self):
+        for text in FIXED:
+            with self.subTest(text=text):
+                self.assertEqual(keyword_route(text), reference_route(KEYWORDS, text))
+        self.assertEqual(keyword_route_batch(FIXED), [reference_route(KEYWORDS, t) for t in FIXED])
+
+    def test_matches_per_pattern_search_on_fuzzed_notes(self):
+        rng = random.Random(0)
+        words = [w for patterns in KEYWORDS.values() for p in patterns
+                 for w in re.sub(r"\\b|[()?|\[\]]", " ", p).split()]
+        words += ["mi", "mild", "follow", "up", "-", "pain", "the", "a", "1c", "exam", "visit", "cardiology"]
+        for _ in range(2000):
+            text = "".join(rng.choice(words) + rng.choice([" ", "", ", ", "-", "\n"])
+                           for _ in range(rng.randint(0, 12)))
+            if rng.random() < 0.3:
+                text = text.upper()
+            self.assertEqual(KeywordRouter().hits(text), reference_hits(KEYWORDS, text), text)
+            self.assertEqual(keyword_route(text), reference_route(KEYWORDS, text), text)
+
+    def test_overlapping_and_same_start_patterns(self):
+        rng = random.Random(1)
+        for keywords in CUSTOM:
+            router = KeywordRouter(keywords)
+            alphabet = ["chest", "pain", "ch", "pa", "ab", "abc", "bbc", "c", "12", "xy", "y", "x", " ", "  ", "-"]
+            texts = ["chest pain", "abcabc", "xy y 123 abc"] + [
+                "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 10))) for _ in range(500)]
+            for text in texts:
+                self.assertEqual(router.hits(text), reference_hits(keywords, text), (keywords, text))
+                self.assertEqual(router.route(text), reference_route(keywords, text), (keywords, text))
+
+
+class OutdatedSelectionTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.notes = {}
+        # name -> Model_version of its predictions, oldest first
+        for name, versions in {
+            "current": ["v3"],
+            "older": ["v2"],
+            "keywords": ["keywords"],
+            "blank": [""],
+            "repredicted": ["v2", "keywords", "v3"],
+            "regressed": ["v3", "v2"],
+            "unpredicted": [],
+        }.items():
+            note = Clinical_note.objects.create(Description="", Medical_specialty="", Sample_name=name,
+                                                Transcription=name, Keywords="")
+            self.notes[name] = note.id
+            for age, version in enumerate(reversed(versions)):
+                NotePrediction.objects.create(Note=note, Predicted_specialty="ENDO", Confidence=0.9,
+                                              Predicted_at=self.now - timedelta(days=age), Model_version=version)
+
+    def selected(self, version):
+        ids = set(outdated_qs(version).values_list("id", flat=True))
+        return {name for name, note_id in self.notes.items() if note_id in ids}
+
+    def test_latest_prediction_from_another_version_is_outdated(self):
+        self.assertEqual(self.selected("v3"), {"older", "keywords", "blank", "regressed"})
+
+    def test_same_timestamp_falls_back_to_the_newest_row(self):
+        note = Clinical_note.objects.get(id=self.notes["current"])
+        NotePrediction.objects.create(Note=note, Predicted_specialty="ENDO", Confidence=0.9,
+                                      Predicted_at=note.noteprediction_set.get().Predicted_at, Model_version="v2")
+        self.assertIn("current", self.selected("v3"))
+
+    def test_no_version_selects_nothing(self):
+        self.assertEqual(self.selected(None), set())
+
+
+@mock.patch.object(serving, "classify",
+                   return_value={"specialty": "ENDO", "confidence": 0.8, "model_version": "keywords", "batch_size": 1})
+class NoteClassifyApiTests(TestCase):
+    def setUp(self):
+        self.note = Clinical_note.objects.create(Description="", Medical_specialty="", Sample_name="s",
+                                                 Transcription="on insulin", Keywords="")
+        self.url = reverse("note_classify_api")
+
+    def test_get_classifies_without_recording_a_prediction(self, classify):
+        response = self.client.get(self.url, {"note_id": self.note.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["note_id"], self.note.id)
+        classify.assert_called_once_with("on insulin", None)
+
+    def test_json_post_records_the_prediction(self, classify):
+        response = self.client.post(self.url, json.dumps({"note_id": self.note.id}), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        classify.assert_called_once_with("on insulin", self.note.id)
+
+    def test_form_post_is_rejected(self, classify):
+        response = self.client.post(self.url, {"note_id": self.note.id})
+        self.assertEqual(response.status_code, 415)
+        classify.assert_not_called()
+
+    def test_timeout_is_a_503(self, classify):
+        classify.side_effect = FutureTimeout()
+        response = self.client.get(self.url, {"text": "chest pain"})
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("error", response.json())
+
+
+# Two specialties with distinct vocabulary, repeated so TF-IDF's min_df keeps the words
+LABELED = [("ENDO", "insulin glucose a1c metformin diabetes"), ("CARD", "chest pain ekg stent angiogram")] * 6
+
+
+class NoteModelFamilyTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings = override_settings(ARTIFACTS_DIR=tmp.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        for i, (label, text) in enumerate(LABELED + [("", "glucose insulin follow up"), ("", "ekg chest pain")]):
+            Clinical_note.objects.create(Description="", Medical_specialty=label, Sample_name=f"s{i}",
+                                         Transcription=f"{text} note {i}", Keywords="")
+        self.addCleanup(setattr, serving, "_loaded", None)
+
+    def classify(self, **opts):
+        out = io.StringIO()
+        call_command("note_classifier", min_labels=4, stdout=out, **opts)
+        return out.getvalue()
+
+    def latest_versions(self):
+        return {n.noteprediction_set.order_by("-Predicted_at", "-id").first().Model_version
+                for n in Clinical_note.objects.all()}
+
+    def test_switching_families_leaves_each_current_alone(self):
+        self.classify()
+        self.assertEqual(self.latest_versions(), {"v1"})
+        self.classify(streaming=True)
+        self.assertEqual(self.latest_versions(), {"streaming-v1"})
+        self.assertEqual(serving.current_model()[0], "streaming-v1")
+
+        out = self.classify()
+        self.assertIn("using saved note model v1", out)
+        self.assertEqual((registry.versions(), streaming_registry.versions()), ([1], [1]))
+        self.assertEqual(self.latest_versions(), {"v1"})
+        self.assertEqual(serving.current_model()[0], "v1")
+
+        # Running the same family again finds nothing to redo
+        self.assertIn("No new or outdated notes", self.classify())
+        out = self.classify(streaming=True)
+        self.assertIn("Streaming note model v1 is up to date", out)
+        self.assertEqual(streaming_registry.versions(), [1])
+        self.assertIn("No new or outdated notes", self.classify(streaming=True))
+
+
+class ChunkedPredictionTests(TestCase):
+    def setUp(self):
+        self.ids = [Clinical_note.objects.create(Description="", Medical_specialty="", Sample_name=f"s{i}",
+                                                 Transcription=text, Keywords="").id
+                    for i, text in enumerate(FIXED)]
+
+    def classify(self, **opts):
+        out = io.StringIO()
+        call_command("note_classifier", stdout=out, **opts)
+        return out.getvalue()
+
+    def test_chunks_page_by_id_while_notes_get_predicted(self):
+        seen = []
+        for ids, texts in note_chunks(unlabeled_or_unpredicted_qs(), chunk_size=3):
+            self.assertEqual(len(ids), len(texts))
+            seen.extend(ids)
+            # Predicting a chunk removes it from the queryset; later pages must not shift
+            NotePrediction.objects.bulk_create([
+                NotePrediction(Note_id=i, Predicted_specialty="OTHER", Confidence=0.5) for i in ids])
+        self.assertEqual(seen, self.ids)
+        self.assertEqual(sum(len(ids) for ids, _ in note_chunks(Clinical_note.objects.all(), 3, limit=4)), 4)
+
+    def test_interrupted_run_keeps_committed_chunks(self):
+        real = note_classifier.predicted_chunks
+
+        def fail_after_two_chunks(*args, **kwargs):
+            for n, chunk in enumerate(real(*args, **kwargs)):
+                if n == 2:
+                    raise RuntimeError("killed")
+                yield chunk
+
+        with mock.patch.object(note_classifier, "predicted_chunks", fail_after_two_chunks), \
+                self.assertRaises(RuntimeError):
+            self.classify(chunk_size=3)
+        self.assertEqual(sorted(NotePrediction.objects.values_list("Note_id", flat=True)), self.ids[:6])
+
+        self.assertIn("Wrote 2 NotePrediction rows", self.classify(chunk_size=3))
+        self.assertEqual(NotePrediction.objects.count(), len(self.ids))
+
+    def test_workers_predict_what_a_single_process_does(self):
+        self.classify(chunk_size=3)
+        single = dict(NotePrediction.objects.values_list("Note_id", "Predicted_specialty"))
+        NotePrediction.objects.all().delete()
+        self.assertIn(f"Wrote {len(self.ids)} NotePrediction rows", self.classify(chunk_size=3, workers=2))
+        self.assertEqual(dict(NotePrediction.objects.values_list("Note_id", "Predicted_specialty")), single)
+
+
+class PredictedChunksTests(SimpleTestCase):
+    def test_pool_keeps_chunk_order_and_matches_in_process(self):
+        texts = [t for _ in range(5) for t in FIXED]
+        chunks = [(list(range(i, i + 7)), texts[i:i + 7]) for i in range(0, len(texts), 7)]
+        fitted = fit_note_model([t for _, t in LABELED], [label for label, _ in LABELED])
+        for artifact in (None, fitted):
+            with self.subTest(model=artifact is not None):
+                serial = list(predicted_chunks(chunks, artifact))
+                pooled = list(predicted_chunks(chunks, artifact, workers=2))
+                self.assertEqual([ids for ids, _, _ in pooled], [ids for ids, _ in chunks])
+                self.assertEqual(pooled, serial)
+
+
+class MicroBatcherTests(TransactionTestCase):
+    # Real classification on the batcher's own thread and DB connection (no saved model: keyword routing)
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings = override_settings(ARTIFACTS_DIR=tmp.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.notes = [Clinical_note.objects.create(Description="", Medical_specialty="", Sample_name=f"s{i}",
+                                                   Transcription=text, Keywords="") for i, text in enumerate(FIXED)]
+        self.batcher = serving.MicroBatcher(size=len(FIXED) + 2, wait=0.5)
+
+    def classify_concurrently(self, requests):
+        with ThreadPoolExecutor(len(requests)) as pool:
+            futures = [pool.submit(lambda r: self.batcher.submit(*r).result(timeout=10), r) for r in requests]
+        return futures
+
+    def test_concurrent_requests_share_one_batch(self):
+        futures = self.classify_concurrently([(n.Transcription, n.id) for n in self.notes])
+        results = [f.result() for f in futures]
+        self.assertEqual([(r["specialty"], r["confidence"]) for r in results],
+                         [keyword_route(n.Transcription) for n in self.notes])
+        self.assertEqual({r["batch_size"] for r in results}, {len(self.notes)})
+        self.assertEqual(sorted(NotePrediction.objects.values_list("id", flat=True)),
+                         sorted(r["prediction_id"] for r in results))
+
+    def test_bad_request_fails_alone(self):
+        missing = max(n.id for n in self.notes) + 100
+        futures = self.classify_concurrently(
+            [(n.Transcription, n.id) for n in self.notes] + [(None, None), ("chest pain", missing)])
+        for note, future in zip(self.notes, futures):
+            self.assertEqual(future.result()["specialty"], keyword_route(note.Transcription)[0])
+        self.assertRaises(Exception, futures[-2].result)
+        self.assertRaises(IntegrityError, futures[-1].result)
+        self.assertEqual(sorted(NotePrediction.objects.values_list("Note_id", flat=True)),
+                         sorted(n.id for n in self.notes))
@@ -1,4 +1,8 @@
 from django.urls import path
-from .views import triage_queue
+from .views import note_classify_api, triage_queue, triage_queue_export
 
-urlpatterns = [ path("triage-queue/", triage_queue, name="triage_queue") ]
+urlpatterns = [
+    path("triage-queue/", triage_queue, name="triage_queue"),
+    path("triage-queue/export.csv", triage_queue_export, name="triage_queue_export"),
+    path("triage-queue/classify/", note_classify_api, name="note_classify_api"),
+]
@@ -1,11 +1,22 @@
 from __future__ import annotations
+import json
+from concurrent.futures import TimeoutError as ClassifyTimeout
+
+from django.http import JsonResponse
 from django.shortcuts import render
+from django.utils import timezone
 from django.core.paginator import Paginator
 from django.db.models import F
 from django.db.models.expressions import Window
 from django.db.models.functions import RowNumber
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
 
-from core.models import NotePrediction
+from core.models import Clinical_note, NotePrediction
+from core.queues import EXPORT_CHUNK, PAGE_SIZE_OPTIONS, csv_response, page_size_from
+from core.registry import ArtifactNotFound
+from note import serving
+from note.predict import join_note_text
 
 def _latest_note_preds():
     # Latest prediction per note
@@ -21,7 +32,8 @@ def _latest_note_preds():
         .filter(rn=1)
     )
 
-def triage_queue(request):
+def _filtered_preds(request):
+    # Latest predictions narrowed by the page's query params; returns (qs, params)
     qs = _latest_note_preds()
 
     spec = (request.GET.get("spec") or "").upper()
@@ -42,19 +54,79 @@ def triage_queue(request):
         ) | qs.filter(Note__Transcription__icontains=s)
 
     qs = qs.order_by("-Confidence", "-Predicted_at")
+    return qs, {"spec": spec, "min_conf": min_conf or "", "search": search or ""}
+
+def triage_queue(request):
+    qs, params = _filtered_preds(request)
 
-    page_size = int(request.GET.get("page_size") or 25)
+    page_size = page_size_from(request)
     paginator = Paginator(qs, page_size)
     page_obj = paginator.get_page(request.GET.get("page"))
 
     ctx = {
         "page_obj": page_obj,
         "paginator": paginator,
-        "spec": spec,
-        "min_conf": min_conf or "",
-        "search": search or "",
+        **params,
         "page_size": page_size,
     }
     ctx["specialty_options"] = ["ENDO", "CARD", "PCP", "OTHER"]
-    ctx["page_size_options"] = ['25', '50', '100']
+    ctx["page_size_options"] = [str(n) for n in PAGE_SIZE_OPTIONS]
     return render(request, "note/triage_queue.html", ctx)
+
+def triage_queue_export(request):
+    # Same filters as the page, every matching row, streamed
+    qs, _ = _filtered_preds(request)
+    rows = qs.values_list(
+        "Note_id", "Note__Patient_id__Cust_id", "Note__Patient_id__CustFirstName",
+        "Note__Patient_id__CustLastName", "Note__Sample_name", "Predicted_specialty",
+        "Confidence", "Predicted_at",
+    ).iterator(chunk_size=EXPORT_CHUNK)
+    return csv_response(
+        f"triage_queue_{timezone.now():%Y%m%d_%H%M%S}.csv",
+        ["note_id", "patient_id", "first_name", "last_name", "sample_name",
+         "predicted_specialty", "confidence", "predicted_at"],
+        rows,
+    )
+
+@csrf_exempt  # JSON API for intake services; only a JSON POST writes, which a cross-site form cannot send
+@require_http_methods(["GET", "POST"])
+def note_classify_api(request):
+    """
+    Classify one note with the current note model (keyword routing if none is saved).
+    GET ?note_id=N or ?text=... only classifies. POST {"note_id": N} or {"text": "..."}
+    (Content-Type: application/json) also records a NotePrediction row for a note given
+    by id, so it shows up in the triage queue.
+    """
+    if request.method == "POST":
+        if request.content_type != "application/json":
+            return JsonResponse({"error": "POST body must be application/json"}, status=415)
+        try:
+            body = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse({"error": "Body must be JSON"}, status=400)
+        if not isinstance(body, dict):
+            return JsonResponse({"error": "Body must be a JSON object"}, status=400)
+        note_id, text = body.get("note_id"), body.get("text")
+    else:
+        note_id, text = request.GET.get("note_id"), request.GET.get("text")
+
+    if note_id is not None:
+        try:
+            note_id = int(note_id)
+        except (TypeError, ValueError):
+            return JsonResponse({"error": "note_id must be an integer"}, status=400)
+        row = Clinical_note.objects.filter(id=note_id).values_list("Transcription", "Description", "Keywords").first()
+        if row is None:
+            return JsonResponse({"error": f"No note {note_id}"}, status=404)
+        text = join_note_text(*row)
+    elif not isinstance(text, str) or not text.strip():
+        return JsonResponse({"error": "Provide note_id or text"}, status=400)
+
+    try:
+        result = serving.classify(text, note_id if request.method == "POST" else None)
+    except ArtifactNotFound as e:
+        return JsonResponse({"error": str(e)}, status=503)
+    except ClassifyTimeout:
+        return JsonResponse({"error": f"Classification did not finish within {serving.RESULT_TIMEOUT}s"},
+                            status=503)
+    return JsonResponse({"note_id": note_id, **result})
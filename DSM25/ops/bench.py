@@ -0,0 +1,185 @@
+"""
+Benchmark harness for the import / scoring / classification pipeline.
+
+`manage.py benchmark` generates a dataset per size (core.synth, cached in the
+work dir), then runs each stage in a fresh `manage.py benchmark --run-stage`
+subprocess against a scratch database and artifacts dir (DSM25_DB_PATH /
+DSM25_ARTIFACTS_DIR), so the real database is never touched and every stage's
+peak RSS is its own. The subprocess measures its stage with `measure_stage`
+and hands the numbers back as JSON.
+"""
+import json
+import os
+import platform
+import resource
+import sqlite3
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.db import connection
+
+# Run in this order; each stage works on what the previous ones left in the scratch DB
+STAGES = {
+    "import_data": {"args": ["--populate", "--bulk", "--skip-ml"], "tables": ["Customer", "Patient_lab", "Clinical_note"]},
+    "score_diabetes": {"args": [], "tables": ["RiskScore"]},
+    "note_classifier": {"args": [], "tables": ["NotePrediction"]},
+}
+METRICS = ["wall_s", "rows_per_s", "peak_rss_mb", "queries"]
+HIGHER_IS_BETTER = {"rows_per_s"}
+
+
+def parse_size(text):
+    """'10k' -> 10000, '1M' -> 1000000, '2500' -> 2500."""
+    text = text.strip().lower()
+    scale = {"k": 1000, "m": 1000000}.get(text[-1:], 1)
+    try:
+        return int(float(text[:-1] if scale > 1 else text) * scale)
+    except ValueError:
+        raise ValueError(f"Bad size {text!r}; use e.g. 10k, 100k, 1M")
+
+
+def size_label(n):
+    for unit, scale in (("M", 1000000), ("k", 1000)):
+        if n >= scale and n % scale == 0:
+            return f"{n // scale}{unit}"
+    return str(n)
+
+
+class QueryCounter:
+    """connection.execute_wrapper that only counts statements (execute and executemany calls)."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _peak_rss_mb(who):
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / (1 << 20) if sys.platform == "darwin" else rss / 1024
+
+
+def _table_rows(names):
+    from django.apps import apps
+    return sum(apps.get_model("core", name).objects.count() for name in names)
+
+
+def measure_stage(stage, argv, log):
+    """Run one stage in this process; returns its metrics dict."""
+    from django.core.management import call_command
+
+    tables = STAGES[stage]["tables"]
+    before = _table_rows(tables)
+    counter = QueryCounter()
+    result = {"stage": stage, "status": "ok", "error": None}
+    start = time.perf_counter()
+    try:
+        with connection.execute_wrapper(counter):
+            call_command(stage, *argv, stdout=log, stderr=log)
+    except Exception as e:  # recorded, not fatal: later stages and sizes still run
+        result.update(status="error", error=f"{type(e).__name__}: {e}")
+    wall = time.perf_counter() - start
+    rows = _table_rows(tables) - before
+    result.update(
+        wall_s=round(wall, 4),
+        rows=rows,
+        rows_per_s=round(rows / wall, 1) if wall > 0 else None,
+        queries=counter.count,
+        peak_rss_mb=round(_peak_rss_mb(resource.RUSAGE_SELF), 1),
+        children_peak_rss_mb=round(_peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+    )
+    return result
+
+
+def run_stage_subprocess(stage, dataset, db_path, artifacts_dir, log_path, extra_args=(), variant=None):
+    """Run `stage` in a fresh manage.py process against the scratch DB; returns its metrics dict."""
+    argv = list(STAGES[stage]["args"]) + list(extra_args)
+    if stage == "import_data":
+        argv += [f"--patients={dataset['patient_info']}", f"--labs={dataset['patient_lab']}",
+                 f"--notes={dataset['notes']}"]
+    result_path = f"{log_path}.json"
+    env = {**os.environ, "DSM25_DB_PATH": str(db_path), "DSM25_ARTIFACTS_DIR": str(artifacts_dir)}
+    cmd = [sys.executable, os.path.join(settings.BASE_DIR, "manage.py"), "benchmark",
+           "--run-stage", stage, "--result-file", result_path, "--", *argv]
+    with open(log_path, "w") as log:
+        proc = subprocess.run(cmd, env=env, stdout=log, stderr=subprocess.STDOUT)
+    if proc.returncode != 0 or not os.path.exists(result_path):
+        return {"stage": stage, "variant": variant, "status": "error",
+                "error": f"exit code {proc.returncode}, see {log_path}"}
+    with open(result_path) as f:
+        return {**json.load(f), "variant": variant}
+
+
+def migrate_scratch(db_path, artifacts_dir, log_path):
+    env = {**os.environ, "DSM25_DB_PATH": str(db_path), "DSM25_ARTIFACTS_DIR": str(artifacts_dir)}
+    with open(log_path, "w") as log:
+        subprocess.run([sys.executable, os.path.join(settings.BASE_DIR, "manage.py"), "migrate", "--no-input"],
+                       env=env, stdout=log, stderr=subprocess.STDOUT, check=True)
+
+
+def environment():
+    """What the numbers depend on, stored with every result file."""
+    import django
+    import numpy
+    import sklearn
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "numpy": numpy.__version__,
+        "sklearn": sklearn.__version__,
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def median_result(runs):
+    """Collapse repeats of one (size, stage) into their median per metric (errors win)."""
+    failed = [r for r in runs if r["status"] != "ok"]
+    if failed:
+        return failed[0]
+    out = dict(runs[0])
+    for key in METRICS + ["rows", "children_peak_rss_mb"]:
+        values = sorted(r[key] for r in runs if r.get(key) is not None)
+        if values:
+            out[key] = values[len(values) // 2]
+    out["repeats"] = len(runs)
+    return out
+
+
+def compare(results, baseline, tolerance):
+    """
+    Per (size, stage, variant) metric changes against a baseline result file.
+    Returns rows (size, stage, metric, base, current, change) and the regressions among them:
+    a metric more than `tolerance` (fraction) worse than its baseline.
+    """
+    base = {(r["size"], r["stage"], r.get("variant")): r
+            for r in baseline.get("results", []) if r.get("status") == "ok"}
+    rows, regressions = [], []
+    for r in results:
+        b = base.get((r["size"], r["stage"], r.get("variant")))
+        if b is None or r["status"] != "ok":
+            continue
+        for metric in METRICS:
+            old, new = b.get(metric), r.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            row = (r["size"], r["stage"], metric, old, new, change)
+            rows.append(row)
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            if worse > tolerance:
+                regressions.append(row)
+    return rows, regressions
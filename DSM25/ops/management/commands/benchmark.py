@@ -0,0 +1,158 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.synth import generate
+from ops.bench import (
+    STAGES, compare, environment, measure_stage, median_result, migrate_scratch, parse_size,
+    run_stage_subprocess, size_label,
+)
+
+BENCH_DIR = os.path.join(settings.BASE_DIR, "benchmarks")
+
+
+class Command(BaseCommand):
+    help = ("Benchmark import_data, score_diabetes and note_classifier on generated datasets: wall time, "
+            "peak RSS, rows/sec and DB queries per stage, as JSON plus a comparison with a stored baseline. "
+            "Runs against scratch databases; the configured database is not touched.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="10k,100k", help="Comma-separated patient counts (default 10k,100k)")
+        parser.add_argument("--stages", default=",".join(STAGES),
+                            help=f"Comma-separated stages, run in pipeline order (default {','.join(STAGES)})")
+        parser.add_argument("--repeat", type=int, default=1,
+                            help="Runs per size; each metric reports the median (default 1)")
+        parser.add_argument("--seed", type=int, default=42, help="Dataset seed (default 42)")
+        parser.add_argument("--bulk-load", action="store_true",
+                            help="Run every stage with --bulk-load (SQLite WAL, relaxed sync, deferred index "
+                                 "builds); results are tagged variant=bulk-load and only compared with the same "
+                                 "variant")
+        parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "dsm25-bench"),
+                            help="Generated datasets (reused across runs), scratch DBs and stage logs")
+        parser.add_argument("--output", default=None,
+                            help="Result JSON path (default benchmarks/results/<timestamp>.json)")
+        parser.add_argument("--baseline", default=os.path.join(BENCH_DIR, "baseline.json"),
+                            help="Result file to compare against (default benchmarks/baseline.json)")
+        parser.add_argument("--save-baseline", action="store_true", help="Also store this run as the baseline")
+        parser.add_argument("--tolerance", type=float, default=0.10,
+                            help="Report a metric as regressed when it is this fraction worse (default 0.10)")
+        parser.add_argument("--fail-on-regression", action="store_true", help="Exit non-zero on any regression")
+        # Internal: one stage inside the scratch-DB subprocess
+        parser.add_argument("--run-stage", choices=list(STAGES), help=argparse.SUPPRESS)
+        parser.add_argument("--result-file", help=argparse.SUPPRESS)
+        parser.add_argument("stage_args", nargs="*", help=argparse.SUPPRESS)
+
+    def handle(self, *args, **opts):
+        if opts["run_stage"]:
+            result = measure_stage(opts["run_stage"], opts["stage_args"], log=self.stdout)
+            with open(opts["result_file"], "w") as f:
+                json.dump(result, f)
+            return
+
+        try:
+            sizes = [parse_size(s) for s in opts["sizes"].split(",") if s.strip()]
+        except ValueError as e:
+            raise CommandError(str(e))
+        stages = [s.strip() for s in opts["stages"].split(",") if s.strip()]
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            raise CommandError(f"Unknown stages: {', '.join(sorted(unknown))}")
+        stages = [s for s in STAGES if s in stages]
+        if opts["repeat"] < 1:
+            raise CommandError("--repeat must be >= 1")
+
+        workdir = opts["workdir"]
+        results = []
+        for size in sizes:
+            label = size_label(size)
+            dataset = self.dataset(workdir, size, opts["seed"])
+            runs = {stage: [] for stage in stages}
+            for rep in range(opts["repeat"]):
+                scratch = os.path.join(workdir, "run", label)
+                shutil.rmtree(scratch, ignore_errors=True)
+                os.makedirs(scratch)
+                db_path, artifacts = os.path.join(scratch, "bench.sqlite3"), os.path.join(scratch, "artifacts")
+                migrate_scratch(db_path, artifacts, os.path.join(scratch, "migrate.log"))
+                for stage in stages:
+                    r = run_stage_subprocess(stage, dataset, db_path, artifacts,
+                                             os.path.join(scratch, f"{stage}.{rep}.log"),
+                                             extra_args=["--bulk-load"] if opts["bulk_load"] else (),
+                                             variant="bulk-load" if opts["bulk_load"] else None)
+                    runs[stage].append(r)
+                    self.stdout.write(f"  {label} {stage} (run {rep + 1}/{opts['repeat']}): {self.summary(r)}")
+            for stage in stages:
+                results.append({"size": size, **median_result(runs[stage])})
+
+        report = {
+            "created_at": timezone.now().isoformat(),
+            "environment": environment(),
+            "seed": opts["seed"],
+            "variant": "bulk-load" if opts["bulk_load"] else None,
+            "sizes": sizes,
+            "stages": stages,
+            "results": results,
+        }
+        output = opts["output"] or os.path.join(BENCH_DIR, "results", f"{timezone.now():%Y%m%d_%H%M%S}.json")
+        self.write_json(output, report)
+
+        self.stdout.write("")
+        self.stdout.write(f"{'size':>6}  {'stage':<16}{'wall s':>9}{'rows/s':>12}{'peak MB':>9}{'queries':>9}")
+        for r in results:
+            self.stdout.write(f"{size_label(r['size']):>6}  {r['stage']:<16}" + (
+                f"{r['wall_s']:>9.2f}{r['rows_per_s'] or 0:>12,.0f}{r['peak_rss_mb']:>9.0f}{r['queries']:>9}"
+                if r["status"] == "ok" else f"  {r['error']}"
+            ))
+        self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+
+        regressions = self.compare_baseline(opts["baseline"], results, opts["tolerance"])
+        if opts["save_baseline"]:
+            self.write_json(opts["baseline"], report)
+            self.stdout.write(self.style.SUCCESS(f"Saved as baseline {opts['baseline']}"))
+        if regressions and opts["fail_on_regression"]:
+            raise CommandError(f"{len(regressions)} metric(s) regressed beyond {opts['tolerance']:.0%}")
+
+    def dataset(self, workdir, size, seed):
+        """Generated CSVs for `size` patients, built once per (size, seed) and reused."""
+        out = os.path.join(workdir, "data", f"{size_label(size)}-seed{seed}")
+        marker = os.path.join(out, "COMPLETE")
+        if not os.path.exists(marker):
+            self.stdout.write(f"Generating {size_label(size)} patient dataset in {out}…")
+            shutil.rmtree(out, ignore_errors=True)
+            generate(out, size, seed=seed, sample=os.path.join(settings.BASE_DIR, "data", "raw_test", "patient_lab.csv"))
+            open(marker, "w").close()
+        return {table: os.path.join(out, f"{table}.csv") for table in ("patient_info", "patient_lab", "notes")}
+
+    def compare_baseline(self, path, results, tolerance):
+        if not os.path.exists(path):
+            self.stdout.write(self.style.WARNING(f"No baseline at {path}; run with --save-baseline to store one."))
+            return []
+        with open(path) as f:
+            baseline = json.load(f)
+        rows, regressions = compare(results, baseline, tolerance)
+        base_env = baseline.get("environment", {})
+        self.stdout.write(f"\nAgainst baseline {path} (commit {base_env.get('commit')}, {baseline.get('created_at')}):")
+        for size, stage, metric, old, new, change in rows:
+            line = f"{size_label(size):>6}  {stage:<16}{metric:<12}{old:>12,.2f} -> {new:>12,.2f}  {change:+.1%}"
+            regressed = any(r[:3] == (size, stage, metric) for r in regressions)
+            self.stdout.write(self.style.ERROR(line + "  REGRESSION") if regressed else line)
+        if not rows:
+            self.stdout.write("  no matching (size, stage) pairs")
+        return regressions
+
+    def summary(self, r):
+        if r["status"] != "ok":
+            return f"ERROR {r['error']}"
+        return (f"{r['wall_s']:.2f}s, {r['rows']} rows ({r['rows_per_s'] or 0:,.0f}/s), "
+                f"peak {r['peak_rss_mb']:.0f} MB, {r['queries']} queries")
+
+    def write_json(self, path, data):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2)
+
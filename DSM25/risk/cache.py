@@ -0,0 +1,182 @@
+"""
+On-disk, memory-mapped cache of lab feature rows.
+
+Every Patient_lab row attached to a patient is stored once, in id order, as the
+float32 row `fill_block` produces (before any model's scaler, so the cache
+survives retraining), next to its lab and patient ids:
+
+    ARTIFACTS_DIR/features/spec-<feature_spec_version()>/
+        X.npy  lab_ids.npy  patient_ids.npy  meta.json
+
+Labs are an append-only history (import_data loads changed source rows as new
+lab versions), so `sync()` only appends labs above the cached watermark. Rows
+are written first and meta.json, replaced atomically, commits them; a reader
+that opens the arrays with `arrays()` maps exactly the committed rows without
+copying, and later appends never move them. Editing a lab in place is not
+detected: rebuild with `score_diabetes --rebuild-feature-cache`.
+"""
+import json
+import os
+import struct
+from contextlib import contextmanager
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+from core.models import Patient_lab
+from risk.features import EXTRACT_CHUNK, FEATURES, feature_spec_version, iter_feature_chunks
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, syncs must not overlap
+    fcntl = None
+
+HEADER_LEN = 128  # fixed-size .npy header, so the row count can be rewritten in place on append
+
+# name -> (dtype, trailing shape)
+ARRAYS = {
+    "patient_ids": (np.dtype(np.int64), ()),
+    "lab_ids": (np.dtype(np.int64), ()),
+    "X": (np.dtype(np.float32), (len(FEATURES),)),
+}
+
+
+def _npy_header(dtype, shape):
+    # .npy format 1.0: magic, version, little-endian header length, dict literal padded to HEADER_LEN
+    text = repr({"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": tuple(shape)})
+    text = text.encode("latin1").ljust(HEADER_LEN - 11) + b"\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(text)) + text
+
+
+def cached_labs():
+    # What the cache holds: every lab attached to a patient
+    return Patient_lab.objects.filter(Patient_id__isnull=False)
+
+
+class FeatureCache:
+    def __init__(self, root=None):
+        self.root = root or os.path.join(settings.ARTIFACTS_DIR, "features", f"spec-{feature_spec_version()}")
+        self._latest = None
+
+    def path(self, name):
+        return os.path.join(self.root, f"{name}.npy" if name in ARRAYS else name)
+
+    def meta(self):
+        try:
+            with open(self.path("meta.json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def arrays(self):
+        """(patient_ids, lab_ids, X) as read-only memory maps of the committed rows; None if never synced."""
+        meta = self.meta()
+        if meta is None:
+            return None
+        rows = meta["rows"]
+        return tuple(np.load(self.path(name), mmap_mode="r")[:rows] for name in ARRAYS)
+
+    def sync(self, rebuild=False, chunk_size=EXTRACT_CHUNK):
+        """
+        Bring the cache up to the current labs: reuse it as is, append the labs
+        above its watermark, or rebuild it when it belongs to another database
+        or labs below the watermark were deleted. Returns {rows, appended, rebuilt}.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock():
+            meta = self.meta()
+            db = str(connection.settings_dict["NAME"])
+            if (rebuild or meta is None or meta.get("db") != db
+                    or cached_labs().filter(id__lte=meta["watermark"]).count() != meta["rows"]):
+                meta, rebuilt = {"spec": feature_spec_version(), "db": db, "watermark": 0, "rows": 0}, True
+                if os.path.exists(self.path("meta.json")):
+                    os.unlink(self.path("meta.json"))  # readers stop trusting the old files first
+            else:
+                rebuilt = False
+
+            rows, watermark = meta["rows"], meta["watermark"]
+            files = {name: self._open(name, rows) for name in ARRAYS}
+            try:
+                new = cached_labs().filter(id__gt=watermark).order_by("id")
+                for pids, lab_ids, X in iter_feature_chunks(new, chunk_size):
+                    for name, block in (("patient_ids", pids), ("lab_ids", lab_ids), ("X", X)):
+                        files[name].write(np.ascontiguousarray(block, dtype=ARRAYS[name][0]).tobytes())
+                    rows += len(lab_ids)
+                    watermark = int(lab_ids[-1])
+                for name, f in files.items():
+                    f.truncate()
+                    f.seek(0)
+                    f.write(_npy_header(ARRAYS[name][0], (rows, *ARRAYS[name][1])))
+                    f.flush()
+                    os.fsync(f.fileno())
+            finally:
+                for f in files.values():
+                    f.close()
+
+            appended = rows - meta["rows"]
+            meta.update(rows=rows, watermark=watermark)
+            tmp = self.path(".meta.json.tmp")
+            with open(tmp, "w") as f:
+                json.dump(meta, f)
+            os.replace(tmp, self.path("meta.json"))
+        self._latest = None
+        return {"rows": rows, "appended": appended, "rebuilt": rebuilt}
+
+    def latest_positions(self):
+        """Cache row of each patient's newest lab, in patient id order (what LatestLab points at)."""
+        if self._latest is None:
+            pids = self.arrays()[0]
+            # lab ids ascend, so a patient's last row is its newest lab
+            _, first_from_end = np.unique(pids[::-1], return_index=True)
+            self._latest = len(pids) - 1 - first_from_end
+        return self._latest
+
+    def chunks(self, labs, chunk_size=EXTRACT_CHUNK):
+        """
+        Like iter_feature_chunks(labs) but only ids come from the DB; feature rows are
+        gathered from the cache (labs newer than the last sync are read from the DB).
+        labs=None means every patient's latest lab, taken from the cache alone.
+        """
+        cached_pids, cached_ids, cached_X = self.arrays()
+        if labs is None:
+            latest = self.latest_positions()
+            for start in range(0, len(latest), chunk_size):
+                pos = latest[start:start + chunk_size]
+                yield np.asarray(cached_pids[pos]), np.asarray(cached_ids[pos]), np.asarray(cached_X[pos])
+            return
+        it = labs.values_list("Patient_id", "id").iterator(chunk_size=chunk_size)
+        while rows := list(islice(it, chunk_size)):
+            ids = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows))
+            pids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+            pos = np.minimum(np.searchsorted(cached_ids, ids), max(len(cached_ids) - 1, 0))
+            hit = cached_ids[pos] == ids if len(cached_ids) else np.zeros(len(ids), dtype=bool)
+            X = np.empty((len(ids), len(FEATURES)), dtype=np.float32)
+            X[hit] = cached_X[pos[hit]]
+            if not hit.all():
+                missing = {int(i): k for k, i in enumerate(ids) if not hit[k]}
+                for _, lab_ids, Xm in iter_feature_chunks(Patient_lab.objects.filter(id__in=list(missing))):
+                    X[[missing[int(i)] for i in lab_ids]] = Xm
+            yield pids, ids, X
+
+    def _open(self, name, rows):
+        # Open for appending after the committed rows (anything past them is an interrupted sync)
+        path = self.path(name)
+        dtype, trailing = ARRAYS[name]
+        if rows == 0 or not os.path.exists(path):
+            if os.path.exists(path):
+                os.unlink(path)  # a new inode: processes still mapping the old file keep valid pages
+            f = open(path, "w+b")
+            f.write(_npy_header(dtype, (0, *trailing)))
+            return f
+        f = open(path, "r+b")
+        f.seek(HEADER_LEN + rows * dtype.itemsize * int(np.prod(trailing, dtype=np.int64)))
+        return f
+
+    @contextmanager
+    def _lock(self):
+        with open(self.path(".lock"), "w") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
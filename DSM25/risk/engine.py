@@ -0,0 +1,192 @@
+"""
+Chunked, bounded-memory risk scoring.
+
+Features stream from the DB `chunk_size` rows at a time; each chunk is scored
+in a process pool whose workers receive the fitted artifact once, at start-up.
+At most 2 * workers chunks are in flight and results come back in submission
+order, so memory is roughly chunk_size * (2 * workers + 1) feature rows no
+matter how large the cohort is.
+
+Scoring with a saved model writes each chunk as soon as it is scored. A training
+run needs population-wide numbers first (min/max for normalization, the k-th
+largest score for the top-fraction cutoff): raw scores are spilled to a
+temporary memory-mapped file, the exact k-th largest is found with a bounded
+histogram select over it, and a second pass normalizes and writes.
+
+Nothing in here touches the ORM (querysets come in as arguments and job
+progress goes out through a callback), so pool workers started with spawn or
+forkserver can import it without Django being set up.
+"""
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from risk.features import iter_feature_chunks
+from risk.model import calibrate, fit_estimators, normalize_scores, raw_scores, top_k
+
+DEFAULT_CHUNK = 50000
+TRAIN_SAMPLE = 200000   # rows the scaler/IsolationForest are fitted on (all rows if the cohort is smaller)
+SELECT_BINS = 4096
+SELECT_LIMIT = 1000000  # candidates held in memory by the final partition of the k-th largest select
+
+_artifact = None
+
+
+def _no_progress(done=None, total=None, step=None, force=False):
+    pass
+
+
+def _init_worker(artifact):
+    global _artifact
+    _artifact = artifact
+
+
+def _score_chunk(X):
+    return raw_scores(_artifact, X)
+
+
+def scored_chunks(chunks, artifact, workers=1):
+    """Yield (patient_ids, lab_ids, raw_scores) for each (patient_ids, lab_ids, X) chunk, in order."""
+    if workers <= 1:
+        for pids, lab_ids, X in chunks:
+            yield pids, lab_ids, raw_scores(artifact, X)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(artifact,)) as pool:
+        pending = deque()
+        for pids, lab_ids, X in chunks:
+            pending.append((pids, lab_ids, pool.submit(_score_chunk, X)))
+            if len(pending) >= 2 * workers:
+                pids_, lab_ids_, future = pending.popleft()
+                yield pids_, lab_ids_, future.result()
+        while pending:
+            pids_, lab_ids_, future = pending.popleft()
+            yield pids_, lab_ids_, future.result()
+
+
+def feature_chunks(labs, chunk_size, cache=None):
+    # Feature rows from a synced risk.cache.FeatureCache when given, else straight from the DB
+    return cache.chunks(labs, chunk_size) if cache is not None else iter_feature_chunks(labs, chunk_size)
+
+
+def training_sample(labs, count, size=TRAIN_SAMPLE, chunk_size=DEFAULT_CHUNK, seed=42, cache=None):
+    """Uniform sample of `size` feature rows (every row when count <= size), read chunk by chunk."""
+    positions = None
+    if count > size:
+        positions = np.sort(np.random.default_rng(seed).choice(count, size, replace=False))
+    out = []
+    offset = 0
+    for _, _, X in feature_chunks(labs, chunk_size, cache):
+        if positions is None:
+            out.append(X)
+        else:
+            lo, hi = np.searchsorted(positions, [offset, offset + len(X)])
+            out.append(X[positions[lo:hi] - offset])
+        offset += len(X)
+    return np.concatenate(out) if out else np.empty((0, 0), dtype=np.float32)
+
+
+def kth_largest(values, k, lo, hi, chunk_size=DEFAULT_CHUNK):
+    """
+    Exact k-th largest of a 1-D (memory-mapped) array, reading it in chunks:
+    histogram the current [lo, hi] window, narrow it to the bin that holds the
+    k-th value, repeat until few enough candidates remain to partition in memory.
+    """
+    above = 0  # values known to be larger than the window
+    for _ in range(64):
+        width = hi - lo
+        if width <= 0:
+            return float(lo)
+        counts = np.zeros(SELECT_BINS, dtype=np.int64)
+        mins = np.full(SELECT_BINS, np.inf)
+        maxs = np.full(SELECT_BINS, -np.inf)
+        for start in range(0, len(values), chunk_size):
+            v = np.asarray(values[start:start + chunk_size])
+            v = v[(v >= lo) & (v <= hi)]
+            idx = np.minimum(((v - lo) / width * SELECT_BINS).astype(np.int64), SELECT_BINS - 1)
+            counts += np.bincount(idx, minlength=SELECT_BINS)
+            np.minimum.at(mins, idx, v)
+            np.maximum.at(maxs, idx, v)
+        if counts.sum() <= SELECT_LIMIT:
+            break
+        # Walk bins from the top; the bin index is monotonic in the value, so the
+        # chosen bin is exactly the values in [its min, its max]
+        from_top = above + np.cumsum(counts[::-1])
+        b = SELECT_BINS - 1 - int(np.searchsorted(from_top, k))
+        above += int(counts[b + 1:].sum())
+        lo, hi = mins[b], maxs[b]
+
+    candidates = []
+    for start in range(0, len(values), chunk_size):
+        v = np.asarray(values[start:start + chunk_size])
+        candidates.append(v[(v >= lo) & (v <= hi)])
+    candidates = np.concatenate(candidates)
+    j = k - above
+    return float(np.partition(candidates, -j)[-j])
+
+
+def score_cohort(labs, count, write, artifact=None, fraction=0.05, chunk_size=DEFAULT_CHUNK, workers=1,
+                 train_sample=TRAIN_SAMPLE, cache=None, progress=_no_progress):
+    """
+    Score every lab in the `labs` queryset (`count` rows), calling
+    write(patient_ids, lab_ids, scores, high_flags) once per chunk.
+
+    With `artifact=None` the model is fitted first (on up to `train_sample` rows)
+    and calibrated on the whole cohort. Returns (artifact, stats) with stats
+    holding n, high and the first (score, high) pair. `cache` is an optional,
+    already synced FeatureCache to read feature rows from; with a cache, labs=None
+    scores every patient's latest lab straight from it. `progress` is called
+    like core.jobs.progress.
+    """
+    stats = {"n": 0, "high": 0, "first": None}
+
+    def emit(pids, lab_ids, scores, high):
+        if stats["first"] is None and len(scores):
+            stats["first"] = (float(scores[0]), bool(high[0]))
+        write(pids, lab_ids, scores, high)
+        stats["n"] += len(scores)
+        stats["high"] += int(high.sum())
+        progress(done=stats["n"], total=count)
+
+    chunks = feature_chunks(labs, chunk_size, cache)
+
+    if artifact is not None:
+        progress(done=0, total=count, step="Scoring with saved model")
+        for pids, lab_ids, inv in scored_chunks(chunks, artifact, workers):
+            emit(pids, lab_ids, *normalize_scores(artifact, inv))
+        return artifact, stats
+
+    progress(done=0, total=count, step="Training IsolationForest")
+    artifact = fit_estimators(training_sample(labs, count, train_sample, chunk_size, cache=cache), fraction)
+
+    with tempfile.TemporaryDirectory(prefix="risk-score-") as tmp:
+        def spill(name, dtype):
+            return np.lib.format.open_memmap(os.path.join(tmp, name), mode="w+", dtype=dtype, shape=(max(count, 1),))
+        inv_mm, pid_mm, lab_mm = spill("inv.npy", np.float64), spill("pid.npy", np.int64), spill("lab.npy", np.int64)
+
+        # Pass 1: raw scores for everyone, spilled to disk, with running min/max
+        progress(done=0, total=count, step="Scoring cohort (pass 1/2)")
+        n, lo, hi = 0, np.inf, -np.inf
+        for pids, lab_ids, inv in scored_chunks(chunks, artifact, workers):
+            m = min(len(inv), count - n)  # rows inserted since count() are left for the next run
+            if m <= 0:
+                break
+            inv_mm[n:n + m], pid_mm[n:n + m], lab_mm[n:n + m] = inv[:m], pids[:m], lab_ids[:m]
+            lo, hi = min(lo, float(inv[:m].min())), max(hi, float(inv[:m].max()))
+            n += m
+            progress(done=n)
+        if n == 0:
+            return calibrate(artifact, 0.0, 0.0, 0.0), stats
+
+        # Exact population cutoff, then pass 2: normalize and write chunk by chunk
+        calibrate(artifact, lo, hi, kth_largest(inv_mm[:n], top_k(n, fraction), lo, hi, chunk_size))
+        progress(done=0, total=n, step="Writing scores (pass 2/2)")
+        for start in range(0, n, chunk_size):
+            end = min(start + chunk_size, n)
+            emit(np.asarray(pid_mm[start:end]), np.asarray(lab_mm[start:end]),
+                 *normalize_scores(artifact, np.asarray(inv_mm[start:end])))
+        del inv_mm, pid_mm, lab_mm
+    return artifact, stats
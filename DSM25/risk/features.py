@@ -0,0 +1,63 @@
+"""Feature spec shared by risk scoring and the lab importers, plus columnar extraction."""
+import hashlib
+from itertools import islice
+
+import numpy as np
+
+ACTIVITY_MAP = {"low": 0, "moderate": 1, "medium": 1, "high": 2, "none": 0, "": 0, None: 0}
+
+FEATURES = [
+    "Age", "BMI", "Systolic_BP", "Diastolic_BP",
+    "Total_Cholesterol", "HDL_Cholesterol", "LDL_Cholesterol",
+    "Triglycerides", "Smoking_status", "Physical_Activity_Level",
+]
+
+# Patient_lab field behind each feature, same order as FEATURES
+FEATURE_FIELDS = [
+    "Age", "BMI", "Systolic_BP", "Diastolic_BP",
+    "Total_Cholesterol", "HDL_Cholesterol", "LDL_Cholesterol",
+    "Triglycerides", "Smoking_status", "Physical_activity",
+]
+
+# Imputed when a value is missing or 0 (the old per-row `value or default`)
+DEFAULTS = np.array([0, 26.0, 125.0, 78.0, 190.0, 50.0, 110.0, 120.0, 0, 0], dtype=np.float32)
+
+EXTRACT_CHUNK = 20000
+
+# Bump when extraction/imputation code changes in a way the constants above do not show
+FEATURE_SPEC_REVISION = 1
+
+
+def feature_spec_version():
+    """Short fingerprint of everything that decides a lab's feature row (used to key cached matrices)."""
+    spec = (FEATURE_SPEC_REVISION, FEATURES, FEATURE_FIELDS, DEFAULTS.tolist(),
+            sorted(ACTIVITY_MAP.items(), key=str))
+    return hashlib.sha1(repr(spec).encode()).hexdigest()[:12]
+
+
+def activity_codes(values):
+    """Vectorized ACTIVITY_MAP over a column of activity strings; unknown -> 0."""
+    col = np.array(["" if v is None else v for v in values], dtype=object)
+    uniq, inverse = np.unique(col, return_inverse=True)
+    table = np.array([ACTIVITY_MAP.get(u.strip().lower(), 0) for u in uniq], dtype=np.float32)
+    return table[inverse.reshape(-1)]
+
+
+def fill_block(out, rows):
+    """Write value tuples (Patient_id, id, *FEATURE_FIELDS) into float32 matrix `out`; returns (patient_ids, lab_ids)."""
+    cols = list(zip(*rows))
+    for j, values in enumerate(cols[2:-1]):
+        out[:, j] = np.array(values, dtype=np.float64)  # None -> nan
+    out[:, -1] = activity_codes(cols[-1])
+    missing = np.isnan(out) | (out == 0)
+    out[missing] = np.broadcast_to(DEFAULTS, out.shape)[missing]
+    return np.array(cols[0], dtype=np.int64), np.array(cols[1], dtype=np.int64)
+
+
+def iter_feature_chunks(labs, chunk_size=EXTRACT_CHUNK):
+    """Yield (patient_ids, lab_ids, X float32) per `chunk_size` rows of a Patient_lab queryset."""
+    it = labs.values_list("Patient_id", "id", *FEATURE_FIELDS).iterator(chunk_size=chunk_size)
+    while rows := list(islice(it, chunk_size)):
+        X = np.empty((len(rows), len(FEATURES)), dtype=np.float32)
+        patient_ids, lab_ids = fill_block(X, rows)
+        yield patient_ids, lab_ids, X
@@ -0,0 +1,107 @@
+"""
+RiskScore history upkeep: the one-row-per-patient CurrentRiskScore table and
+compaction of old runs into RiskScoreSummary rows.
+"""
+from django.db import connection, transaction
+from django.db.models import F, Max, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from core.models import CurrentRiskScore, RiskScore, RiskScoreSummary
+
+CURRENT_FIELDS = ["Lab", "Score", "HighRisk", "Scored_at"]
+
+
+def upsert_current(scores):
+    """Make `scores` (RiskScore instances, one per patient) the patients' current scores."""
+    CurrentRiskScore.objects.bulk_create(
+        [
+            CurrentRiskScore(Patient_id_id=s.Patient_id_id, Lab_id=s.Lab_id, Score=s.Score,
+                             HighRisk=s.HighRisk, Scored_at=s.Scored_at)
+            for s in scores
+        ],
+        update_conflicts=True, unique_fields=["Patient_id"], update_fields=CURRENT_FIELDS, batch_size=1000,
+    )
+
+
+def rebuild_current_scores():
+    """Recompute CurrentRiskScore from the newest RiskScore per patient; returns the row count."""
+    qn = connection.ops.quote_name
+    cols = ", ".join(qn(RiskScore._meta.get_field(f).column) for f in ["Patient_id", *CURRENT_FIELDS])
+    with transaction.atomic(), connection.cursor() as cursor:
+        CurrentRiskScore.objects.all().delete()
+        cursor.execute(
+            f"INSERT INTO {qn(CurrentRiskScore._meta.db_table)} ({cols}) "
+            f"SELECT {cols} FROM (SELECT {cols}, ROW_NUMBER() OVER ("
+            f"PARTITION BY {qn('Patient_id_id')} ORDER BY {qn('Scored_at')} DESC, {qn('id')} DESC) AS rn "
+            f"FROM {qn(RiskScore._meta.db_table)}) latest WHERE rn = 1"
+        )
+    return CurrentRiskScore.objects.count()
+
+
+def compact_before(cutoff, patients_per_batch=2000, dry_run=False):
+    """
+    Fold RiskScore rows older than `cutoff` into per-patient RiskScoreSummary rows
+    (runs, HighRisk runs, min/max, first/last scored, last score) and delete them.
+    Works through patient-id windows, each summarized and pruned in one transaction,
+    so an interrupted run never double-counts. The run behind each patient's
+    CurrentRiskScore is always kept; a patient without one (never upserted, or
+    the table not rebuilt yet) keeps its newest run instead. Returns (rows
+    folded, patients touched); a dry run counts the rows it would delete.
+    """
+    current = CurrentRiskScore.objects.filter(Patient_id=OuterRef("Patient_id")).values("Scored_at")
+    newest = (RiskScore.objects.filter(Patient_id=OuterRef("Patient_id"))
+              .order_by("-Scored_at").values("Scored_at")[:1])
+    old = (
+        RiskScore.objects.filter(Scored_at__lt=cutoff)
+        .annotate(keep_from=Coalesce(Subquery(current), Subquery(newest)))
+        .filter(Scored_at__lt=F("keep_from"))
+    )
+    bounds = old.aggregate(lo=Min("Patient_id"), hi=Max("Patient_id"))
+    if bounds["lo"] is None:
+        return 0, 0
+
+    rows_total = patients_total = 0
+    for start in range(bounds["lo"], bounds["hi"] + 1, patients_per_batch):
+        window = old.filter(Patient_id__gte=start, Patient_id__lt=start + patients_per_batch)
+        with transaction.atomic():
+            rollup, folded = {}, 0
+            rows = window.order_by("Patient_id", "Scored_at", "id").values_list(
+                "Patient_id", "Score", "HighRisk", "Scored_at")
+            for pid, score, high, scored_at in rows.iterator(chunk_size=10000):
+                folded += 1
+                r = rollup.get(pid)
+                if r is None:
+                    rollup[pid] = RiskScoreSummary(
+                        Patient_id_id=pid, Runs=1, High_runs=int(high), Min_score=score, Max_score=score,
+                        Last_score=score, Last_high=high, First_scored_at=scored_at, Last_scored_at=scored_at,
+                    )
+                    continue
+                r.Runs += 1
+                r.High_runs += int(high)
+                r.Min_score = min(r.Min_score, score)
+                r.Max_score = max(r.Max_score, score)
+                r.Last_score, r.Last_high, r.Last_scored_at = score, high, scored_at
+            if not rollup:
+                continue
+
+            # Merge into summaries left by earlier compactions (all older than this window's rows)
+            for prev in RiskScoreSummary.objects.filter(Patient_id__in=list(rollup)):
+                r = rollup[prev.Patient_id_id]
+                r.Runs += prev.Runs
+                r.High_runs += prev.High_runs
+                r.Min_score = min(r.Min_score, prev.Min_score)
+                r.Max_score = max(r.Max_score, prev.Max_score)
+                r.First_scored_at = min(r.First_scored_at, prev.First_scored_at)
+
+            if not dry_run:
+                RiskScoreSummary.objects.bulk_create(
+                    rollup.values(), update_conflicts=True, unique_fields=["Patient_id"],
+                    update_fields=["Runs", "High_runs", "Min_score", "Max_score", "Last_score", "Last_high",
+                                   "First_scored_at", "Last_scored_at"],
+                    batch_size=1000,
+                )
+                deleted, _ = window.delete()
+                folded = deleted
+            rows_total += folded
+            patients_total += len(rollup)
+    return rows_total, patients_total
@@ -0,0 +1,46 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.bulkload import recover_interrupted_load
+from core.jobs import progress
+from risk.history import compact_before, rebuild_current_scores
+
+
+class Command(BaseCommand):
+    help = ("Fold RiskScore rows older than --keep-days into per-patient RiskScoreSummary rows "
+            "(runs, min/max/last score) and delete them. Each patient's current score is kept.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep-days", type=int, default=90,
+                            help="Raw RiskScore rows newer than this many days are kept (default 90)")
+        parser.add_argument("--batch", type=int, default=2000,
+                            help="Patients summarized and pruned per transaction (default 2000)")
+        parser.add_argument("--dry-run", action="store_true", help="Report what would be folded, change nothing")
+        parser.add_argument("--rebuild-current", action="store_true",
+                            help="First recompute CurrentRiskScore from the RiskScore history")
+
+    def handle(self, *args, **opts):
+        recover_interrupted_load(self.stdout.write)
+        if opts["keep_days"] < 0:
+            raise CommandError("--keep-days must be >= 0")
+
+        if opts["rebuild_current"] and not opts["dry_run"]:
+            progress(step="Rebuilding current scores")
+            count = rebuild_current_scores()
+            self.stdout.write(self.style.SUCCESS(f"CurrentRiskScore rebuilt: {count} patients"))
+
+        cutoff = timezone.now() - timedelta(days=opts["keep_days"])
+        progress(step=f"Compacting scores before {cutoff:%Y-%m-%d}")
+        rows, patients = compact_before(cutoff, patients_per_batch=opts["batch"], dry_run=opts["dry_run"])
+
+        if opts["dry_run"]:
+            self.stdout.write(self.style.HTTP_INFO(
+                f"[DRY RUN] Would fold {rows} RiskScore rows older than {cutoff:%Y-%m-%d} "
+                f"into summaries for {patients} patients."
+            ))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Folded {rows} RiskScore rows older than {cutoff:%Y-%m-%d} into summaries for {patients} patients."
+        ))
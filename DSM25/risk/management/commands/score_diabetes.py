@@ -1,128 +1,185 @@
 from __future__ import annotations
 
-import numpy as np
-import pandas as pd
+from contextlib import nullcontext
 
-from django.core.management.base import BaseCommand
-from django.db.models import Max
+import sklearn
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Q
 from django.utils import timezone
 
-from sklearn.preprocessing import StandardScaler
-from sklearn.ensemble import IsolationForest
-
-from core.models import Patient_lab, RiskScore
-
-ACTIVITY_MAP = {"low": 0, "moderate": 1, "medium": 1, "high": 2, "none": 0, "": 0, None: 0}
-
-FEATURES = [
-    "Age", "BMI", "Systolic_BP", "Diastolic_BP",
-    "Total_Cholesterol", "HDL_Cholesterol", "LDL_Cholesterol",
-    "Triglycerides", "Smoking_status", "Physical_Activity_Level",
-]
-
-def labs_queryset():
-    # latest Patient_lab per patient
-    latest_ids = (
-        Patient_lab.objects
-        .values("Patient_id")
-        .annotate(max_id=Max("id"))
-        .values_list("max_id", flat=True)
-    )
-    return (
-        Patient_lab.objects
-        .filter(id__in=list(latest_ids))
-        .select_related("Patient_id")
-        .order_by("Patient_id_id")
-    )
-
-def row_to_dict(lab: Patient_lab) -> dict:
-    return {
-        "Patient_id": lab.Patient_id_id,
-        "Age": lab.Age or 0,
-        "BMI": float(lab.BMI or 26.0),
-        "Systolic_BP": float(lab.Systolic_BP or 125.0),
-        "Diastolic_BP": float(lab.Diastolic_BP or 78.0),
-        "Total_Cholesterol": float(lab.Total_Cholesterol or 190.0),
-        "HDL_Cholesterol": float(lab.HDL_Cholesterol or 50.0),
-        "LDL_Cholesterol": float(lab.LDL_Cholesterol or 110.0),
-        "Triglycerides": float(lab.Triglycerides or 120.0),
-        "Smoking_status": 1 if bool(lab.Smoking_status) else 0,
-        "Physical_Activity_Level": ACTIVITY_MAP.get(
-            (lab.Physical_activity or "").strip().lower(), 0
-        ),
-    }
+from core.bulkload import bulk_load_mode, recover_interrupted_load
+from core.jobs import progress
+from core.models import CurrentRiskScore, LatestLab, Patient_lab, RiskScore
+from core.registry import ArtifactNotFound
+from risk.cache import FeatureCache
+from risk.engine import DEFAULT_CHUNK, TRAIN_SAMPLE, score_cohort
+from risk.history import upsert_current
+from risk.model import registry
+
+DEFAULT_FRACTION = 0.05
+
+def labs_queryset(changed_only=False):
+    # latest Patient_lab per patient: one join through the maintained LatestLab pointer
+    qs = Patient_lab.objects.filter(latestlab__isnull=False)
+    if changed_only:
+        # ...newer than the lab behind the patient's current score (or never scored)
+        qs = qs.filter(
+            Q(Patient_id__currentriskscore__isnull=True)
+            | Q(Patient_id__currentriskscore__Lab__isnull=True)
+            | Q(id__gt=F("Patient_id__currentriskscore__Lab"))
+        )
+    return qs.order_by("Patient_id_id")
 
 class Command(BaseCommand):
-    help = "Train a simple IsolationForest on DB features and write RiskScore outcomes."
+    help = ("Write RiskScore outcomes with the current saved risk model; with --retrain, or when no model "
+            "is saved yet, first train a simple IsolationForest on DB features (saved as a new model version).")
 
     def add_arguments(self, parser):
-        parser.add_argument("--fraction", type=float, default=0.05,
-                            help="Top fraction to mark as HighRisk (default 0.05 = 5%)")
+        parser.add_argument("--fraction", type=float, default=None,
+                            help=f"When training: top fraction to mark as HighRisk (default {DEFAULT_FRACTION} "
+                                 "= 5%%). A saved model keeps the fraction it was trained with")
         parser.add_argument("--dry-run", action="store_true", help="Compute but do not write to DB")
+        parser.add_argument("--retrain", action="store_true",
+                            help="Fit and save a new model version even if one is saved")
+        parser.add_argument("--score-only", action="store_true",
+                            help="Never train: fail if no model is saved (by default a run without a saved "
+                                 "model trains one)")
+        parser.add_argument("--model-version", type=int, default=None,
+                            help="Saved model version to score with (default: current)")
+        parser.add_argument("--incremental", action="store_true",
+                            help="Implies --score-only: score only patients whose latest lab is newer than "
+                                 "the lab behind their last RiskScore, or who were never scored")
+        parser.add_argument("--bulk-load", action="store_true",
+                            help="SQLite: WAL + relaxed sync and rebuild RiskScore indexes after the insert")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK,
+                            help="Patients read, scored and written per chunk; peak memory is about "
+                                 f"chunk-size x (2 x workers + 1) feature rows (default {DEFAULT_CHUNK})")
+        parser.add_argument("--workers", type=int, default=1,
+                            help="Processes scoring chunks in parallel (default 1: in-process)")
+        parser.add_argument("--train-sample", type=int, default=TRAIN_SAMPLE,
+                            help=f"Rows the model is fitted on when training (default {TRAIN_SAMPLE}; "
+                                 "smaller cohorts are used whole)")
+        parser.add_argument("--no-feature-cache", action="store_true",
+                            help="Read feature rows from the DB instead of the memory-mapped feature cache")
+        parser.add_argument("--rebuild-feature-cache", action="store_true",
+                            help="Rebuild the feature cache from scratch (e.g. after labs were edited in place)")
 
     def handle(self, *args, **opts):
-        frac = opts["fraction"]
+        recover_interrupted_load(self.stdout.write)
+        frac = opts["fraction"] if opts["fraction"] is not None else DEFAULT_FRACTION
         dry = opts["dry_run"]
+        incremental = opts["incremental"]
+        if incremental:
+            opts["score_only"] = True
+        if opts["retrain"] and (opts["score_only"] or opts["model_version"] is not None):
+            raise CommandError("--retrain cannot be combined with --score-only, --incremental or --model-version")
+
+        artifact = None
+        if not opts["retrain"]:
+            try:
+                artifact, manifest = registry.load(opts["model_version"])
+            except ArtifactNotFound as e:
+                # Nothing saved yet: a plain run trains the first model
+                if opts["score_only"] or opts["model_version"] is not None:
+                    raise CommandError(str(e))
+        if artifact is not None:
+            if opts["fraction"] is not None and opts["fraction"] != artifact["fraction"]:
+                raise CommandError(
+                    f"Model v{manifest['version']} marks the top {artifact['fraction']:.2%} as HighRisk; "
+                    f"--fraction only applies when training, add --retrain to fit a model with {opts['fraction']:.2%}"
+                )
+            frac = artifact["fraction"]
+            if manifest["sklearn"] != sklearn.__version__:
+                self.stdout.write(self.style.WARNING(
+                    f"Model v{manifest['version']} was saved with scikit-learn {manifest['sklearn']}, "
+                    f"running {sklearn.__version__}; retrain if scores look off"
+                ))
+            self.stdout.write(self.style.HTTP_INFO(
+                f"Scoring with saved model v{manifest['version']} "
+                f"(trained {manifest['created_at']} on {manifest['n_train']} patients)"
+            ))
 
-        qs = labs_queryset()
-        labs = list(qs)
-        if not labs:
-            self.stdout.write(self.style.WARNING("No Patient_lab rows found. Nothing to score."))
+        progress(step="Loading latest labs")
+        skipped = 0
+        qs = labs_queryset(changed_only=incremental)
+        count = qs.count()
+        if incremental:
+            skipped = LatestLab.objects.count() - count
+        if not count:
+            if incremental and skipped:
+                self.stdout.write(self.style.SUCCESS(
+                    f"No patients with new labs since their last score. Skipped {skipped} patients."
+                ))
+            else:
+                self.stdout.write(self.style.WARNING("No Patient_lab rows found. Nothing to score."))
             return
 
-        # Build DataFrame
-        rows = [row_to_dict(l) for l in labs]
-        df = pd.DataFrame(rows)
-
-        # Matrix
-        X = df[FEATURES].values.astype(float)
-
-        # Scale + IsolationForest
-        scaler = StandardScaler()
-        Xs = scaler.fit_transform(X)
-
-        model = IsolationForest(contamination=frac, random_state=42)
-        model.fit(Xs)
+        cache = None
+        if not opts["no_feature_cache"]:
+            progress(step="Syncing feature cache")
+            cache = FeatureCache()
+            synced = cache.sync(rebuild=opts["rebuild_feature_cache"])
+            self.stdout.write(self.style.HTTP_INFO(
+                f"Feature cache: {synced['rows']} lab rows, "
+                + ("rebuilt" if synced["rebuilt"] else f"{synced['appended']} appended") + f" ({cache.root})"
+            ))
+            # Whole cohort and the cache agrees with LatestLab: no per-patient reads from the DB at all
+            if not incremental and len(cache.latest_positions()) == count:
+                qs = None
 
-        # Scores: IsolationForest decision_function → higher = less anomalous.
-        # We invert and min-max normalize to 0..1 so higher = higher risk.
-        raw = model.decision_function(Xs)
-        inv = -raw
-        inv -= inv.min()
-        if inv.max() > 0:
-            inv /= inv.max()
-        scores = inv
+        now = timezone.now()
 
-        # Top fraction as HighRisk
-        n = len(scores)
-        k = max(1, int(round(frac * n)))
-        cutoff = np.partition(scores, -k)[-k]  # k-th largest
-        high_flags = scores >= cutoff
+        def write(patient_ids, lab_ids, scores, high_flags):
+            # Each chunk commits on its own as soon as it is scored
+            if dry:
+                return
+            rows = [
+                RiskScore(
+                    Patient_id_id=int(pid),
+                    Lab_id=int(lab_id),
+                    Score=float(s),
+                    HighRisk=bool(h),
+                    Scored_at=now
+                )
+                for pid, lab_id, s, h in zip(patient_ids, lab_ids, scores, high_flags)
+            ]
+            with transaction.atomic():
+                RiskScore.objects.bulk_create(rows, batch_size=1000)
+                upsert_current(rows)
+
+        # Features stream in chunks (only the feature columns, no model instances / DataFrame);
+        # without a saved artifact (or with --retrain) the model is trained first and persisted for later runs
+        bulk = opts["bulk_load"] and not dry
+        with bulk_load_mode(RiskScore, CurrentRiskScore, log=self.stdout.write) if bulk else nullcontext():
+            trained = artifact is None
+            artifact, stats = score_cohort(
+                qs, count, write, artifact=artifact, fraction=frac, chunk_size=opts["chunk_size"],
+                workers=opts["workers"], train_sample=opts["train_sample"], cache=cache,
+                progress=progress,
+            )
+        if trained and not dry:
+            version = registry.save(artifact, n_train=min(count, opts["train_sample"]), n_scored=stats["n"],
+                                    fraction=frac)
+            self.stdout.write(self.style.SUCCESS(f"Saved risk model v{version} to {registry.root}"))
+        n = stats["n"]
+        cutoff = artifact["cutoff"]
 
-        now = timezone.now()
         if dry:
+            skip_note = f" (skipping {skipped} unchanged)" if incremental else ""
+            score0, high0 = stats["first"]
             self.stdout.write(self.style.HTTP_INFO(
-                f"[DRY RUN] Would score {n} patients. "
+                f"[DRY RUN] Would score {n} patients{skip_note}. "
                 f"HighRisk fraction={frac:.2%} (cutoff={cutoff:.3f}). "
-                f"Sample: score={scores[0]:.3f}, high={bool(high_flags[0])}"
+                f"Sample: score={score0:.3f}, high={high0}"
             ))
             return
 
-        # Write outcomes
-        to_create = [
-            RiskScore(
-                Patient_id_id=int(pid),
-                Score=float(s),
-                HighRisk=bool(h),
-                Scored_at=now
-            )
-            for pid, s, h in zip(df["Patient_id"].values, scores, high_flags)
-        ]
-        RiskScore.objects.bulk_create(to_create, batch_size=1000)
-
-        low = float(np.mean(~high_flags))
-        high = float(np.mean(high_flags))
+        high = stats["high"] / n if n else 0.0
+        low = 1.0 - high if n else 0.0
         self.stdout.write(self.style.SUCCESS(
-            f"Wrote {len(to_create)} RiskScore rows @ {now.isoformat()}. "
+            f"Wrote {n} RiskScore rows @ {now.isoformat()}. "
             f"HighRisk {high:.1%} • NotHigh {low:.1%} (cutoff={cutoff:.3f})"
+            + (f". Skipped {skipped} patients with unchanged labs." if incremental else "")
         ))
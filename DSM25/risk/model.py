@@ -0,0 +1,148 @@
+"""
+Fit and apply the diabetes risk model (StandardScaler + IsolationForest).
+
+Training stores the normalization bounds and HighRisk cutoff it derived from
+the training population next to the fitted estimators, so scoring with a saved
+artifact is pure inference and gives the same score for the same labs.
+"""
+import numpy as np
+from sklearn.ensemble import IsolationForest
+from sklearn.preprocessing import StandardScaler
+
+from core.registry import ModelRegistry
+from risk.features import FEATURES
+
+registry = ModelRegistry("risk")
+
+
+def fit_estimators(X, fraction):
+    """Fit scaler + IsolationForest on X; the returned artifact still needs `calibrate(...)`."""
+    scaler = StandardScaler()
+    Xs = scaler.fit_transform(_as_float64(X))
+
+    model = IsolationForest(contamination=fraction, random_state=42)
+    model.fit(Xs)
+    return {
+        "scaler": scaler,
+        "model": model,
+        "features": list(FEATURES),
+        "fraction": fraction,
+        "score_min": None,
+        "score_max": None,
+        "cutoff": None,
+    }
+
+
+def raw_scores(artifact, X):
+    # Scores: IsolationForest decision_function → higher = less anomalous.
+    # We invert so higher = higher risk; normalize_scores() maps these to 0..1.
+    if artifact["features"] != list(FEATURES):
+        raise ValueError(f"Model was trained on features {artifact['features']}, current spec is {FEATURES}")
+    return -artifact["model"].decision_function(artifact["scaler"].transform(_as_float64(X)))
+
+
+def calibrate(artifact, lo, hi, kth_raw):
+    """Store min-max bounds and the HighRisk cutoff (k-th largest raw score of the population)."""
+    artifact["score_min"], artifact["score_max"] = float(lo), float(hi)
+    artifact["cutoff"] = float(_normalize(np.array([kth_raw], dtype=np.float64), lo, hi)[0])
+    return artifact
+
+
+def normalize_scores(artifact, inv):
+    """Raw scores -> (scores in 0..1, high flags); patients beyond the training extremes clip to 0/1."""
+    scores = np.clip(_normalize(inv, artifact["score_min"], artifact["score_max"]), 0.0, 1.0)
+    return scores, scores >= artifact["cutoff"]
+
+
+def top_k(n, fraction):
+    # Top fraction as HighRisk
+    return max(1, int(round(fraction * n)))
+
+
+def compile_forest(artifact):
+    """
+    Flatten the fitted scaler + IsolationForest into plain arrays so a handful of
+    rows can be scored without sklearn's per-call validation and per-tree loop
+    (milliseconds for a single row). All trees are walked at once, one level per
+    step. Returns None when the result would not match `raw_scores` exactly, or
+    when the fitted trees do not have the (partly private) sklearn attributes it
+    reads, so callers fall back to `raw_scores`.
+    """
+    try:
+        compiled = _flatten_forest(artifact["scaler"], artifact["model"])
+    except AttributeError:
+        return None
+
+    # Probe rows spread around the training population: anything but an exact match -> use sklearn
+    scaler = artifact["scaler"]
+    probe = np.random.default_rng(0).normal(scaler.mean_, 3 * scaler.scale_, size=(256, len(scaler.mean_)))
+    if not np.array_equal(compiled_raw_scores(compiled, probe), raw_scores(artifact, probe)):
+        return None
+    return compiled
+
+
+def _flatten_forest(scaler, model):
+    feature, threshold, left, right, leaf_value, roots = [], [], [], [], [], []
+    offset, depth = 0, 0
+    for tree_idx, (est, cols) in enumerate(zip(model.estimators_, model.estimators_features_)):
+        t = est.tree_
+        nodes = np.arange(t.node_count)
+        leaf = t.children_left == -1
+        roots.append(offset)
+        feature.append(np.where(leaf, 0, np.asarray(cols)[np.maximum(t.feature, 0)]))
+        threshold.append(t.threshold)
+        left.append(np.where(leaf, nodes, t.children_left) + offset)
+        right.append(np.where(leaf, nodes, t.children_right) + offset)
+        # Same per-leaf term IsolationForest adds up per tree
+        leaf_value.append(model._decision_path_lengths[tree_idx] + model._average_path_length_per_tree[tree_idx] - 1.0)
+        offset += t.node_count
+        depth = max(depth, t.max_depth)
+
+    return {
+        "mean": scaler.mean_, "scale": scaler.scale_,
+        "feature": np.concatenate(feature), "threshold": np.concatenate(threshold),
+        "left": np.concatenate(left), "right": np.concatenate(right),
+        "leaf_value": np.concatenate(leaf_value), "roots": np.array(roots), "depth": depth,
+        # score_samples() = -2 ** (-depths / denominator); decision_function() subtracts offset_
+        "denominator": _path_length_denominator(model), "offset": model.offset_,
+    }
+
+
+def compiled_raw_scores(compiled, X):
+    """`raw_scores` through a `compile_forest` result."""
+    Xs = ((_as_float64(X) - compiled["mean"]) / compiled["scale"]).astype(np.float32).astype(np.float64)
+    rows = np.arange(len(Xs))[:, None]
+    nodes = np.broadcast_to(compiled["roots"], (len(Xs), len(compiled["roots"])))
+    for _ in range(compiled["depth"]):
+        go_left = Xs[rows, compiled["feature"][nodes]] <= compiled["threshold"][nodes]
+        nodes = np.where(go_left, compiled["left"][nodes], compiled["right"][nodes])
+    values = compiled["leaf_value"][nodes]
+    depths = np.zeros(len(Xs))
+    for t in range(values.shape[1]):  # tree by tree, the order sklearn sums in
+        depths += values[:, t]
+    return -(-(2 ** -(depths / compiled["denominator"])) - compiled["offset"])
+
+
+def _path_length_denominator(model):
+    # n_trees * average path length of an unsuccessful BST search over max_samples points
+    n = model.max_samples_
+    if n <= 1:
+        c = 0.0
+    elif n == 2:
+        c = 1.0
+    else:
+        c = 2.0 * (np.log(n - 1.0) + np.euler_gamma) - 2.0 * (n - 1.0) / n
+    return len(model.estimators_) * c
+
+
+def _normalize(inv, lo, hi):
+    out = inv - lo
+    if hi - lo > 0:
+        out /= hi - lo
+    return out
+
+
+def _as_float64(X):
+    # Features are stored float32; scale in float64 so split decisions match the
+    # float64 pipeline the model was fitted with (IsolationForest then casts to float32 itself)
+    return np.asarray(X, dtype=np.float64)
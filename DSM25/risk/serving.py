@@ -0,0 +1,97 @@
+"""
+Online scoring of single patients with the saved risk model.
+
+The current registry version is loaded once per process and swapped only when
+a different version is promoted (one small file read per request), so online
+scores use the same scaler, forest, normalization bounds and HighRisk cutoff
+as the last batch run and are directly comparable with RiskScore rows.
+"""
+import threading
+
+import numpy as np
+
+from core.models import Patient_lab
+from risk.features import FEATURE_FIELDS, FEATURES, fill_block
+from risk.model import compile_forest, compiled_raw_scores, normalize_scores, raw_scores, registry
+
+_lock = threading.Lock()
+_loaded = None  # (version, artifact, compiled forest or None)
+
+# Accepted names for raw lab values: the Patient_lab field or the FEATURES label
+_FIELD_ALIASES = {**{f: f for f in FEATURE_FIELDS}, **dict(zip(FEATURES, FEATURE_FIELDS))}
+
+
+class LabValueError(ValueError):
+    pass
+
+
+def current_model():
+    """(version, artifact, compiled) for the promoted model; raises ArtifactNotFound if none is saved."""
+    global _loaded
+    version = registry.current()
+    loaded = _loaded
+    if loaded is None or loaded[0] != version:
+        with _lock:
+            if _loaded is None or _loaded[0] != version:
+                artifact, manifest = registry.load(version)
+                _loaded = (manifest["version"], artifact, compile_forest(artifact))
+            loaded = _loaded
+    return loaded
+
+
+def latest_lab_row(patient_id):
+    """(Patient_id, id, *FEATURE_FIELDS) of the patient's latest lab, or None."""
+    return (
+        Patient_lab.objects.filter(latestlab__Patient_id=patient_id)
+        .values_list("Patient_id", "id", *FEATURE_FIELDS)
+        .first()
+    )
+
+
+def lab_values_row(values):
+    """Row tuple like latest_lab_row's from a {field or feature name: value} mapping (missing -> default)."""
+    unknown = set(values) - set(_FIELD_ALIASES)
+    if unknown:
+        raise LabValueError(f"Unknown lab fields: {', '.join(sorted(unknown))}")
+    fields = {_FIELD_ALIASES[k]: v for k, v in values.items()}
+    row = [None, None]
+    for field in FEATURE_FIELDS[:-1]:
+        row.append(_number(field, fields.get(field)))
+    activity = fields.get(FEATURE_FIELDS[-1])
+    if activity is not None and not isinstance(activity, str):
+        raise LabValueError(f"{FEATURE_FIELDS[-1]} must be a string, got {activity!r}")
+    row.append(activity)
+    return tuple(row)
+
+
+def _number(field, v):
+    # JSON numbers/booleans, or query-string text ("27.5", "true")
+    if v is None or v == "":
+        return None
+    if isinstance(v, str):
+        v = {"true": 1, "yes": 1, "false": 0, "no": 0}.get(v.strip().lower(), v)
+    try:
+        v = float(v)
+    except (TypeError, ValueError):
+        raise LabValueError(f"{field} must be a number, got {v!r}")
+    if not np.isfinite(v):
+        raise LabValueError(f"{field} must be finite, got {v!r}")
+    return v
+
+
+def score_row(row):
+    """Score one lab row tuple with the current model; returns a JSON-ready dict."""
+    version, artifact, compiled = current_model()
+    X = np.empty((1, len(FEATURES)), dtype=np.float32)
+    fill_block(X, [(0, 0, *row[2:])])  # same mapping/imputation as batch extraction; ids may be None here
+    inv = compiled_raw_scores(compiled, X) if compiled is not None else raw_scores(artifact, X)
+    scores, high = normalize_scores(artifact, inv)
+    return {
+        "patient_id": row[0],
+        "lab_id": row[1],
+        "score": float(scores[0]),
+        "high_risk": bool(high[0]),
+        "cutoff": artifact["cutoff"],
+        "model_version": version,
+        "features": dict(zip(FEATURES, X[0].tolist())),
+    }
@@ -1,3 +1,380 @@
-from django.test import TestCase
+import copy
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import CurrentRiskScore, Customer, Patient_lab, RiskScore, RiskScoreSummary
+from risk import engine, features
+from risk.cache import FeatureCache
+from risk.history import compact_before, upsert_current
+from risk.model import (calibrate, compile_forest, compiled_raw_scores, fit_estimators, normalize_scores, raw_scores,
+                        registry)
+from risk.features import ACTIVITY_MAP, DEFAULTS, FEATURE_FIELDS, FEATURES, fill_block, iter_feature_chunks
+
+# (Age, BMI, Systolic_BP, Diastolic_BP, Total_Cholesterol, HDL, LDL, Triglycerides, Smoking, Activity)
+LAB_VALUES = [
+    (61, 27.5, 130, 85, 210, 45, 130, 160, True, "Low"),
+    (45, 0, 0, 80, 190, 50, 110, 0, False, " moderate "),
+    (38, 22.4, 118, 0, 175, 0, 95, 120, False, "high"),
+    (70, 31.2, 145, 90, 0, 40, 0, 200, True, ""),
+    (52, 25.0, 122, 79, 185, 55, 105, 130, False, "unknown"),
+]
+
+
+def make_labs(values=LAB_VALUES):
+    labs = []
+    for i, row in enumerate(values):
+        customer = Customer.objects.create(CustFirstName=f"P{i}", CustLastName="Test", CustMiddleInit="",
+                                           CustSuffix="", Gender="female")
+        labs.append(Patient_lab.objects.create(Patient_id=customer, **dict(zip(FEATURE_FIELDS, row))))
+    return labs
+
+
+def reference_row(lab):
+    # The per-instance extraction this replaced: `value or default`, activity via ACTIVITY_MAP
+    row = [float(getattr(lab, f) or d) for f, d in zip(FEATURE_FIELDS[:-1], DEFAULTS[:-1])]
+    row.append(float(ACTIVITY_MAP.get((lab.Physical_activity or "").strip().lower(), 0)))
+    return row
+
+
+class FeatureExtractionTests(TestCase):
+    def setUp(self):
+        self.labs = make_labs()
+
+    def test_matches_per_row_extraction(self):
+        chunks = list(iter_feature_chunks(Patient_lab.objects.order_by("id"), chunk_size=2))
+        self.assertEqual([len(X) for _, _, X in chunks], [2, 2, 1])
+        patient_ids, lab_ids, X = (np.concatenate(c) for c in zip(*chunks))
+        self.assertEqual(X.dtype, np.float32)
+        self.assertEqual(X.shape, (len(self.labs), len(FEATURES)))
+        self.assertEqual(lab_ids.tolist(), [lab.id for lab in self.labs])
+        self.assertEqual(patient_ids.tolist(), [lab.Patient_id_id for lab in self.labs])
+        np.testing.assert_array_equal(X, np.array([reference_row(lab) for lab in self.labs], dtype=np.float32))
+
+    def test_empty_queryset_yields_nothing(self):
+        self.assertEqual(list(iter_feature_chunks(Patient_lab.objects.none())), [])
+
+    def test_fill_block_imputes_missing_values(self):
+        out = np.empty((1, len(FEATURES)), dtype=np.float32)
+        patient_ids, lab_ids = fill_block(out, [(7, 9, None, None, 0, None, None, None, None, None, None, None)])
+        self.assertEqual((patient_ids.tolist(), lab_ids.tolist()), ([7], [9]))
+        np.testing.assert_array_equal(out[0], DEFAULTS)
+
+
+class FeatureCacheTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache = FeatureCache(root=tmp.name)
+        self.labs = make_labs()
+
+    def assertMatchesDb(self):
+        want = [np.concatenate(c) for c in zip(*iter_feature_chunks(Patient_lab.objects.order_by("id")))]
+        for got, expected in zip(self.cache.arrays(), want):
+            np.testing.assert_array_equal(got, expected)
+
+    def test_new_labs_are_appended(self):
+        self.assertEqual(self.cache.sync(), {"rows": 5, "appended": 5, "rebuilt": True})
+        self.assertEqual(self.cache.sync(), {"rows": 5, "appended": 0, "rebuilt": False})
+        make_labs(LAB_VALUES[:2])
+        self.assertEqual(self.cache.sync(), {"rows": 7, "appended": 2, "rebuilt": False})
+        self.assertMatchesDb()
+
+    def test_deleted_lab_below_the_watermark_rebuilds(self):
+        self.cache.sync()
+        self.labs[1].delete()
+        self.assertEqual(self.cache.sync(), {"rows": 4, "appended": 4, "rebuilt": True})
+        self.assertMatchesDb()
+
+    def test_cache_of_another_database_rebuilds(self):
+        self.cache.sync()
+        with open(self.cache.path("meta.json")) as f:
+            meta = json.load(f)
+        with open(self.cache.path("meta.json"), "w") as f:
+            json.dump({**meta, "db": "/elsewhere/db.sqlite3"}, f)
+        self.assertTrue(self.cache.sync()["rebuilt"])
+        self.assertTrue(self.cache.sync(rebuild=True)["rebuilt"])
+        self.assertMatchesDb()
+
+    def test_feature_spec_change_moves_to_a_new_cache(self):
+        with override_settings(ARTIFACTS_DIR=self.cache.root):
+            before = FeatureCache().root
+            with mock.patch.object(features, "FEATURE_SPEC_REVISION", features.FEATURE_SPEC_REVISION + 1):
+                self.assertNotEqual(FeatureCache().root, before)
+            with mock.patch.dict(features.ACTIVITY_MAP, {"vigorous": 3}):
+                self.assertNotEqual(FeatureCache().root, before)
+
+    def test_labs_newer_than_the_sync_are_read_from_the_db(self):
+        self.cache.sync()
+        newer = make_labs(LAB_VALUES[2:3])[0]
+        labs = Patient_lab.objects.order_by("id")
+        got = [np.concatenate(c) for c in zip(*self.cache.chunks(labs, chunk_size=4))]
+        want = [np.concatenate(c) for c in zip(*iter_feature_chunks(labs))]
+        self.assertEqual(got[1][-1], newer.id)
+        for g, w in zip(got, want):
+            np.testing.assert_array_equal(g, w)
+
+
+class KthLargestTests(SimpleTestCase):
+    def check(self, values, ks, chunk_size=1000):
+        for k in ks:
+            with self.subTest(k=k):
+                want = np.partition(values, -k)[-k]
+                self.assertEqual(engine.kth_largest(values, k, values.min(), values.max(), chunk_size), want)
+
+    def test_matches_partition_when_every_value_fits_in_memory(self):
+        values = np.random.default_rng(1).normal(size=5000)
+        self.check(values, [1, 2, 250, 4999, 5000])
+
+    def test_matches_partition_after_narrowing_the_window(self):
+        rng = np.random.default_rng(2)
+        # Skewed, with ties and a dense cluster, so several histogram rounds run
+        values = np.concatenate([rng.exponential(size=20000), np.full(3000, 0.5), rng.normal(3, 1e-6, 2000)])
+        rng.shuffle(values)
+        with mock.patch.object(engine, "SELECT_LIMIT", 100):
+            self.check(values, [1, 7, 1000, 2000, 2500, 5000, 12345, len(values)], chunk_size=777)
+
+    def test_reads_a_memory_mapped_array(self):
+        values = np.random.default_rng(3).uniform(-1, 1, 10000)
+        with tempfile.TemporaryDirectory() as tmp:
+            mm = np.lib.format.open_memmap(os.path.join(tmp, "raw.npy"), mode="w+", dtype=np.float64,
+                                           shape=values.shape)
+            mm[:] = values
+            with mock.patch.object(engine, "SELECT_LIMIT", 50):
+                self.check(mm, [1, 500, 9999], chunk_size=1024)
+            del mm
+
+    def test_constant_values(self):
+        self.check(np.full(100, 0.25), [1, 50, 100])
+
+
+# Scores chunks in spawned workers from an interpreter where Django was never set up
+SPAWN_SCRIPT = """
+import multiprocessing
+import numpy as np
+from risk.engine import scored_chunks
+from risk.features import FEATURES
+from risk.model import fit_estimators
+
+multiprocessing.set_start_method("spawn")
+X = np.random.default_rng(0).normal(size=(300, len(FEATURES))).astype(np.float32)
+artifact = fit_estimators(X, 0.05)
+chunks = [(np.arange(i, i + 100), np.arange(i, i + 100), X[i:i + 100]) for i in range(0, 300, 100)]
+serial = np.concatenate([inv for _, _, inv in scored_chunks(chunks, artifact)])
+pooled = np.concatenate([inv for _, _, inv in scored_chunks(chunks, artifact, workers=2)])
+assert np.array_equal(serial, pooled)
+"""
+
+
+class ScoringPoolTests(SimpleTestCase):
+    def test_spawned_workers_score_without_django(self):
+        env = {k: v for k, v in os.environ.items() if k != "DJANGO_SETTINGS_MODULE"}
+        proc = subprocess.run([sys.executable, "-c", SPAWN_SCRIPT], cwd=settings.BASE_DIR, env=env,
+                              capture_output=True, text=True, timeout=120)
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+
+
+class CompactionTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.cutoff = self.now - timedelta(days=90)
+        self.a, self.b, self.c = (
+            Customer.objects.create(CustFirstName=name, CustLastName="Test", CustMiddleInit="", CustSuffix="",
+                                    Gender="female")
+            for name in ("A", "B", "C")
+        )
+        # A: three old runs and a recent current one
+        self.runs(self.a, [(200, 0.2, False), (150, 0.9, True), (100, 0.5, False), (10, 0.4, False)])
+        # B: never got a CurrentRiskScore row; its newest run is old
+        self.runs(self.b, [(300, 0.3, False), (120, 0.6, True)], current=False)
+        # C: compacted before, one old run left and a recent current one
+        self.runs(self.c, [(180, 0.7, True), (5, 0.1, False)])
+        RiskScoreSummary.objects.create(
+            Patient_id=self.c, Runs=2, High_runs=0, Min_score=0.05, Max_score=0.3, Last_score=0.3,
+            Last_high=False, First_scored_at=self.now - timedelta(days=400),
+            Last_scored_at=self.now - timedelta(days=350),
+        )
+
+    def runs(self, patient, runs, current=True):
+        scores = [RiskScore.objects.create(Patient_id=patient, Score=score, HighRisk=high,
+                                           Scored_at=self.now - timedelta(days=days))
+                  for days, score, high in runs]
+        if current:
+            upsert_current(scores[-1:])
+
+    def test_dry_run_counts_the_rows_a_real_run_deletes(self):
+        before = RiskScore.objects.count()
+        rows, patients = compact_before(self.cutoff, patients_per_batch=1, dry_run=True)
+        self.assertEqual(RiskScore.objects.count(), before)
+        self.assertEqual(RiskScoreSummary.objects.count(), 1)
+
+        self.assertEqual(compact_before(self.cutoff, patients_per_batch=1), (rows, patients))
+        self.assertEqual((rows, patients), (3 + 1 + 1, 3))
+        self.assertEqual(RiskScore.objects.count(), before - rows)
+
+    def test_rollups_merge_with_earlier_summaries(self):
+        compact_before(self.cutoff)
+        a = RiskScoreSummary.objects.get(Patient_id=self.a)
+        self.assertEqual((a.Runs, a.High_runs, a.Min_score, a.Max_score), (3, 1, 0.2, 0.9))
+        self.assertEqual((a.Last_score, a.Last_high), (0.5, False))
+        self.assertEqual(a.First_scored_at, self.now - timedelta(days=200))
+        self.assertEqual(a.Last_scored_at, self.now - timedelta(days=100))
+
+        c = RiskScoreSummary.objects.get(Patient_id=self.c)
+        self.assertEqual((c.Runs, c.High_runs, c.Min_score, c.Max_score), (3, 1, 0.05, 0.7))
+        self.assertEqual((c.Last_score, c.Last_high), (0.7, True))
+        self.assertEqual(c.First_scored_at, self.now - timedelta(days=400))
+        self.assertEqual(c.Last_scored_at, self.now - timedelta(days=180))
+
+        # Nothing left to fold
+        self.assertEqual(compact_before(self.cutoff), (0, 0))
+
+    def test_current_run_is_kept(self):
+        compact_before(self.cutoff)
+        for patient in (self.a, self.c):
+            kept = RiskScore.objects.filter(Patient_id=patient)
+            self.assertEqual(list(kept.values_list("Scored_at", flat=True)),
+                             [CurrentRiskScore.objects.get(Patient_id=patient).Scored_at])
+
+    def test_patient_without_a_current_row_keeps_its_newest_run(self):
+        self.assertFalse(CurrentRiskScore.objects.filter(Patient_id=self.b).exists())
+        compact_before(self.cutoff)
+        b = RiskScoreSummary.objects.get(Patient_id=self.b)
+        self.assertEqual((b.Runs, b.Last_score), (1, 0.3))
+        kept = RiskScore.objects.filter(Patient_id=self.b)
+        self.assertEqual(list(kept.values_list("Score", flat=True)), [0.6])
+
+
+class CompiledForestTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = np.random.default_rng(4)
+        cls.X = rng.normal(DEFAULTS + 1, DEFAULTS / 5 + 1, size=(2000, len(FEATURES))).astype(np.float32)
+        artifact = fit_estimators(cls.X, 0.05)
+        inv = raw_scores(artifact, cls.X)
+        cls.artifact = calibrate(artifact, inv.min(), inv.max(), np.partition(inv, -100)[-100])
+
+    def test_matches_decision_function(self):
+        compiled = compile_forest(self.artifact)
+        self.assertIsNotNone(compiled)
+        held_out = np.random.default_rng(5).normal(DEFAULTS, DEFAULTS / 2 + 1, size=(500, len(FEATURES)))
+        for X in (self.X, held_out.astype(np.float32), self.X[:1]):
+            want = -self.artifact["model"].decision_function(
+                self.artifact["scaler"].transform(X.astype(np.float64)))
+            np.testing.assert_array_equal(compiled_raw_scores(compiled, X), want)
+
+    def test_falls_back_without_private_attributes(self):
+        artifact = dict(self.artifact, model=copy.deepcopy(self.artifact["model"]))
+        del artifact["model"]._decision_path_lengths
+        self.assertIsNone(compile_forest(artifact))
+
+
+class RiskQueueViewTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        scores = []
+        for i, (score, high) in enumerate([(0.9, True), (0.2, False), (0.7, True)]):
+            patient = Customer.objects.create(CustFirstName=f"P{i}", CustLastName="Test", CustMiddleInit="",
+                                              CustSuffix="", Gender="female")
+            scores.append(RiskScore.objects.create(Patient_id=patient, Score=score, HighRisk=high, Scored_at=now))
+        upsert_current(scores)
+
+    def test_export_streams_every_filtered_row(self):
+        response = self.client.get(reverse("risk_queue_export"), {"high": "1", "order": "score_asc"})
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "patient_id,first_name,last_name,gender,score,high_risk,scored_at")
+        self.assertEqual([line.split(",")[1:5] for line in lines[1:]],
+                         [["P2", "Test", "female", "0.7"], ["P0", "Test", "female", "0.9"]])
+
+    def test_page_size_outside_the_options_falls_back(self):
+        for raw, want in [("50", 50), ("100000", 25), ("-1", 25)]:
+            with self.subTest(raw=raw):
+                response = self.client.get(reverse("risk_queue"), {"page_size": raw})
+                self.assertEqual(response.context["page_size"], want)
+                self.assertEqual(response.context["paginator"].per_page, want)
+
+
+class ScoreDiabetesCommandTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings = override_settings(ARTIFACTS_DIR=tmp.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        rng = np.random.default_rng(6)
+        make_labs([(int(rng.integers(30, 80)), float(rng.normal(27, 4)), int(rng.normal(125, 15)), 80,
+                    int(rng.normal(190, 30)), 50, 110, int(rng.normal(150, 40)), bool(i % 3 == 0), "low")
+                   for i in range(40)])
+
+    def score(self, **opts):
+        out = io.StringIO()
+        call_command("score_diabetes", stdout=out, **opts)
+        return out.getvalue()
+
+    def test_plain_runs_reuse_the_current_model(self):
+        self.assertIn("Saved risk model v1", self.score())
+        out = self.score()
+        self.assertIn("Scoring with saved model v1", out)
+        self.assertEqual(registry.versions(), [1])
+        self.assertEqual(RiskScore.objects.count(), 80)
+
+        self.assertIn("Saved risk model v2", self.score(retrain=True))
+        self.assertEqual(registry.current(), 2)
+
+    def test_incremental_run_scores_only_patients_with_new_labs(self):
+        self.score()
+        artifact, _ = registry.load()
+        first = dict(CurrentRiskScore.objects.values_list("Patient_id", "Lab"))
+        patient = Customer.objects.order_by("Cust_id")[3]
+        newer = Patient_lab.objects.create(Patient_id=patient, **dict(zip(FEATURE_FIELDS, LAB_VALUES[0])))
+
+        out = self.score(incremental=True)
+        self.assertIn("Scoring with saved model v1", out)
+        self.assertIn(f"Skipped {len(first) - 1} patients", out)
+        self.assertEqual(registry.versions(), [1])
+        self.assertEqual(RiskScore.objects.count(), len(first) + 1)
+        rescored = CurrentRiskScore.objects.get(Patient_id=patient)
+        self.assertEqual(rescored.Lab_id, newer.id)
+        self.assertEqual(dict(CurrentRiskScore.objects.exclude(Patient_id=patient).values_list("Patient_id", "Lab")),
+                         {pid: lab for pid, lab in first.items() if pid != patient.pk})
+
+        # The saved model scores the new lab exactly as it would in-process
+        scores, high = normalize_scores(artifact, raw_scores(artifact, np.array([reference_row(newer)], np.float32)))
+        self.assertAlmostEqual(rescored.Score, float(scores[0]))
+        self.assertEqual(rescored.HighRisk, bool(high[0]))
+        self.assertIn("No patients with new labs", self.score(incremental=True))
+
+    def test_score_only_needs_a_saved_model(self):
+        with self.assertRaisesMessage(CommandError, "train one first"):
+            self.score(score_only=True)
+        self.assertFalse(RiskScore.objects.exists())
+
+    def test_fraction_only_applies_when_training(self):
+        self.score()
+        for opts in ({"score_only": True}, {}, {"incremental": True}):
+            with self.subTest(**opts), self.assertRaisesMessage(CommandError, "add --retrain"):
+                self.score(fraction=0.1, **opts)
+        self.score(fraction=0.05, score_only=True)  # the model's own fraction is not a conflict
+
+        self.score(fraction=0.1, retrain=True)
+        artifact, _ = registry.load()
+        self.assertEqual(artifact["fraction"], 0.1)
+
+    def test_retrain_conflicts_with_scoring_a_saved_model(self):
+        for opts in ({"score_only": True}, {"incremental": True}, {"model_version": 1}):
+            with self.subTest(**opts), self.assertRaises(CommandError):
+                self.score(retrain=True, **opts)
@@ -1,6 +1,8 @@
 from django.urls import path
-from .views import risk_queue
+from .views import risk_queue, risk_queue_export, risk_score_api
 
 urlpatterns = [
     path("diabetes_risk/", risk_queue, name="risk_queue"),
+    path("diabetes_risk/export.csv", risk_queue_export, name="risk_queue_export"),
+    path("diabetes_risk/score/", risk_score_api, name="risk_score_api"),
 ]
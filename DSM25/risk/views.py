@@ -1,29 +1,27 @@
+import json
+
+from django.http import JsonResponse
 from django.shortcuts import render
-from core.models import RiskScore
-from django.db.models.expressions import Window
-from django.db.models.functions import RowNumber
-from django.db.models import F, Q
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from core.models import CurrentRiskScore
+from core.registry import ArtifactNotFound
+from core.queues import EXPORT_CHUNK, PAGE_SIZE_OPTIONS, csv_response, page_size_from
+from django.db.models import Q
 from django.core.paginator import Paginator
+from risk import serving
 
 # Create your views here.
 def _latest_scores_qs():
     """
-    Return a queryset of the LATEST RiskScore per patient using a window function.
-    Works on SQLite 3.25+ (ships with recent Python).
+    Return a queryset of the LATEST RiskScore per patient: the one-row-per-patient
+    CurrentRiskScore table score_diabetes keeps up to date (same field names).
     """
-    return (
-        RiskScore.objects.select_related("Patient_id")
-        .annotate(
-            rn=Window(
-                expression=RowNumber(),
-                partition_by=[F("Patient_id")],
-                order_by=[F("Scored_at").desc(), F("id").desc()],
-            )
-        )
-        .filter(rn=1)
-    )
+    return CurrentRiskScore.objects.select_related("Patient_id")
 
-def risk_queue(request):
+def _filtered_scores(request):
+    """Latest scores narrowed and ordered by the page's query params; returns (qs, params)."""
     qs = _latest_scores_qs()
 
     # --- Filters from query params ---
@@ -57,19 +55,79 @@ def risk_queue(request):
     }.get(order or "score_desc", ("-Score",))
     qs = qs.order_by(*ordering)
 
+    params = {
+        "search": search or "",
+        "high": (high or ""),
+        "min_score": (min_score or ""),
+        "order": order or "score_desc",
+    }
+    return qs, params
+
+def risk_queue(request):
+    qs, params = _filtered_scores(request)
+
     # Pagination
-    page_size = int(request.GET.get("page_size") or 25)
+    page_size = page_size_from(request)
     paginator = Paginator(qs, page_size)
     page_obj = paginator.get_page(request.GET.get("page"))
 
     ctx = {
         "page_obj": page_obj,
         "paginator": paginator,
-        "search": search or "",
-        "high": (high or ""),
-        "min_score": (min_score or ""),
-        "order": order or "score_desc",
+        **params,
         "page_size": page_size,
     }
-    ctx['page_size_options'] = ['25', '50', '100']
-    return render(request, "risk/risk_queue.html", ctx)
\ No newline at end of file
+    ctx['page_size_options'] = [str(n) for n in PAGE_SIZE_OPTIONS]
+    return render(request, "risk/risk_queue.html", ctx)
+
+def risk_queue_export(request):
+    # Same filters as the page, every matching row, streamed
+    qs, _ = _filtered_scores(request)
+    rows = qs.values_list(
+        "Patient_id__Cust_id", "Patient_id__CustFirstName", "Patient_id__CustLastName",
+        "Patient_id__Gender", "Score", "HighRisk", "Scored_at",
+    ).iterator(chunk_size=EXPORT_CHUNK)
+    return csv_response(
+        f"risk_queue_{timezone.now():%Y%m%d_%H%M%S}.csv",
+        ["patient_id", "first_name", "last_name", "gender", "score", "high_risk", "scored_at"],
+        rows,
+    )
+
+@csrf_exempt  # read-only JSON API: nothing is written
+@require_http_methods(["GET", "POST"])
+def risk_score_api(request):
+    """
+    Score one patient with the saved risk model.
+    GET ?patient_id=N or ?Age=..&BMI=..; POST {"patient_id": N} or {"labs": {...}}.
+    Lab keys are Patient_lab field or FEATURES names; missing values get the batch defaults.
+    """
+    if request.method == "POST":
+        try:
+            body = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse({"error": "Body must be JSON"}, status=400)
+        if not isinstance(body, dict):
+            return JsonResponse({"error": "Body must be a JSON object"}, status=400)
+        patient_id, labs = body.get("patient_id"), body.get("labs")
+    else:
+        params = request.GET.dict()
+        patient_id, labs = params.pop("patient_id", None), params
+
+    try:
+        if patient_id is not None:
+            try:
+                patient_id = int(patient_id)
+            except (TypeError, ValueError):
+                return JsonResponse({"error": "patient_id must be an integer"}, status=400)
+            row = serving.latest_lab_row(patient_id)
+            if row is None:
+                return JsonResponse({"error": f"No labs for patient {patient_id}"}, status=404)
+        elif isinstance(labs, dict) and labs:
+            row = serving.lab_values_row(labs)
+        else:
+            return JsonResponse({"error": "Provide patient_id or lab values"}, status=400)
+        return JsonResponse(serving.score_row(row))
+    except serving.LabValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    except ArtifactNotFound as e:
+        return JsonResponse({"error": str(e)}, status=503)